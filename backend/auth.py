@@ -1,28 +1,140 @@
 from flask import request, jsonify
 from functools import wraps
+from collections import OrderedDict, namedtuple
+import hashlib
+import threading
+import time
+import jwt
+from .config import Config
 from .supabase_client import supabase
 import logging
 
 logger = logging.getLogger(__name__)
 
+# What handlers get for a locally verified token; they only rely on .id
+TokenUser = namedtuple('TokenUser', ['id', 'email', 'role', 'claims'])
+
+class SigningKeyUnavailable(Exception):
+    """No local key material for this token; verification falls back to the auth server."""
+
+class VerifiedTokenCache:
+    """LRU of verified tokens; an entry never outlives the token's own expiry."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def put(self, token, user, expires_at):
+        if self.max_size <= 0 or expires_at <= time.time():
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_token_cache = VerifiedTokenCache(Config.AUTH_TOKEN_CACHE_SIZE)
+_jwks_client = None
+_jwks_lock = threading.Lock()
+
+def get_jwks_client():
+    global _jwks_client
+    if _jwks_client is None and Config.SUPABASE_JWKS_URL:
+        with _jwks_lock:
+            if _jwks_client is None:
+                # PyJWKClient keeps the fetched key set for AUTH_JWKS_TTL seconds
+                _jwks_client = jwt.PyJWKClient(Config.SUPABASE_JWKS_URL, cache_jwk_set=True, lifespan=Config.AUTH_JWKS_TTL)
+    return _jwks_client
+
+def signing_key_for(token):
+    algorithm = jwt.get_unverified_header(token).get('alg')
+    if algorithm == 'HS256':
+        if not Config.SUPABASE_JWT_SECRET:
+            raise SigningKeyUnavailable("SUPABASE_JWT_SECRET is not configured")
+        return Config.SUPABASE_JWT_SECRET, algorithm
+    if algorithm in ('RS256', 'ES256'):
+        client = get_jwks_client()
+        if not client:
+            raise SigningKeyUnavailable("No JWKS URL configured")
+        try:
+            return client.get_signing_key_from_jwt(token).key, algorithm
+        except Exception as e:
+            # Unknown kid or JWKS endpoint unreachable
+            raise SigningKeyUnavailable(str(e))
+    raise jwt.InvalidAlgorithmError(f"Unsupported token algorithm: {algorithm}")
+
+def verify_token_locally(token):
+    key, algorithm = signing_key_for(token)
+    claims = jwt.decode(
+        token, key, algorithms=[algorithm],
+        audience=Config.AUTH_JWT_AUDIENCE or None,
+        leeway=Config.AUTH_JWT_LEEWAY,
+        options={'require': ['exp', 'sub'], 'verify_aud': bool(Config.AUTH_JWT_AUDIENCE)},
+    )
+    return TokenUser(claims['sub'], claims.get('email'), claims.get('role'), claims), claims['exp']
+
+def verify_token_remotely(token):
+    user = supabase.auth.get_user(token)
+    if not user or not user.user:
+        return None, 0
+    # The auth server has vouched for the token, so its own exp bounds how long to trust that
+    expires_at = jwt.decode(token, options={'verify_signature': False}).get('exp', 0)
+    return user.user, expires_at
+
 def verify_token(token):
+    user = _token_cache.get(token)
+    if user:
+        return user
     try:
-        user = supabase.auth.get_user(token)
-        if user and user.user:
-            logging.info(f"Verified token for user ID: {user.user.id}")
-            return user.user
-        logging.warning("Token verification failed: User not found")
+        try:
+            user, expires_at = verify_token_locally(token)
+        except SigningKeyUnavailable as e:
+            logging.debug(f"Local token verification unavailable, asking the auth server: {str(e)}")
+            user, expires_at = verify_token_remotely(token)
+        if not user:
+            logging.warning("Token verification failed: User not found")
+            return None
+        _token_cache.put(token, user, expires_at)
+        logging.info(f"Verified token for user ID: {user.id}")
+        return user
+    except jwt.InvalidTokenError as e:
+        logging.warning(f"Token verification failed: {str(e)}")
         return None
     except Exception as e:
         logging.error(f"Token verification failed: {str(e)}")
         return None
 
-def token_required(f):
+def token_required(f, allow_query_token=False):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = None
         if 'Authorization' in request.headers:
             token = request.headers['Authorization'].split(" ")[1]
+        elif allow_query_token:
+            token = request.args.get('access_token')
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         try:
@@ -34,4 +146,8 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def stream_token_required(f):
+    # EventSource cannot send headers, so streaming endpoints also take ?access_token=
+    return token_required(f, allow_query_token=True)
+
 # Remove the auth_bp and other unnecessary functions
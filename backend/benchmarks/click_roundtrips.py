@@ -0,0 +1,57 @@
+"""Counts WebDriver round trips per click for the legacy and current Player click paths.
+
+Run with: python -m backend.benchmarks.click_roundtrips
+Importing the backend needs SUPABASE_URL/SUPABASE_KEY set (no request is sent) and an X display
+for pynput (or PYNPUT_BACKEND=dummy).
+"""
+import json
+import time
+
+from selenium.webdriver.common.action_chains import ActionChains
+from backend.player import Player
+from backend.benchmarks.fake_driver import FakeWebDriver, FakeSession
+
+CLICKS = 1000
+
+def legacy_perform_click(driver, x, y):
+    # Player.perform_click before the low-overhead dispatch path
+    window_size = driver.get_window_size()
+    actual_x = int(x * window_size['width'])
+    actual_y = int(y * window_size['height'])
+    driver.execute_script("/* show_click_indicator */", actual_x, actual_y)
+    actions = ActionChains(driver)
+    actions.move_by_offset(actual_x, actual_y).click().perform()
+    actions.move_by_offset(-actual_x, -actual_y).perform()
+
+def measure(label, click, driver):
+    driver.reset_counts()
+    started = time.perf_counter()
+    for i in range(CLICKS):
+        click(0.1 + (i % 80) / 100, 0.5)
+    elapsed = time.perf_counter() - started
+    return {
+        'path': label,
+        'round_trips_per_click': driver.round_trips / CLICKS,
+        'commands': dict(driver.commands),
+        'us_per_click': elapsed / CLICKS * 1e6,
+    }
+
+def run():
+    results = []
+
+    driver = FakeWebDriver()
+    results.append(measure('legacy', lambda x, y: legacy_perform_click(driver, x, y), driver))
+
+    for show_overlay in (True, False):
+        driver = FakeWebDriver()
+        player = Player('benchmark', {'actions': []}, session=FakeSession(driver), show_overlay=show_overlay)
+        player.driver = driver
+        if show_overlay:
+            player.install_click_indicator()
+        label = 'current (overlay)' if show_overlay else 'current (no overlay)'
+        results.append(measure(label, player.perform_click, driver))
+    return results
+
+if __name__ == '__main__':
+    for result in run():
+        print(json.dumps(result))
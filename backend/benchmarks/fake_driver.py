@@ -0,0 +1,61 @@
+import time
+from collections import Counter
+
+class FakeWebDriver:
+    """In-process stand-in for a Chrome WebDriver that counts every command it would send.
+
+    `latency` is slept on every command, `command_latency` overrides it per command name
+    (e.g. {'actions': 0.002}). `script_results` maps a substring of a script to the value
+    execute_script returns for it, or to a callable taking the script and its arguments.
+    """
+
+    def __init__(self, latency=0.0, window_size=(1920, 1080), command_latency=None, script_results=None):
+        self.latency = latency
+        self.command_latency = command_latency or {}
+        self.script_results = script_results or {}
+        self.window_size = {'width': window_size[0], 'height': window_size[1]}
+        # No debuggerAddress, so DevTools connections fall back to their polling paths
+        self.capabilities = {}
+        self.commands = Counter()
+
+    @property
+    def round_trips(self):
+        return sum(self.commands.values())
+
+    def reset_counts(self):
+        self.commands.clear()
+
+    def _round_trip(self, command):
+        self.commands[command] += 1
+        latency = self.command_latency.get(command, self.latency)
+        if latency:
+            time.sleep(latency)
+
+    # Used by ActionChains / ActionBuilder.perform()
+    def execute(self, driver_command, params=None):
+        self._round_trip(driver_command)
+        return {'value': None}
+
+    def execute_script(self, script, *args):
+        self._round_trip('executeScript')
+        for fragment, result in self.script_results.items():
+            if fragment in script:
+                return result(script, *args) if callable(result) else result
+        return None
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        self._round_trip('executeCdpCommand')
+        return {}
+
+    def get_window_size(self):
+        self._round_trip('getWindowRect')
+        return dict(self.window_size)
+
+    def quit(self):
+        self._round_trip('quit')
+
+class FakeSession:
+    # Player and Recorder only read .driver from a leased session; passing one also keeps them from
+    # provisioning a real profile clone for the fake driver
+    def __init__(self, driver):
+        self.driver = driver
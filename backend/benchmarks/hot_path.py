@@ -0,0 +1,253 @@
+"""Benchmarks the playback and recording hot paths against an in-process fake WebDriver.
+
+Run with: python -m backend.benchmarks.hot_path [--latency MS] [--sizes 10,1000] [--baseline FILE]
+
+Cases, each run for routines of 10 to 100k actions:
+  play          Player.start + Player.play with every action due at once (pure overhead)
+  play_timed    Player.play on a fixed-interval timeline, for timing drift; only sizes that finish
+                within --max-timed seconds
+  perform_click Player.perform_click in a loop
+  capture       Recorder listener capture plus the consumer thread, fed as one burst; events
+                beyond the ring's capacity show up as capture.dropped
+  calibrate     Calibrator.transform_coordinate per point, with transform_routine for comparison
+
+Every result has ops_per_s and us_per_op; peak_memory_kb comes from a second, tracemalloc-ed
+run so tracing doesn't distort the timings. Results are written as JSON (--output) and, with
+--baseline, compared against an earlier file: any case whose ops_per_s dropped by more than
+--tolerance makes the run exit non-zero.
+
+Logging below ERROR is disabled while measuring; per-action debug logging would otherwise
+dominate every number. Importing the backend needs SUPABASE_URL/SUPABASE_KEY set (no
+request is sent).
+"""
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import tracemalloc
+
+from backend.player import Player
+from backend.recorder import Recorder
+from backend.calibration import Calibrator
+from backend.routine_format import encode_routine, load_routine
+from backend.benchmarks.fake_driver import FakeWebDriver, FakeSession
+
+SIZES = (10, 100, 1_000, 10_000, 100_000)
+CASES = ('play', 'play_timed', 'perform_click', 'capture', 'calibrate')
+
+# Nine window-fraction points, slightly off the expected grid so the fitted models do real work
+CALIBRATION_POINTS = [
+    (0.01, 0.02), (0.51, 0.01), (0.99, 0.03),
+    (0.02, 0.49), (0.50, 0.51), (0.98, 0.50),
+    (0.01, 0.98), (0.49, 0.99), (0.99, 0.97),
+]
+
+def make_actions(count, interval=0.0):
+    return [{'type': 'click', 'time': i * interval, 'x': 0.1 + (i % 80) / 100, 'y': 0.5} for i in range(count)]
+
+def peak_memory_kb(run):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+def per_op(count, elapsed):
+    return {
+        'ops_per_s': round(count / elapsed, 1) if elapsed else None,
+        'us_per_op': round(elapsed / count * 1e6, 3),
+    }
+
+def bench_play(count, latency, interval=0.0):
+    # Stored form, so startup includes decoding the routine like a real run does
+    steps = encode_routine(make_actions(count, interval))
+    players = []
+    driver = FakeWebDriver(latency, script_results={
+        # End the session after the single pass instead of waiting for another start key
+        'Solo playback completed': lambda script, *args: players[0].signals.post('stop'),
+    })
+
+    started = time.perf_counter()
+    player = Player('benchmark', steps, session=FakeSession(driver))
+    players.append(player)
+    player.signals.post('start')
+    player.start()
+    startup = time.perf_counter() - started
+
+    driver.reset_counts()
+    started = time.perf_counter()
+    player.play()
+    elapsed = time.perf_counter() - started
+
+    duration = (count - 1) * interval
+    return dict(per_op(count, elapsed), **{
+        'startup_ms': round(startup * 1000, 3),
+        'startup_phases': {span['name']: span['duration_ms'] for span in player.trace.spans},
+        # Time spent beyond the recorded timeline, per action
+        'overhead_us_per_action': round(max(elapsed - duration, 0.0) / count * 1e6, 3),
+        'round_trips_per_action': round(driver.round_trips / count, 3),
+        'drift': player.scheduler.stats(),
+    })
+
+def bench_perform_click(count, latency):
+    driver = FakeWebDriver(latency)
+    player = Player('benchmark', {'actions': []}, session=FakeSession(driver))
+    player.driver = driver
+    started = time.perf_counter()
+    for i in range(count):
+        player.perform_click(0.1 + (i % 80) / 100, 0.5)
+    elapsed = time.perf_counter() - started
+    return dict(per_op(count, elapsed), round_trips_per_action=round(driver.round_trips / count, 3))
+
+def bench_capture(count, latency, timeout=60):
+    recorder = Recorder('benchmark', session=FakeSession(FakeWebDriver(latency)))
+    recorder.driver = recorder.session.driver
+    recorder.start_recording()
+    recorder.consumer = threading.Thread(target=recorder.consume, daemon=True)
+    recorder.consumer.start()
+
+    capture = recorder.mouse_channel.capture
+    started = time.perf_counter()
+    for i in range(count):
+        capture('click', 100 + i % 800, 500)
+    produced = time.perf_counter() - started
+
+    # Done once every event was either recorded or dropped by the full ring
+    deadline = time.monotonic() + timeout
+    while len(recorder.actions) + recorder.mouse_channel.events.dropped < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    recorder.finished.set()
+    recorder.consumer.join()
+
+    recorded = len(recorder.actions)
+    return dict(per_op(max(recorded, 1), elapsed), **{
+        'capture_us_per_event': round(produced / count * 1e6, 3),
+        'recorded': recorded,
+        'capture': recorder.capture_stats.snapshot((recorder.mouse_channel, recorder.keyboard_channel)),
+    })
+
+def bench_calibrate(count, latency):
+    calibrator = Calibrator(CALIBRATION_POINTS, CALIBRATION_POINTS, CALIBRATION_POINTS)
+    calibrator.calibrate()
+    actions = make_actions(count)
+
+    started = time.perf_counter()
+    for action in actions:
+        calibrator.transform_coordinate(action['x'], action['y'], mode='play')
+    elapsed = time.perf_counter() - started
+
+    routine = load_routine(actions)
+    routine_started = time.perf_counter()
+    calibrator.transform_routine(routine)
+    vectorized = time.perf_counter() - routine_started
+    return dict(per_op(count, elapsed), transform_routine_ms=round(vectorized * 1000, 3))
+
+def run_case(case, count, args):
+    latency = args.latency / 1000
+    if case == 'play':
+        run = lambda: bench_play(count, latency)
+    elif case == 'play_timed':
+        interval = args.interval / 1000
+        if count * interval > args.max_timed:
+            return None
+        run = lambda: bench_play(count, latency, interval)
+    elif case == 'perform_click':
+        run = lambda: bench_perform_click(count, latency)
+    elif case == 'capture':
+        run = lambda: bench_capture(count, latency)
+    else:
+        run = lambda: bench_calibrate(count, latency)
+
+    gc.collect()
+    result = {'case': case, 'actions': count}
+    result.update(run())
+    if not args.skip_memory:
+        result['peak_memory_kb'] = peak_memory_kb(run)
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def compare(results, baseline, tolerance):
+    """Cases whose throughput fell more than tolerance (a fraction) below the baseline."""
+    previous = {(result['case'], result['actions']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['case'], result['actions']))
+        if not before or not before.get('ops_per_s') or not result.get('ops_per_s'):
+            continue
+        change = result['ops_per_s'] / before['ops_per_s'] - 1
+        if change < -tolerance:
+            regressions.append({
+                'case': result['case'],
+                'actions': result['actions'],
+                'baseline_ops_per_s': before['ops_per_s'],
+                'ops_per_s': result['ops_per_s'],
+                'change': round(change, 3),
+            })
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES), help='comma-separated action counts')
+    parser.add_argument('--cases', default=','.join(CASES), help='comma-separated subset of ' + ', '.join(CASES))
+    parser.add_argument('--latency', type=float, default=0.0, help='fake WebDriver latency per command, ms')
+    parser.add_argument('--interval', type=float, default=2.0, help='action spacing for play_timed, ms')
+    parser.add_argument('--max-timed', type=float, default=5.0, help='longest timeline play_timed runs, seconds')
+    parser.add_argument('--skip-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', default='benchmark-results.json', help='where to write the JSON results')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed ops_per_s drop against the baseline')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    cases = [case for case in args.cases.split(',') if case]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        raise SystemExit(f"Unknown cases: {', '.join(sorted(unknown))}")
+
+    logging.disable(logging.WARNING)
+    results = []
+    for case in cases:
+        for count in sizes:
+            result = run_case(case, count, args)
+            if result:
+                print(json.dumps(result), flush=True)
+                results.append(result)
+    logging.disable(logging.NOTSET)
+
+    report = {
+        'created_at': time.time(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'latency_ms': args.latency, 'interval_ms': args.interval, 'max_timed_s': args.max_timed},
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for regression in report.get('regressions', []):
+        print(f"REGRESSION {regression['case']} x{regression['actions']}: "
+              f"{regression['baseline_ops_per_s']} -> {regression['ops_per_s']} ops/s ({regression['change']:+.0%})", file=sys.stderr)
+    return 1 if report.get('regressions') else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
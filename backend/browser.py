@@ -0,0 +1,91 @@
+import os
+import shutil
+import logging
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from urllib3.exceptions import HTTPError
+from .config import Config
+from .tracing import StartupTrace
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_WEB_URL = 'https://web.telegram.org/k/'
+
+class BrowserCrashed(WebDriverException):
+    """Raised in the player when the watchdog found its browser hung or gone."""
+
+# What a dead chromedriver looks like to its client: WebDriver errors, or the HTTP connection failing
+DRIVER_ERRORS = (WebDriverException, HTTPError, ConnectionError)
+
+def build_chrome_options(user_data_dir=None):
+    chrome_options = Options()
+    chrome_options.add_argument("--start-maximized")
+    chrome_options.add_argument("--disable-notifications")
+    chrome_options.add_argument("--disable-infobars")
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+
+    prefs = {"credentials_enable_service": False,
+             "profile.password_manager_enabled": False}
+    chrome_options.add_experimental_option("prefs", prefs)
+
+    # Defaults to the root chrome_user_data directory
+    user_data_dir = user_data_dir or Config.CHROME_USER_DATA_DIR
+    chrome_options.add_argument(f"user-data-dir={user_data_dir}")
+
+    if Config.CHROME_DISK_CACHE_DIR:
+        chrome_options.add_argument(f"--disk-cache-dir={prepare_disk_cache(user_data_dir)}")
+    if Config.CHROME_DISK_CACHE_SIZE:
+        chrome_options.add_argument(f"--disk-cache-size={Config.CHROME_DISK_CACHE_SIZE}")
+    if Config.BROWSER_PRELOAD_PAGE:
+        chrome_options.add_argument("--start-fullscreen")
+        # Opened as the startup tab, before the driver session even exists
+        chrome_options.add_argument(TELEGRAM_WEB_URL)
+
+    return chrome_options
+
+def prepare_disk_cache(user_data_dir):
+    cache_dir = os.path.join(Config.CHROME_DISK_CACHE_DIR, os.path.basename(os.path.normpath(user_data_dir)))
+    seed_dir = Config.CHROME_DISK_CACHE_SEED_DIR
+    if seed_dir and os.path.isdir(seed_dir) and not os.path.exists(cache_dir):
+        try:
+            shutil.copytree(seed_dir, cache_dir)
+            logger.info(f"Seeded disk cache {cache_dir} from {seed_dir}")
+        except OSError as e:
+            # A cold cache only costs time
+            logger.warning(f"Failed to seed disk cache {cache_dir}: {str(e)}")
+    return cache_dir
+
+def page_loaded(driver):
+    return driver.current_url.startswith(TELEGRAM_WEB_URL) and driver.execute_script("return document.readyState;") == 'complete'
+
+def wait_for_preloaded_page(driver):
+    try:
+        WebDriverWait(driver, Config.BROWSER_PAGE_LOAD_TIMEOUT).until(page_loaded)
+        return True
+    except TimeoutException:
+        logger.warning(f"Preloaded page not ready after {Config.BROWSER_PAGE_LOAD_TIMEOUT}s, navigating instead")
+        return False
+
+def launch_browser(chrome_options, trace=None):
+    trace = trace or StartupTrace()
+    with trace.span('chrome_launch'):
+        driver = webdriver.Chrome(options=chrome_options)
+    if Config.BROWSER_PRELOAD_PAGE:
+        with trace.span('page_load'):
+            preloaded = wait_for_preloaded_page(driver)
+        if preloaded:
+            # Chrome already started fullscreen on the page
+            return driver
+    with trace.span('navigate'):
+        driver.get(TELEGRAM_WEB_URL)
+    with trace.span('fullscreen'):
+        driver.fullscreen_window()
+    return driver
@@ -1,11 +1,67 @@
-import numpy as np
-from scipy.interpolate import interp2d
 import logging
+from array import array
+import numpy as np
+from .config import Config
+from .routine_format import Routine
 
 logger = logging.getLogger(__name__)
 
+class IdentityModel:
+    def transform(self, points):
+        return points
+
+class HomographyModel:
+    """Projective mapping fitted by least squares (DLT) over all calibration points."""
+
+    def __init__(self, source_points, target_points):
+        rows = []
+        for (x, y), (u, v) in zip(source_points, target_points):
+            rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y, -u])
+            rows.append([0, 0, 0, x, y, 1, -v * x, -v * y, -v])
+        _, _, vt = np.linalg.svd(np.asarray(rows, dtype=float))
+        self.matrix = vt[-1].reshape(3, 3) / vt[-1][-1]
+
+    def transform(self, points):
+        homogeneous = np.column_stack([points, np.ones(len(points))]) @ self.matrix.T
+        return homogeneous[:, :2] / homogeneous[:, 2:3]
+
+class ThinPlateSplineModel:
+    """Thin plate spline through the calibration points; smoothing > 0 trades exactness for stability."""
+
+    def __init__(self, source_points, target_points, smoothing=0.0):
+        self.control_points = np.asarray(source_points, dtype=float)
+        n = len(self.control_points)
+        kernel = self._kernel(self.control_points, self.control_points) + smoothing * np.eye(n)
+        affine = np.column_stack([np.ones(n), self.control_points])
+        system = np.zeros((n + 3, n + 3))
+        system[:n, :n] = kernel
+        system[:n, n:] = affine
+        system[n:, :n] = affine.T
+        rhs = np.zeros((n + 3, 2))
+        rhs[:n] = target_points
+        solution = np.linalg.solve(system, rhs)
+        self.weights = solution[:n]
+        self.affine = solution[n:]
+
+    @staticmethod
+    def _kernel(points, control_points):
+        # U(r) = r^2 log r^2, with U(0) = 0
+        dx = points[:, 0:1] - control_points[:, 0]
+        dy = points[:, 1:2] - control_points[:, 1]
+        squared = dx * dx + dy * dy
+        return squared * np.log(np.maximum(squared, 1e-300))
+
+    def transform(self, points):
+        return (self.affine[0] + points @ self.affine[1:]
+                + self._kernel(points, self.control_points) @ self.weights)
+
+CALIBRATION_MODELS = {
+    'homography': HomographyModel,
+    'tps': ThinPlateSplineModel,
+}
+
 class Calibrator:
-    def __init__(self, browser_calibration=None, recorder_calibration=None, player_calibration=None):
+    def __init__(self, browser_calibration=None, recorder_calibration=None, player_calibration=None, method=None):
         self.browser_calibration = np.array(browser_calibration or [])
         self.recorder_calibration = np.array(recorder_calibration or [])
         self.player_calibration = np.array(player_calibration or [])
@@ -14,9 +70,10 @@ class Calibrator:
             (0, 0.5), (0.5, 0.5), (1, 0.5),
             (0, 1), (0.5, 1), (1, 1)
         ])
-        self.browser_interp_x = self.browser_interp_y = None
-        self.recorder_interp_x = self.recorder_interp_y = None
-        self.player_interp_x = self.player_interp_y = None
+        self.method = method or Config.CALIBRATION_METHOD
+        if self.method not in CALIBRATION_MODELS:
+            raise ValueError(f"Calibration method must be one of {tuple(CALIBRATION_MODELS)}")
+        self.browser_model = self.recorder_model = self.player_model = IdentityModel()
 
     def is_calibrated(self):
         return (len(self.browser_calibration) == len(self.expected_points) and
@@ -24,56 +81,65 @@ class Calibrator:
                 len(self.player_calibration) == len(self.expected_points))
 
     def calibrate(self):
+        # Fitted once; every later transform is a closed-form, vectorized evaluation
         if not self.is_calibrated():
             logger.warning("Not all calibration data is available")
-        self.browser_interp_x, self.browser_interp_y = self._create_interpolators(self.browser_calibration)
-        self.recorder_interp_x, self.recorder_interp_y = self._create_interpolators(self.recorder_calibration)
-        self.player_interp_x, self.player_interp_y = self._create_interpolators(self.player_calibration)
+        self.browser_model = self._fit(self.browser_calibration)
+        self.recorder_model = self._fit(self.recorder_calibration)
+        self.player_model = self._fit(self.player_calibration)
 
-    def transform_coordinate(self, x, y, mode='record'):
-        if not self.is_calibrated():
-            logger.info(f"No calibration applied: ({x}, {y})")
-            return x, y
+    def _fit(self, calibration_points):
+        if len(calibration_points) < len(self.expected_points):
+            logger.warning(f"Insufficient calibration points: {len(calibration_points)}")
+            return IdentityModel()
+        return CALIBRATION_MODELS[self.method](calibration_points[:len(self.expected_points)], self.expected_points)
 
-        # First, transform through browser calibration
-        x_browser, y_browser = self._apply_interpolation(x, y, self.browser_interp_x, self.browser_interp_y)
-        
+    def transform_points(self, points, mode='record'):
+        """Transform an (N, 2) array of coordinates in one call."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if not self.is_calibrated():
+            return points
         if mode == 'record':
-            x_final, y_final = self._apply_interpolation(x_browser, y_browser, self.recorder_interp_x, self.recorder_interp_y)
+            stage_model = self.recorder_model
         elif mode == 'play':
-            x_final, y_final = self._apply_interpolation(x_browser, y_browser, self.player_interp_x, self.player_interp_y)
+            stage_model = self.player_model
         else:
             raise ValueError("Mode must be 'record' or 'play'")
+        # First, transform through browser calibration
+        return stage_model.transform(self.browser_model.transform(points))
 
-        logger.info(f"Calibration applied: ({x}, {y}) -> ({x_final}, {y_final})")
-        return x_final, y_final
+    def transform_coordinate(self, x, y, mode='record'):
+        x_final, y_final = self.transform_points([(x, y)], mode)[0]
+        logger.debug(f"Calibration applied: ({x}, {y}) -> ({x_final}, {y_final})")
+        return float(x_final), float(y_final)
 
-    def _create_interpolators(self, calibration_points):
-        if len(calibration_points) < len(self.expected_points):
-            logger.warning(f"Insufficient calibration points: {len(calibration_points)}")
-            return None, None
-        x = calibration_points[:, 0]
-        y = calibration_points[:, 1]
-        zx = self.expected_points[:, 0]
-        zy = self.expected_points[:, 1]
-        return interp2d(x, y, zx, kind='linear'), interp2d(x, y, zy, kind='linear')
-
-    def _apply_interpolation(self, x, y, interp_x, interp_y):
-        if interp_x is None or interp_y is None:
-            return x, y
-        return float(interp_x(x, y)), float(interp_y(x, y))
+    def transform_routine(self, routine, mode='play'):
+        if not self.is_calibrated() or not len(routine):
+            return routine
+        scale = routine.coord_scale
+        points = np.column_stack([
+            np.cumsum(np.frombuffer(routine.xs, dtype=np.int32), dtype=np.int64),
+            np.cumsum(np.frombuffer(routine.ys, dtype=np.int32), dtype=np.int64),
+        ]) / scale
+        transformed = self.transform_points(points, mode)
+        scale = 1e6 if np.abs(transformed).max() <= 1000 else 100.0
+        fixed = np.round(transformed * scale).astype(np.int32)
+        deltas = np.diff(fixed, axis=0, prepend=0).astype(np.int32)
+        return Routine(routine.types, routine.times, array('i', deltas[:, 0].tobytes()), array('i', deltas[:, 1].tobytes()),
+                       routine.type_names, routine.extras, scale, routine.viewport_coords)
 
     def to_dict(self):
         return {
             'browser_calibration_points': self.browser_calibration.tolist(),
             'recorder_calibration_points': self.recorder_calibration.tolist(),
             'player_calibration_points': self.player_calibration.tolist(),
-            'expected_points': self.expected_points.tolist()
+            'expected_points': self.expected_points.tolist(),
+            'method': self.method
         }
 
     @classmethod
     def from_dict(cls, data):
-        calibrator = cls()
+        calibrator = cls(method=data.get('method'))
         calibrator.browser_calibration = np.array(data['browser_calibration_points'])
         calibrator.recorder_calibration = np.array(data['recorder_calibration_points'])
         calibrator.player_calibration = np.array(data['player_calibration_points'])
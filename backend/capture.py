@@ -0,0 +1,106 @@
+"""Lock-free hand-off from input listener threads to the recorder's consumer thread.
+
+Listener callbacks run on the OS input hook thread, so they do nothing but take a timestamp and
+store a tuple. Everything that can block (WebDriver calls, logging, persistence) happens on the
+consumer side. Page-mode recordings capture inside the browser and arrive here in batches.
+"""
+import time
+from .utils import percentile
+
+class RingBuffer:
+    """Single-producer, single-consumer ring of preallocated slots; neither side takes a lock.
+
+    Only the producer moves `_head` and only the consumer moves `_tail`. Under the GIL each index
+    store is atomic, and a slot is written before `_head` moves past it, so the consumer never
+    sees a half-written entry. When full, new items are dropped and counted, never blocked on.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def push(self, item):
+        head = self._head
+        if head - self._tail >= self.capacity:
+            self.dropped += 1
+            return False
+        self._slots[head % self.capacity] = item
+        self._head = head + 1
+        return True
+
+    def drain(self):
+        tail, head = self._tail, self._head
+        capacity = self.capacity
+        items = [self._slots[index % capacity] for index in range(tail, head)]
+        self._tail = head
+        return items
+
+class CaptureChannel:
+    """One per listener thread: timestamped events plus how long each capture call took."""
+
+    def __init__(self, capacity=4096, clock=time.perf_counter):
+        self.events = RingBuffer(capacity)
+        self.latency = RingBuffer(capacity)
+        self.clock = clock
+
+    def capture(self, kind, *data):
+        captured_at = self.clock()
+        self.events.push((captured_at, kind) + data)
+        self.latency.push(self.clock() - captured_at)
+
+class CaptureStats:
+    """Consumer-side bookkeeping; only ever touched by the consumer thread."""
+
+    def __init__(self):
+        self.events = 0
+        self.capture_latency = []
+        self.queue_delay = []
+
+    def record(self, channels, events, now):
+        self.events += len(events)
+        for channel in channels:
+            self.capture_latency.extend(channel.latency.drain())
+        self.queue_delay.extend(now - event[0] for event in events)
+
+    def snapshot(self, channels):
+        capture_latency = sorted(self.capture_latency)
+        queue_delay = sorted(self.queue_delay)
+        return {
+            'events': self.events,
+            'dropped': sum(channel.events.dropped for channel in channels),
+            'capture_p50_us': round(percentile(capture_latency, 0.5) * 1e6, 1),
+            'capture_p99_us': round(percentile(capture_latency, 0.99) * 1e6, 1),
+            'capture_max_us': round(capture_latency[-1] * 1e6, 1) if capture_latency else 0.0,
+            'queue_delay_p50_ms': round(percentile(queue_delay, 0.5) * 1000, 3),
+            'queue_delay_p99_ms': round(percentile(queue_delay, 0.99) * 1000, 3),
+        }
+
+class BatchStats:
+    """Consumer-side bookkeeping for events captured in the page and delivered in batches."""
+
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+        self.flush_delay = []
+
+    def record(self, batch, now):
+        self.events += len(batch)
+        self.batches += 1
+        # Page timestamps are wall-clock based, so this is capture-to-delivery time
+        self.flush_delay.extend(now - event[0] for event in batch)
+
+    def snapshot(self):
+        flush_delay = sorted(self.flush_delay)
+        return {
+            'events': self.events,
+            'batches': self.batches,
+            'events_per_batch': round(self.events / self.batches, 1) if self.batches else 0.0,
+            'flush_delay_p50_ms': round(percentile(flush_delay, 0.5) * 1000, 3),
+            'flush_delay_p99_ms': round(percentile(flush_delay, 0.99) * 1000, 3),
+        }
@@ -1,4 +1,6 @@
+import time
 from celery import Celery
+from celery.result import AsyncResult
 from .config import Config
 
 def make_celery(app_name=__name__):
@@ -11,7 +13,33 @@ def make_celery(app_name=__name__):
 celery = make_celery()
 celery.conf.update(Config.CELERY_CONFIG)
 
+def pending_too_long(task_id, now):
+    # A task's state is never PENDING once it runs, so a marker stuck on PENDING belongs to a task
+    # that was lost before its result was stored. Timed from when cleanup first saw it pending.
+    key = f"playback_task_pending:{task_id}"
+    client = celery.backend.client
+    timeout = Config.PLAYBACK_MARKER_PENDING_TIMEOUT
+    client.set(key, now, nx=True, ex=timeout * 2)
+    first_seen = client.get(key)
+    return first_seen is not None and now - float(first_seen) > timeout
+
 @celery.task
 def cleanup_old_tasks():
-    # Implement task cleanup logic here
-    pass
+    # Drop playback_task markers whose task has finished without cleaning up (e.g. the worker died);
+    # the scheduler reads them to avoid starting a routine that is still playing
+    removed = 0
+    now = time.time()
+    for key in celery.backend.client.scan_iter(match='playback_task:*'):
+        task_id = celery.backend.get(key)
+        if task_id is not None:
+            task_id = task_id.decode() if isinstance(task_id, bytes) else task_id
+            result = AsyncResult(task_id, app=celery)
+            if result.state == 'PENDING':
+                if not pending_too_long(task_id, now):
+                    continue
+            elif not result.ready():
+                continue
+            celery.backend.client.delete(f"playback_task_pending:{task_id}")
+        celery.backend.delete(key)
+        removed += 1
+    return removed
@@ -11,10 +11,55 @@ class Config:
     # Supabase Configuration
     SUPABASE_URL = os.environ.get('SUPABASE_URL')
     SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
+    # Data store behind backend.repository: 'supabase', or 'sqlite' for a single-host/offline file
+    DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND', 'supabase')
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'dropfarm.db')
+
+    # Auth Configuration
+    # Access tokens are verified locally: HS256 against the project's JWT secret, asymmetric
+    # algorithms against the auth server's JWKS. The remote user lookup is only a fallback.
+    SUPABASE_JWT_SECRET = os.environ.get('SUPABASE_JWT_SECRET')
+    SUPABASE_JWKS_URL = os.environ.get('SUPABASE_JWKS_URL') or (
+        f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None)
+    AUTH_JWT_AUDIENCE = os.environ.get('AUTH_JWT_AUDIENCE', 'authenticated')
+    AUTH_JWT_LEEWAY = int(os.environ.get('AUTH_JWT_LEEWAY', 10))  # seconds
+    AUTH_JWKS_TTL = int(os.environ.get('AUTH_JWKS_TTL', 600))  # seconds
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024))
     
     # Frontend URL
     FRONTEND_URL = os.environ.get('FRONTEND_URL') or 'http://localhost:3000'
     
+    # Redis Configuration (caches, control channels)
+    REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
+    PLAYBACK_PLAN_TTL = int(os.environ.get('PLAYBACK_PLAN_TTL', 7 * 24 * 3600))  # seconds
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 30))  # seconds
+    # Activity rows and user_stats counters are queued in Redis and flushed in batches
+    WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 2.0))  # seconds
+    WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 500))
+    # Live status streaming (/api/status/stream)
+    STATUS_PROGRESS_INTERVAL = float(os.environ.get('STATUS_PROGRESS_INTERVAL', 0.5))  # seconds
+    STATUS_KEEPALIVE = float(os.environ.get('STATUS_KEEPALIVE', 15))  # seconds
+    STATUS_SNAPSHOT_TTL = int(os.environ.get('STATUS_SNAPSHOT_TTL', 24 * 3600))  # seconds
+    # Startup traces (see tracing.py): how long each is kept and how many per user
+    STARTUP_TRACE_TTL = int(os.environ.get('STARTUP_TRACE_TTL', 7 * 24 * 3600))  # seconds
+    STARTUP_TRACE_HISTORY = int(os.environ.get('STARTUP_TRACE_HISTORY', 200))
+
+    # Browser Slot Configuration
+    # Each slot runs one routine at a time with its own profile, display and lock
+    BROWSER_SLOTS = int(os.environ.get('BROWSER_SLOTS', 1))
+    SLOT_LOCK_DIR = os.environ.get('SLOT_LOCK_DIR') or os.path.join(os.getcwd(), 'slot_locks')
+    SLOT_DISPLAY_BASE = int(os.environ['SLOT_DISPLAY_BASE']) if os.environ.get('SLOT_DISPLAY_BASE') else None
+    SLOT_RETRY_DELAY = int(os.environ.get('SLOT_RETRY_DELAY', 10))  # seconds
+    # How often a task is requeued before it gives up waiting for a slot (an hour at the default delay)
+    SLOT_MAX_RETRIES = int(os.environ.get('SLOT_MAX_RETRIES', 360))
+
+    # Routine Scheduler Configuration (python -m backend.scheduler)
+    SCHEDULER_MIN_INTERVAL = int(os.environ.get('SCHEDULER_MIN_INTERVAL', 60))  # seconds
+    SCHEDULER_JITTER = float(os.environ.get('SCHEDULER_JITTER', 30))  # seconds, capped at 10% of the interval
+    SCHEDULER_BUSY_RETRY = int(os.environ.get('SCHEDULER_BUSY_RETRY', 60))  # seconds
+    SCHEDULER_RESYNC_INTERVAL = int(os.environ.get('SCHEDULER_RESYNC_INTERVAL', 600))  # seconds
+    SCHEDULER_LOCK_TIMEOUT = int(os.environ.get('SCHEDULER_LOCK_TIMEOUT', 30))  # seconds
+
     # Celery Configuration
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or 'redis://localhost:6379/0'
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND') or 'redis://localhost:6379/0'
@@ -26,9 +71,109 @@ class Config:
         'result_serializer': 'json',
         'timezone': 'UTC',
         'task_always_eager': False,
-        'worker_concurrency': 1,
-        'worker_max_tasks_per_child': 1,
-        'worker_pool': 'solo',
+        # One prefork child per browser slot; each child claims a slot for its lifetime
+        'worker_concurrency': BROWSER_SLOTS,
+        'worker_prefetch_multiplier': 1,
+        'task_acks_late': True,
+        # Running tasks report STARTED, so a marker whose task stays PENDING points at a lost task
+        'task_track_started': True,
+        # Recycling the worker after every task would throw away the warm session pool
+        'worker_max_tasks_per_child': int(os.environ.get('CELERY_MAX_TASKS_PER_CHILD', 0)) or None,
+        'worker_pool': os.environ.get('CELERY_WORKER_POOL') or ('prefork' if BROWSER_SLOTS > 1 else 'solo'),
     }
 
+    # playback_task markers whose task is still PENDING after this long are removed by cleanup_old_tasks
+    PLAYBACK_MARKER_PENDING_TIMEOUT = int(os.environ.get('PLAYBACK_MARKER_PENDING_TIMEOUT', 900))  # seconds
+
+    # Browser Configuration
+    CHROME_USER_DATA_DIR = os.environ.get('CHROME_USER_DATA_DIR') or os.path.join(os.getcwd(), 'chrome_user_data')
+    # Profile cloning (see profiles.py): every browser runs on its own copy of the template profile
+    PROFILE_CLONING = os.environ.get('PROFILE_CLONING', 'true').lower() == 'true'
+    PROFILE_TEMPLATE_DIR = os.environ.get('PROFILE_TEMPLATE_DIR') or CHROME_USER_DATA_DIR
+    PROFILE_ROOT = os.environ.get('PROFILE_ROOT') or f"{CHROME_USER_DATA_DIR}-profiles"
+    # reflink, hardlink or copy; reflink falls back to the others where the filesystem can't clone
+    PROFILE_CLONE_METHOD = os.environ.get('PROFILE_CLONE_METHOD', 'reflink')
+    PROFILE_MAX_IDLE = int(os.environ.get('PROFILE_MAX_IDLE', 7 * 24 * 3600))  # seconds
+    # Write changed login/storage state back to the template when a session closes
+    PROFILE_SYNC_BACK = os.environ.get('PROFILE_SYNC_BACK', 'false').lower() == 'true'
+    PROFILE_SYNC_PATHS = [path for path in os.environ.get('PROFILE_SYNC_PATHS', 'Default/Cookies,Default/Local Storage,Default/IndexedDB').split(',') if path]
+    # Warm start (see tracing.py for measuring it). Preloading passes Telegram Web and fullscreen as
+    # Chrome startup arguments, so the page loads while the driver connects and is not navigated again
+    BROWSER_PRELOAD_PAGE = os.environ.get('BROWSER_PRELOAD_PAGE', 'false').lower() == 'true'
+    BROWSER_PAGE_LOAD_TIMEOUT = int(os.environ.get('BROWSER_PAGE_LOAD_TIMEOUT', 30))  # seconds
+    # Disk cache kept outside the profiles, one directory per profile; empty keeps Chrome's default.
+    # A new cache directory is first filled from the seed directory, if one is set
+    CHROME_DISK_CACHE_DIR = os.environ.get('CHROME_DISK_CACHE_DIR', '')
+    CHROME_DISK_CACHE_SEED_DIR = os.environ.get('CHROME_DISK_CACHE_SEED_DIR', '')
+    CHROME_DISK_CACHE_SIZE = int(os.environ.get('CHROME_DISK_CACHE_SIZE', 0))  # bytes, 0 = Chrome's default
+
+    # Session Pool Configuration
+    SESSION_POOL_ENABLED = os.environ.get('SESSION_POOL_ENABLED', 'true').lower() == 'true'
+    SESSION_POOL_SIZE = int(os.environ.get('SESSION_POOL_SIZE', 1))
+    SESSION_MAX_AGE = int(os.environ.get('SESSION_MAX_AGE', 3600))  # seconds
+    SESSION_MAX_USES = int(os.environ.get('SESSION_MAX_USES', 50))
+    SESSION_LEASE_TIMEOUT = int(os.environ.get('SESSION_LEASE_TIMEOUT', 120))  # seconds
+
+    # Recorder Configuration
+    RECORDER_BUFFER_SIZE = int(os.environ.get('RECORDER_BUFFER_SIZE', 4096))  # events per listener
+    RECORDER_CONSUMER_INTERVAL = float(os.environ.get('RECORDER_CONSUMER_INTERVAL', 0.005))  # seconds
+    # 'os' hooks the display's mouse and keyboard; 'page' captures inside the browser (no display needed)
+    RECORDER_MODE = os.environ.get('RECORDER_MODE', 'os')
+    RECORDER_FLUSH_INTERVAL = float(os.environ.get('RECORDER_FLUSH_INTERVAL', 0.1))  # seconds between page flushes
+    RECORDER_BATCH_SIZE = int(os.environ.get('RECORDER_BATCH_SIZE', 64))  # events per page flush
+
+    # Player Configuration
+    # Click indicators are a debugging aid; production runs can switch them off
+    PLAYER_SHOW_OVERLAY = os.environ.get('PLAYER_SHOW_OVERLAY', 'true').lower() == 'true'
+
+    # Action timing: catch_up, skip or shift (see timing.py)
+    PLAYER_SCHEDULE_POLICY = os.environ.get('PLAYER_SCHEDULE_POLICY', 'catch_up')
+    PLAYER_MAX_LATENESS = float(os.environ.get('PLAYER_MAX_LATENESS', 0.25))  # seconds
+    PLAYER_SPIN_THRESHOLD = float(os.environ.get('PLAYER_SPIN_THRESHOLD', 0.002))  # seconds
+    # Drift percentiles cover the most recent actions only, so repeat runs stay bounded in memory
+    PLAYER_LATENESS_WINDOW = int(os.environ.get('PLAYER_LATENESS_WINDOW', 5000))
+    # Memory governor for repeat runs (see memory.py); a budget of 0 is not enforced
+    MEMORY_GOVERNOR = os.environ.get('MEMORY_GOVERNOR', 'true').lower() == 'true'
+    MEMORY_SAMPLE_INTERVAL = float(os.environ.get('MEMORY_SAMPLE_INTERVAL', 60))  # seconds
+    MEMORY_MAX_RSS_MB = float(os.environ.get('MEMORY_MAX_RSS_MB', 2048))  # whole Chrome process tree
+    MEMORY_MAX_JS_HEAP_MB = float(os.environ.get('MEMORY_MAX_JS_HEAP_MB', 512))
+    MEMORY_MAX_DOM_NODES = int(os.environ.get('MEMORY_MAX_DOM_NODES', 0))
+    MEMORY_MIN_RECYCLE_INTERVAL = float(os.environ.get('MEMORY_MIN_RECYCLE_INTERVAL', 600))  # seconds
+    MEMORY_HISTORY = int(os.environ.get('MEMORY_HISTORY', 10000))  # samples kept per run
+    MEMORY_SAMPLES_TTL = int(os.environ.get('MEMORY_SAMPLES_TTL', 7 * 24 * 3600))  # seconds
+    # Playback supervision (see supervisor.py): a click command in flight longer than the timeout is a hung browser
+    WATCHDOG_ENABLED = os.environ.get('WATCHDOG_ENABLED', 'true').lower() == 'true'
+    WATCHDOG_TIMEOUT = float(os.environ.get('WATCHDOG_TIMEOUT', 60))  # seconds
+    WATCHDOG_INTERVAL = float(os.environ.get('WATCHDOG_INTERVAL', 2))  # seconds
+    PLAYBACK_MAX_RESTARTS = int(os.environ.get('PLAYBACK_MAX_RESTARTS', 3))
+    PLAYBACK_RESTART_BACKOFF = float(os.environ.get('PLAYBACK_RESTART_BACKOFF', 5))  # seconds, doubled per attempt
+    PLAYBACK_RESTART_BACKOFF_MAX = float(os.environ.get('PLAYBACK_RESTART_BACKOFF_MAX', 120))  # seconds
+    # action resumes at the action that was in flight, loop replays the interrupted loop from its start
+    PLAYBACK_RESUME_FROM = os.environ.get('PLAYBACK_RESUME_FROM', 'action')
+    # A paused playback that is not resumed within this time is stopped
+    PLAYER_PAUSE_TIMEOUT = int(os.environ.get('PLAYER_PAUSE_TIMEOUT', 3600))  # seconds
+    # How long a control signal waits for a player that has not subscribed yet
+    CONTROL_STATE_TTL = int(os.environ.get('CONTROL_STATE_TTL', 300))  # seconds
+    # Time-scaled playback (see pacing.py); /start_playback can override these per run
+    PLAYBACK_SPEED = float(os.environ.get('PLAYBACK_SPEED', 1.0))
+    PLAYBACK_MAX_GAP = float(os.environ.get('PLAYBACK_MAX_GAP', 0))  # seconds, 0 = no limit
+    PLAYBACK_LEARN_DELAYS = os.environ.get('PLAYBACK_LEARN_DELAYS', 'false').lower() == 'true'
+    # How far below its shortest successful gap a learned gap may go on the next run
+    PLAYBACK_DELAY_STEP = float(os.environ.get('PLAYBACK_DELAY_STEP', 0.8))
+    # Learned gaps never go below this, however many runs succeed
+    PLAYBACK_MIN_GAP = float(os.environ.get('PLAYBACK_MIN_GAP', 0.1))  # seconds
+    # Playlists (see playlist.py): default reset between items (none, reload, home or session)
+    PLAYLIST_RESET = os.environ.get('PLAYLIST_RESET', 'session')
+    PLAYLIST_MAX_ITEMS = int(os.environ.get('PLAYLIST_MAX_ITEMS', 50))
+
+    # Calibration model fitted from the 9-point calibration: tps or homography
+    CALIBRATION_METHOD = os.environ.get('CALIBRATION_METHOD', 'tps')
+
+    # Headless Playback Configuration
+    HEADLESS_VIEWPORT_WIDTH = int(os.environ.get('HEADLESS_VIEWPORT_WIDTH', 1280))
+    HEADLESS_VIEWPORT_HEIGHT = int(os.environ.get('HEADLESS_VIEWPORT_HEIGHT', 800))
+    # Screen size that recorder pixel coordinates are normalized against
+    HEADLESS_SOURCE_WIDTH = int(os.environ.get('HEADLESS_SOURCE_WIDTH', 1920))
+    HEADLESS_SOURCE_HEIGHT = int(os.environ.get('HEADLESS_SOURCE_HEIGHT', 1080))
+
     # Add other configuration variables as needed
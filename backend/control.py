@@ -0,0 +1,131 @@
+import queue
+import logging
+import threading
+from .config import Config
+from .devtools import DevToolsConnection
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Name of the page function the overlay calls to reach the Python side
+SIGNAL_BINDING = 'dropfarmSignal'
+
+CONTROL_SIGNALS = ('start', 'stop', 'pause', 'resume')
+
+def control_channel(run_id):
+    return f"control:{run_id}"
+
+def control_state_key(run_id):
+    return f"control_state:{run_id}"
+
+def send_control(run_id, signal):
+    """Deliver a signal to the player of a run on any worker; returns False if it isn't listening yet."""
+    if signal not in CONTROL_SIGNALS:
+        raise ValueError(f"Control signal must be one of {CONTROL_SIGNALS}")
+    pipe = redis_client.pipeline()
+    # Kept briefly so a player that subscribes a moment later still sees a stop or pause
+    pipe.set(control_state_key(run_id), signal, ex=Config.CONTROL_STATE_TTL)
+    pipe.publish(control_channel(run_id), signal)
+    _, receivers = pipe.execute()
+    return receivers > 0
+
+class SignalChannel:
+    """Push channel for start/stop/pause/resume signals from the page overlay or remote callers."""
+
+    def __init__(self):
+        self._signals = queue.Queue()
+        self._devtools = None
+        self._pubsub = None
+        self._listener = None
+        # Set whenever a signal is queued, so waits between actions can be cut short
+        self.pending = threading.Event()
+
+    def attach(self, driver):
+        try:
+            self._devtools = DevToolsConnection.for_driver(driver)
+            self._devtools.add_binding(SIGNAL_BINDING, self.post)
+            return True
+        except Exception as e:
+            logger.warning(f"DevTools signal binding unavailable, falling back to polling: {str(e)}")
+            self._close_devtools()
+            return False
+
+    def reattach(self, driver):
+        # After the browser was relaunched; the remote subscription is unaffected
+        self._close_devtools()
+        return self.attach(driver)
+
+    def subscribe(self, run_id):
+        """Also take signals sent with send_control(run_id, ...) from other processes."""
+        try:
+            self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{control_channel(run_id): self._on_message})
+            self._listener = self._pubsub.run_in_thread(sleep_time=0.05, daemon=True)
+            # Anything sent before the subscription existed
+            pipe = redis_client.pipeline()
+            pipe.get(control_state_key(run_id))
+            pipe.delete(control_state_key(run_id))
+            signal, _ = pipe.execute()
+            if signal:
+                self.post(signal.decode())
+            return True
+        except Exception as e:
+            logger.warning(f"Remote control channel unavailable for run {run_id}: {str(e)}")
+            self._close_pubsub()
+            return False
+
+    def _on_message(self, message):
+        self.post(message['data'].decode())
+
+    @property
+    def push_enabled(self):
+        return self._devtools is not None and self._devtools.connected
+
+    def post(self, signal):
+        self._signals.put(signal)
+        self.pending.set()
+
+    def wait(self, timeout=None):
+        try:
+            signal = self._signals.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.pending.clear()
+        if not self._signals.empty():
+            self.pending.set()
+        return signal
+
+    def poll(self):
+        # Clear first: a post racing with this call sets the event again
+        self.pending.clear()
+        try:
+            signal = self._signals.get_nowait()
+        except queue.Empty:
+            return None
+        if not self._signals.empty():
+            self.pending.set()
+        return signal
+
+    def clear(self):
+        while self.poll() is not None:
+            pass
+
+    def _close_devtools(self):
+        if self._devtools:
+            self._devtools.close()
+            self._devtools = None
+
+    def _close_pubsub(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+        if self._pubsub:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
+
+    def detach(self):
+        self._close_devtools()
+        self._close_pubsub()
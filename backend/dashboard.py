@@ -0,0 +1,66 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .config import Config
+from .redis_client import redis_client
+from .repository import routines, activities, user_stats
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='dashboard')
+
+def dashboard_cache_key(user_id):
+    return f"dashboard:{user_id}"
+
+def fetch_user_stats(user_id):
+    return user_stats.get(user_id)
+
+def fetch_routine_summaries(user_id):
+    return routines.summaries(user_id)
+
+def fetch_recent_activities(user_id, limit=10):
+    return activities.recent(user_id, limit)
+
+def build_dashboard_snapshot(user_id):
+    # The three sources are independent, so fetch them concurrently
+    user_stats_future = _executor.submit(fetch_user_stats, user_id)
+    routines_future = _executor.submit(fetch_routine_summaries, user_id)
+    activities_future = _executor.submit(fetch_recent_activities, user_id)
+    user_stats = user_stats_future.result() or {}
+
+    return {
+        'totalEarnings': user_stats.get('total_earnings', 0),
+        'totalTokensGenerated': user_stats.get('total_tokens_generated', 0),
+        'totalRoutineRuns': user_stats.get('total_routine_runs', 0),
+        'lastRunDate': user_stats.get('last_run_date'),
+        'routines': routines_future.result(),
+        'activities': activities_future.result() or [],
+        'earningsHistory': []  # You might want to implement this if needed
+    }
+
+def get_dashboard_data(user_id):
+    key = dashboard_cache_key(user_id)
+    try:
+        cached = redis_client.get(key)
+        if cached:
+            return json.loads(cached)
+    except Exception as e:
+        logger.error(f"Failed to read cached dashboard: {str(e)}")
+
+    try:
+        snapshot = build_dashboard_snapshot(user_id)
+    except Exception as e:
+        logging.error(f"Error fetching dashboard data: {str(e)}")
+        raise
+
+    try:
+        redis_client.set(key, json.dumps(snapshot, default=str), ex=Config.DASHBOARD_CACHE_TTL)
+    except Exception as e:
+        logger.error(f"Failed to cache dashboard: {str(e)}")
+    return snapshot
+
+def invalidate_dashboard(user_id):
+    try:
+        redis_client.delete(dashboard_cache_key(user_id))
+    except Exception as e:
+        logger.error(f"Failed to invalidate dashboard cache: {str(e)}")
@@ -0,0 +1,105 @@
+import json
+import queue
+import logging
+import threading
+import itertools
+import urllib.request
+import websocket
+
+logger = logging.getLogger(__name__)
+
+class DevToolsError(Exception):
+    pass
+
+class DevToolsConnection:
+    """A second DevTools client on the driver's page target, used for pushed events.
+
+    Commands that only need a reply can go through driver.execute_cdp_cmd; this connection
+    exists because chromedriver does not forward CDP events.
+    """
+
+    def __init__(self, websocket_url):
+        self._ws = websocket.create_connection(websocket_url, suppress_origin=True)
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_loop, name='devtools-reader', daemon=True)
+        self._reader.start()
+
+    @classmethod
+    def for_driver(cls, driver):
+        debugger_address = driver.capabilities.get('goog:chromeOptions', {}).get('debuggerAddress')
+        if not debugger_address:
+            raise DevToolsError("Driver does not expose a DevTools debugger address")
+        with urllib.request.urlopen(f"http://{debugger_address}/json", timeout=5) as response:
+            targets = json.loads(response.read())
+        pages = [target for target in targets if target.get('type') == 'page']
+        # chromedriver window handles are DevTools target ids
+        handle = driver.current_window_handle
+        target = next((page for page in pages if page.get('id') == handle), pages[0] if pages else None)
+        if not target:
+            raise DevToolsError("No page target found")
+        return cls(target['webSocketDebuggerUrl'])
+
+    def send(self, method, params=None, timeout=10):
+        message_id = next(self._ids)
+        reply = queue.Queue(maxsize=1)
+        with self._lock:
+            self._pending[message_id] = reply
+        self._ws.send(json.dumps({'id': message_id, 'method': method, 'params': params or {}}))
+        try:
+            message = reply.get(timeout=timeout)
+        except queue.Empty:
+            raise DevToolsError(f"{method} timed out after {timeout}s")
+        finally:
+            with self._lock:
+                self._pending.pop(message_id, None)
+        if 'error' in message:
+            raise DevToolsError(f"{method} failed: {message['error']}")
+        return message.get('result', {})
+
+    def on(self, event, callback):
+        self._listeners.setdefault(event, []).append(callback)
+
+    def add_binding(self, name, callback):
+        # callback(payload) runs on the reader thread whenever the page calls window[name](payload)
+        def on_binding_called(params):
+            if params.get('name') == name:
+                callback(params.get('payload'))
+        self.on('Runtime.bindingCalled', on_binding_called)
+        self.send('Runtime.enable')
+        self.send('Runtime.addBinding', {'name': name})
+
+    def _read_loop(self):
+        while not self._closed:
+            try:
+                message = json.loads(self._ws.recv())
+            except Exception as e:
+                if not self._closed:
+                    logger.warning(f"DevTools connection lost: {str(e)}")
+                break
+            if 'id' in message:
+                with self._lock:
+                    reply = self._pending.get(message['id'])
+                if reply:
+                    reply.put(message)
+                continue
+            for callback in self._listeners.get(message.get('method'), []):
+                try:
+                    callback(message.get('params', {}))
+                except Exception as e:
+                    logger.error(f"DevTools listener for {message.get('method')} failed: {str(e)}")
+        self._closed = True
+
+    @property
+    def connected(self):
+        return not self._closed
+
+    def close(self):
+        self._closed = True
+        try:
+            self._ws.close()
+        except Exception:
+            pass
@@ -0,0 +1,157 @@
+import logging
+from selenium import webdriver
+from .browser import build_chrome_options, TELEGRAM_WEB_URL
+from .profiles import provision_profile
+from .config import Config
+from .control import SignalChannel
+from .timing import ActionScheduler
+from .routine_format import load_routine
+
+logger = logging.getLogger(__name__)
+
+def to_viewport_fraction(value, extent):
+    # Routines store either fractions of the window (player convention) or raw recorder pixels
+    if 0 <= value <= 1:
+        return float(value)
+    return min(max(value / extent, 0.0), 1.0)
+
+def compile_headless_events(actions, source_size=None):
+    """Compile stored routine actions into time-sorted, viewport-relative input events."""
+    source_width, source_height = source_size or (Config.HEADLESS_SOURCE_WIDTH, Config.HEADLESS_SOURCE_HEIGHT)
+    events = []
+    for action in load_routine(actions):
+        if action.type != 'click':
+            continue
+        events.append({
+            'time': action.time,
+            'type': 'click',
+            'x': to_viewport_fraction(action.x, source_width),
+            'y': to_viewport_fraction(action.y, source_height),
+        })
+    events.sort(key=lambda event: event['time'])
+    return events
+
+def launch_headless_browser(user_data_dir, viewport):
+    width, height = viewport
+    chrome_options = build_chrome_options(provision_profile(user_data_dir))
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument(f"--window-size={width},{height}")
+    driver = webdriver.Chrome(options=chrome_options)
+    # Pin the layout viewport so event coordinates never depend on the window
+    driver.execute_cdp_cmd('Emulation.setDeviceMetricsOverride', {
+        'width': width,
+        'height': height,
+        'deviceScaleFactor': 1,
+        'mobile': False,
+    })
+    driver.get(TELEGRAM_WEB_URL)
+    return driver
+
+class HeadlessPlayer:
+    def __init__(self, routine_name, events, user_data_dir, viewport=None, repeat=False, run_id=None, reporter=None):
+        self.routine_name = routine_name
+        self.events = events
+        self.user_data_dir = user_data_dir
+        self.viewport = viewport or (Config.HEADLESS_VIEWPORT_WIDTH, Config.HEADLESS_VIEWPORT_HEIGHT)
+        self.repeat = repeat
+        self.run_id = run_id
+        self.driver = None
+        self.scheduler = ActionScheduler()
+        # No page overlay here, so stop/pause/resume only arrive through send_control(run_id, ...)
+        self.signals = SignalChannel()
+        self.stop_requested = False
+        self.paused = False
+        # Progress sampled by the status reporter, same fields as Player
+        self.action_index = 0
+        self.loop = 0
+        self.is_playing = False
+        self.reporter = reporter
+
+    @property
+    def routine(self):
+        return self.events
+
+    def start(self):
+        self.driver = launch_headless_browser(self.user_data_dir, self.viewport)
+        if self.run_id:
+            self.signals.subscribe(self.run_id)
+        logger.info(f"Started headless player for routine: {self.routine_name} ({self.viewport[0]}x{self.viewport[1]})")
+
+    def play(self):
+        if not self.events:
+            logger.warning("No events to play")
+            return
+        if self.reporter:
+            self.reporter.watch(self)
+        self.is_playing = True
+        try:
+            while not self.stop_requested:
+                self.scheduler.start()
+                for index, event in enumerate(self.events):
+                    self.action_index = index
+                    self.handle_signals()
+                    if self.stop_requested:
+                        break
+                    if not self.wait_for_event_time(event['time']):
+                        continue
+                    self.dispatch_click(event['x'], event['y'])
+                if self.stop_requested:
+                    break
+                self.loop += 1
+                if not self.repeat:
+                    break
+        finally:
+            self.is_playing = False
+            self.close()
+
+    def wait_for_event_time(self, event_time):
+        # Signals cut the wait short, so a stop never waits out a long gap in the routine
+        while True:
+            due = self.scheduler.wait_until(event_time, interrupt=self.signals.pending)
+            if due is not None:
+                return due
+            self.handle_signals()
+            if self.stop_requested:
+                return False
+
+    def handle_signals(self):
+        # Same semantics as Player.handle_signals: a pause blocks here until resume, stop or timeout
+        signal = self.signals.poll()
+        while signal is not None:
+            if signal == 'stop':
+                logger.info("Stop signal received during headless playback")
+                self.stop_requested = True
+                self.paused = False
+                return
+            if signal == 'pause' and not self.paused:
+                logger.info("Headless playback paused")
+                self.paused = True
+                self.scheduler.pause()
+            elif signal == 'resume' and self.paused:
+                logger.info("Headless playback resumed")
+                self.paused = False
+                self.scheduler.resume()
+            if self.paused:
+                signal = self.signals.wait(Config.PLAYER_PAUSE_TIMEOUT)
+                if signal is None:
+                    logger.info("Headless playback paused for too long, stopping")
+                    signal = 'stop'
+            else:
+                signal = self.signals.poll()
+
+    def dispatch_click(self, x, y):
+        width, height = self.viewport
+        params = {'x': x * width, 'y': y * height, 'button': 'left', 'clickCount': 1}
+        self.driver.execute_cdp_cmd('Input.dispatchMouseEvent', dict(params, type='mousePressed'))
+        self.driver.execute_cdp_cmd('Input.dispatchMouseEvent', dict(params, type='mouseReleased'))
+
+    def stop(self):
+        self.stop_requested = True
+        self.close()
+
+    def close(self):
+        self.signals.detach()
+        if self.driver:
+            self.driver.quit()
+            self.driver = None
+        logger.info(f"Stopped headless playback for routine: {self.routine_name}")
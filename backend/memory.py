@@ -0,0 +1,180 @@
+"""Memory governor for long repeat runs: samples the browser between loops and recycles it.
+
+Telegram Web and its mini-apps leak over hours, so a repeat run that keeps one Chrome forever
+eventually pushes the host into swap. Between iterations (at most every MEMORY_SAMPLE_INTERVAL
+seconds) the governor samples
+
+    browser_rss_mb / renderer_rss_mb / total_rss_mb   Chrome's process tree (needs psutil)
+    js_heap_used_mb / js_heap_total_mb, dom_nodes     the page, from Performance.getMetrics
+
+and when a sample exceeds MEMORY_MAX_RSS_MB, MEMORY_MAX_JS_HEAP_MB or MEMORY_MAX_DOM_NODES the
+player relaunches its browser before the next iteration starts. Samples are appended to a Redis
+list per run (GET /api/memory_samples/<run_id>) and the latest goes out with the status events.
+"""
+import json
+import time
+import logging
+from collections import deque
+from .config import Config
+from .redis_client import redis_client
+
+try:
+    import psutil
+except ImportError:
+    # RSS is then unknown and only the page metrics are governed
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+PAGE_METRICS = {
+    'JSHeapUsedSize': 'js_heap_used_mb',
+    'JSHeapTotalSize': 'js_heap_total_mb',
+    'Nodes': 'dom_nodes',
+}
+
+def memory_samples_key(user_id, run_id):
+    return f"memory_samples:{user_id}:{run_id}"
+
+def browser_processes(driver):
+    """Chrome processes started for this driver: chromedriver's descendants."""
+    service = getattr(driver, 'service', None)
+    process = getattr(service, 'process', None)
+    if psutil is None or process is None:
+        return None
+    try:
+        return psutil.Process(process.pid).children(recursive=True)
+    except psutil.Error:
+        return None
+
+def process_rss(driver):
+    processes = browser_processes(driver)
+    if processes is None:
+        return {}
+    browser = renderer = total = 0
+    for process in processes:
+        try:
+            rss = process.memory_info().rss
+            cmdline = process.cmdline()
+        except psutil.Error:
+            # Renderers come and go with tabs and frames
+            continue
+        total += rss
+        if any(arg == '--type=renderer' for arg in cmdline):
+            renderer += rss
+        elif not any(arg.startswith('--type=') for arg in cmdline):
+            browser += rss
+    return {
+        'browser_rss_mb': round(browser / MB, 1),
+        'renderer_rss_mb': round(renderer / MB, 1),
+        'total_rss_mb': round(total / MB, 1),
+    }
+
+class MemoryGovernor:
+    def __init__(self, user_id=None, run_id=None, max_rss_mb=None, max_js_heap_mb=None, max_dom_nodes=None,
+                 sample_interval=None, min_recycle_interval=None):
+        self.user_id = str(user_id) if user_id else None
+        self.run_id = run_id
+        self.max_rss_mb = Config.MEMORY_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+        self.max_js_heap_mb = Config.MEMORY_MAX_JS_HEAP_MB if max_js_heap_mb is None else max_js_heap_mb
+        self.max_dom_nodes = Config.MEMORY_MAX_DOM_NODES if max_dom_nodes is None else max_dom_nodes
+        self.sample_interval = Config.MEMORY_SAMPLE_INTERVAL if sample_interval is None else sample_interval
+        self.min_recycle_interval = Config.MEMORY_MIN_RECYCLE_INTERVAL if min_recycle_interval is None else min_recycle_interval
+        self.samples = deque(maxlen=Config.MEMORY_HISTORY)
+        self.recycles = 0
+        self.started = time.monotonic()
+        self._last_sample = None
+        self._last_recycle = self.started
+        self._metrics_driver = None
+
+    def page_metrics(self, driver):
+        try:
+            if self._metrics_driver is not driver:
+                driver.execute_cdp_cmd('Performance.enable', {})
+                self._metrics_driver = driver
+            metrics = driver.execute_cdp_cmd('Performance.getMetrics', {}).get('metrics', [])
+        except Exception as e:
+            logger.warning(f"Failed to read page memory metrics: {str(e)}")
+            return {}
+        sample = {}
+        for metric in metrics:
+            field = PAGE_METRICS.get(metric.get('name'))
+            if field == 'dom_nodes':
+                sample[field] = int(metric['value'])
+            elif field:
+                sample[field] = round(metric['value'] / MB, 1)
+        return sample
+
+    def sample(self, player):
+        sample = {'timestamp': time.time(), 'uptime_s': round(time.monotonic() - self.started, 1),
+                  'loop': player.loop, 'recycles': self.recycles}
+        sample.update(process_rss(player.driver))
+        sample.update(self.page_metrics(player.driver))
+        self.samples.append(sample)
+        self._last_sample = time.monotonic()
+        self.export(sample)
+        return sample
+
+    def over_budget(self, sample):
+        """Why this sample calls for a recycle, or None."""
+        checks = (
+            ('total_rss_mb', self.max_rss_mb),
+            ('js_heap_used_mb', self.max_js_heap_mb),
+            ('dom_nodes', self.max_dom_nodes),
+        )
+        for field, budget in checks:
+            if budget and sample.get(field) is not None and sample[field] > budget:
+                return f"{field} {sample[field]} > {budget}"
+        return None
+
+    def check(self, player):
+        """Sample if due; True when the player should recycle its browser before the next loop."""
+        now = time.monotonic()
+        if self._last_sample is not None and now - self._last_sample < self.sample_interval:
+            return False
+        sample = self.sample(player)
+        if player.reporter:
+            player.reporter.context['memory'] = sample
+        reason = self.over_budget(sample)
+        if not reason:
+            return False
+        if now - self._last_recycle < self.min_recycle_interval:
+            # A budget below what a fresh browser needs would otherwise recycle every loop
+            logger.warning(f"Memory over budget ({reason}) but last recycle was {now - self._last_recycle:.0f}s ago")
+            return False
+        logger.info(f"Memory over budget ({reason}) after loop {player.loop}, recycling the browser")
+        return True
+
+    def recycled(self):
+        self.recycles += 1
+        self._last_recycle = time.monotonic()
+        # The next boundary samples the fresh browser right away
+        self._last_sample = None
+
+    def export(self, sample):
+        if not self.user_id or not self.run_id:
+            return
+        key = memory_samples_key(self.user_id, self.run_id)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.rpush(key, json.dumps(sample))
+            pipe.ltrim(key, -Config.MEMORY_HISTORY, -1)
+            pipe.expire(key, Config.MEMORY_SAMPLES_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to export memory sample for run {self.run_id}: {str(e)}")
+
+    def summary(self):
+        def peak(field):
+            values = [sample[field] for sample in self.samples if sample.get(field) is not None]
+            return max(values) if values else None
+        return {
+            'samples': len(self.samples),
+            'recycles': self.recycles,
+            'peak_total_rss_mb': peak('total_rss_mb'),
+            'peak_js_heap_used_mb': peak('js_heap_used_mb'),
+            'peak_dom_nodes': peak('dom_nodes'),
+        }
+
+def load_memory_samples(user_id, run_id):
+    return [json.loads(sample) for sample in redis_client.lrange(memory_samples_key(user_id, run_id), 0, -1)]
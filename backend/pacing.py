@@ -0,0 +1,152 @@
+"""Time-scaled playback: replays a routine faster than it was recorded.
+
+A recorded timeline keeps every hesitation of the person who recorded it. Pacing rewrites the
+gaps between actions (including the one before the first action) with three knobs, applied in
+order:
+
+    speed    every gap is divided by it
+    max_gap  no gap is longer than this many seconds
+    learn    every gap is played one exploration step below the shortest gap a successful run of
+             this routine version has used (its floor), and never below PLAYBACK_MIN_GAP
+
+Learned floors start from the recorded gaps. They only move down after a clean run: at least one
+full pass, no browser restart and no skipped action. A run that fails (an error, a crash, a
+failed playlist item, or a failure reported through /api/playback_outcome) raises the floors by
+one PLAYBACK_DELAY_STEP again and narrows the exploration step towards 1, so the gaps settle
+just above the shortest ones that keep working instead of shrinking forever. With speed or
+max_gap, learning holds their target back to what has been proven; speed and max_gap alone apply
+immediately and trust the caller.
+"""
+import logging
+from array import array
+import numpy as np
+from .config import Config
+from .redis_client import redis_client
+from .routine_format import Routine
+
+logger = logging.getLogger(__name__)
+
+# An exploration step this close to 1 has converged; the floors are then played as they are
+CONVERGED_STEP = 0.99
+
+def learned_delays_key(plan):
+    # Tied to the routine version, like the plan itself: gap i only means something for that timeline
+    return f"playback_learned_delays:{plan.routine_id}:{plan.updated_at}"
+
+def _gaps(routine):
+    # Deltas of a sorted timeline are exactly the gaps, in microseconds
+    return np.frombuffer(routine.times, dtype=np.int64)
+
+class Pacing:
+    def __init__(self, speed=None, max_gap=None, learn=None):
+        self.speed = float(Config.PLAYBACK_SPEED if speed is None else speed)
+        self.max_gap = float(Config.PLAYBACK_MAX_GAP if max_gap is None else max_gap) or None
+        self.learn = Config.PLAYBACK_LEARN_DELAYS if learn is None else bool(learn)
+        if self.speed <= 0:
+            raise ValueError("Playback speed must be positive")
+        if self.max_gap is not None and self.max_gap < 0:
+            raise ValueError("Maximum gap must not be negative")
+
+    @classmethod
+    def from_options(cls, options):
+        options = options or {}
+        return cls(options.get('speed'), options.get('max_gap'), options.get('learn_delays'))
+
+    def to_dict(self):
+        return {'speed': self.speed, 'max_gap': self.max_gap, 'learn_delays': self.learn}
+
+    @property
+    def is_identity(self):
+        return self.speed == 1.0 and self.max_gap is None and not self.learn
+
+    def apply(self, routine, floors=None, step=None):
+        """Return the routine with rewritten gaps; positions and types are shared, not copied."""
+        if self.is_identity or not len(routine):
+            return routine
+        gaps = _gaps(routine)
+        paced = gaps / self.speed
+        if self.max_gap is not None:
+            paced = np.minimum(paced, self.max_gap * 1e6)
+        if self.learn:
+            floors = gaps if floors is None or len(floors) != len(gaps) else floors
+            step = Config.PLAYBACK_DELAY_STEP if step is None else step
+            # Never slower than recorded, never more than one step below a proven gap, never below the minimum
+            learned = np.minimum(gaps, np.maximum(floors * step, Config.PLAYBACK_MIN_GAP * 1e6))
+            if self.speed == 1.0 and self.max_gap is None:
+                # No target given: the learned gaps are the target
+                paced = learned
+            else:
+                paced = np.maximum(paced, learned)
+        times = array('q', np.round(paced).astype(np.int64).tobytes())
+        return Routine(routine.types, times, routine.xs, routine.ys, routine.type_names, routine.extras,
+                       routine.coord_scale, routine.viewport_coords)
+
+def timeline_stats(routine):
+    gaps = _gaps(routine)
+    if not len(gaps):
+        return {'actions': 0, 'duration_s': 0.0, 'longest_gap_s': 0.0}
+    return {
+        'actions': len(gaps),
+        'duration_s': round(float(gaps.sum()) / 1e6, 3),
+        'longest_gap_s': round(float(gaps.max()) / 1e6, 3),
+    }
+
+def compression_stats(before, after):
+    before, after = timeline_stats(before), timeline_stats(after)
+    return {
+        'before': before,
+        'after': after,
+        'saved_s': round(before['duration_s'] - after['duration_s'], 3),
+        'speedup': round(before['duration_s'] / after['duration_s'], 2) if after['duration_s'] else None,
+    }
+
+def load_learned_delays(plan):
+    """The learned floors (None before the first outcome) and exploration step of a routine version."""
+    try:
+        data = redis_client.hgetall(learned_delays_key(plan))
+    except Exception as e:
+        logger.error(f"Failed to read learned delays for {plan.routine_name}: {str(e)}")
+        data = None
+    if not data:
+        return None, Config.PLAYBACK_DELAY_STEP
+    floors = np.frombuffer(data[b'floors'], dtype=np.int64)
+    if len(floors) != len(plan.routine):
+        floors = None
+    return floors, float(data[b'step'])
+
+def store_learned_delays(plan, floors, step):
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(learned_delays_key(plan), mapping={'floors': floors.astype(np.int64).tobytes(), 'step': step})
+        pipe.expire(learned_delays_key(plan), Config.PLAYBACK_PLAN_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to store learned delays for {plan.routine_name}: {str(e)}")
+
+def record_pacing_success(plan, played):
+    """Record the gaps of a clean run of this routine version as proven safe.
+
+    Two runs finishing at once can race here; the loser's outcome is simply learned on a later run.
+    """
+    gaps = _gaps(played)
+    floors, step = load_learned_delays(plan)
+    if floors is not None and len(floors) == len(gaps):
+        gaps = np.minimum(floors, gaps)
+    store_learned_delays(plan, gaps, step)
+
+def record_pacing_failure(plan):
+    """Back off after a failed run: floors one step up (at most the recorded gaps), smaller steps."""
+    recorded = _gaps(plan.routine)
+    floors, step = load_learned_delays(plan)
+    floors = recorded if floors is None else np.minimum(recorded, np.round(floors / Config.PLAYBACK_DELAY_STEP))
+    step = step ** 0.5
+    if step > CONVERGED_STEP:
+        step = 1.0
+    logger.info(f"Learned pacing for {plan.routine_name} backed off, next exploration step {step:.3f}")
+    store_learned_delays(plan, floors, step)
+
+def pace_plan(plan, pacing):
+    """The routine to play for this plan and pacing, plus its duration before and after."""
+    floors, step = load_learned_delays(plan) if pacing.learn else (None, None)
+    routine = pacing.apply(plan.routine, floors, step)
+    return routine, compression_stats(plan.routine, routine)
@@ -0,0 +1,95 @@
+import json
+import struct
+import logging
+from .calibration import Calibrator
+from .config import Config
+from .redis_client import redis_client
+from .routine_format import Routine, load_routine
+
+logger = logging.getLogger(__name__)
+
+_META_LENGTH = struct.Struct('<I')
+
+def plan_key(routine_id, updated_at):
+    return f"playback_plan:{routine_id}:{updated_at}"
+
+def plan_ref_key(user_id, routine_name):
+    return f"playback_plan_ref:{user_id}:{routine_name}"
+
+class PlaybackPlan:
+    """A routine compiled for playback: sorted, typed, calibrated and ready to hand to a Player."""
+
+    def __init__(self, routine_id, routine_name, updated_at, routine, tokens_per_run=None, calibrated=False):
+        self.routine_id = routine_id
+        self.routine_name = routine_name
+        self.updated_at = updated_at
+        self.routine = routine
+        self.tokens_per_run = tokens_per_run
+        self.calibrated = calibrated
+
+    @property
+    def key(self):
+        return plan_key(self.routine_id, self.updated_at)
+
+    def to_bytes(self):
+        meta = json.dumps({
+            'routine_id': self.routine_id,
+            'routine_name': self.routine_name,
+            'updated_at': self.updated_at,
+            'tokens_per_run': self.tokens_per_run,
+            'calibrated': self.calibrated,
+        }).encode()
+        return _META_LENGTH.pack(len(meta)) + meta + self.routine.encode()
+
+    @classmethod
+    def from_bytes(cls, data):
+        (meta_length,) = _META_LENGTH.unpack_from(data)
+        meta = json.loads(data[_META_LENGTH.size:_META_LENGTH.size + meta_length])
+        routine = Routine.decode(data[_META_LENGTH.size + meta_length:])
+        return cls(meta['routine_id'], meta['routine_name'], meta['updated_at'], routine,
+                   meta.get('tokens_per_run'), meta.get('calibrated', False))
+
+def compile_plan(routine_row, calibration=None):
+    routine = load_routine(routine_row['steps']).sorted_by_time()
+    calibrated = False
+    if calibration and not routine.viewport_coords:
+        calibrator = Calibrator(calibration.get('browser'), calibration.get('recorder'), calibration.get('player'))
+        # Calibration points are window fractions, so only routines in that space can be calibrated
+        coordinates = [action for action in routine if action.x is not None]
+        if calibrator.is_calibrated() and all(0 <= action.x <= 1 and 0 <= action.y <= 1 for action in coordinates):
+            calibrator.calibrate()
+            routine = calibrator.transform_routine(routine, mode='play')
+            calibrated = True
+    return PlaybackPlan(routine_row['id'], routine_row['name'], routine_row.get('updated_at') or routine_row.get('created_at'),
+                        routine, routine_row.get('tokens_per_run'), calibrated)
+
+def store_plan(plan, user_id):
+    pipe = redis_client.pipeline()
+    pipe.set(plan.key, plan.to_bytes(), ex=Config.PLAYBACK_PLAN_TTL)
+    pipe.set(plan_ref_key(user_id, plan.routine_name), plan.key, ex=Config.PLAYBACK_PLAN_TTL)
+    pipe.execute()
+    logger.info(f"Cached playback plan {plan.key} ({len(plan.routine)} actions, calibrated={plan.calibrated})")
+
+def get_cached_plan(user_id, routine_name):
+    try:
+        key = redis_client.get(plan_ref_key(user_id, routine_name))
+        data = redis_client.get(key) if key else None
+    except Exception as e:
+        logger.error(f"Failed to read cached playback plan: {str(e)}")
+        return None
+    return PlaybackPlan.from_bytes(data) if data else None
+
+def invalidate_plan(user_id, routine_name):
+    redis_client.delete(plan_ref_key(user_id, routine_name))
+
+def invalidate_routine_plans(routine_name):
+    # Every user's plan for this routine name, for deletes that are not scoped to a user
+    keys = list(redis_client.scan_iter(match=plan_ref_key('*', routine_name)))
+    if keys:
+        redis_client.delete(*keys)
+
+def invalidate_user_plans(user_id):
+    # Used when calibration changes, which every plan of the user depends on
+    keys = list(redis_client.scan_iter(match=plan_ref_key(user_id, '*')))
+    if keys:
+        redis_client.delete(*keys)
@@ -1,61 +1,108 @@
 import time
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
+from itertools import islice
+from selenium.webdriver.common.actions.action_builder import ActionBuilder
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-import os
+from selenium.common.exceptions import TimeoutException, MoveTargetOutOfBoundsException, WebDriverException
+from .browser import build_chrome_options, launch_browser, BrowserCrashed
+from .profiles import provision_standalone_profile
+from .config import Config
+from .timing import ActionScheduler
+from .control import SignalChannel, SIGNAL_BINDING
+from .routine_format import load_routine
+from .tracing import StartupTrace
+from .memory import MemoryGovernor
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class Player:
-    def __init__(self, routine_name, actions, repeat=False):
+    def __init__(self, routine_name, actions, repeat=False, session=None, show_overlay=None, reporter=None, run_id=None, trace=None,
+                 autostart=False):
         self.routine_name = routine_name
-        self.actions = actions
+        self.routine = load_routine(actions)
         self.driver = None
-        self.start_time = None
+        self.scheduler = ActionScheduler()
         self.is_playing = False
+        self.paused = False
         self.repeat = repeat
+        # Unattended runs (e.g. scheduled ones): play without the start key and end after a solo pass
+        self.autostart = autostart
         self.stop_requested = False
         self.session_active = True
-        self.chrome_options = self.setup_chrome_options()
+        self.session = session
+        self.show_overlay = Config.PLAYER_SHOW_OVERLAY if show_overlay is None else show_overlay
+        self.viewport = None
+        self.signals = SignalChannel()
+        # Progress sampled by the status reporter; plain ints so the click loop pays nothing
+        self.action_index = 0
+        self.loop = 0
+        # Watchdog heartbeat: when the WebDriver command in flight was sent, None between commands
+        self.busy_since = None
+        # Set while a planned relaunch swaps the browser, so the watchdog does not take it for a crash
+        self.recycling = False
+        self.resume_index = 0
+        self.reporter = reporter
+        self.run_id = run_id
+        self.trace = trace or StartupTrace(kind='playback', routine_name=routine_name, run_id=run_id)
+        # Only repeat runs live long enough to leak their way into swap
+        self.governor = MemoryGovernor(reporter.user_id if reporter else None, run_id) if repeat and Config.MEMORY_GOVERNOR else None
+        # Only needed when no leased session is passed in
+        self.chrome_options = None if session else self.setup_chrome_options()
 
     def setup_chrome_options(self):
-        chrome_options = Options()
-        chrome_options.add_argument("--start-maximized")
-        chrome_options.add_argument("--disable-notifications")
-        chrome_options.add_argument("--disable-infobars")
-        chrome_options.add_argument("--disable-extensions")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        
-        prefs = {"credentials_enable_service": False,
-                 "profile.password_manager_enabled": False}
-        chrome_options.add_experimental_option("prefs", prefs)
-        
-        # Use the root chrome_user_data directory
-        user_data_dir = os.path.join(os.getcwd(), "chrome_user_data")
-        chrome_options.add_argument(f"user-data-dir={user_data_dir}")
-        
-        return chrome_options
+        # Its own working copy of the template profile, never the template itself
+        return build_chrome_options(provision_standalone_profile())
 
-    def start(self):
-        self.driver = webdriver.Chrome(options=self.chrome_options)
-        self.driver.get('https://web.telegram.org/k/')
-        self.driver.fullscreen_window()
+    def start(self, wait_for_start=True):
+        trace = self.trace
+        if self.session:
+            # Leased sessions are already launched, navigated and fullscreen
+            self.driver = self.session.driver
+        else:
+            self.driver = launch_browser(self.chrome_options, trace)
+        self.invalidate_viewport()
+        with trace.span('attach_signals'):
+            self.signals.attach(self.driver)
+        if self.run_id:
+            # Remote stop/pause/resume from any process: send_control(run_id, signal)
+            with trace.span('subscribe_control'):
+                self.signals.subscribe(self.run_id)
         logger.info(f"Started player for routine: {self.routine_name}")
         
-        self.setup_ui()
-        self.setup_start_trigger()
-        self.wait_for_start_signal()
+        with trace.span('setup_ui'):
+            self.setup_ui()
+        with trace.span('setup_start_trigger'):
+            self.setup_start_trigger()
+        trace.mark('ready')
+        if not wait_for_start:
+            return
+        if self.autostart:
+            self.begin_playback()
+        else:
+            with trace.span('wait_for_start'):
+                self.wait_for_start_signal()
+
+    def checkpoint(self):
+        return {'loop': self.loop, 'action_index': self.action_index, 'playing': self.is_playing}
+
+    def resume(self, checkpoint):
+        """Continue a run whose browser died: straight back to the checkpointed action, no start key."""
+        if not checkpoint['playing']:
+            # It was waiting for the start key, so it waits again
+            self.start()
+            return
+        self.start(wait_for_start=False)
+        self.loop = checkpoint['loop']
+        self.resume_index = checkpoint['action_index'] if Config.PLAYBACK_RESUME_FROM == 'action' else 0
+        # The action that was in flight is due right away
+        self.scheduler.start(offset=self.routine.time_at(self.resume_index) if self.resume_index else 0.0)
+        self.is_playing = True
+        self.stop_requested = False
+        self.driver.execute_script("document.getElementById('playing-indicator').style.display = 'block';")
+        logger.info(f"Resumed routine {self.routine_name} at loop {self.loop}, action {self.resume_index}")
 
     def setup_ui(self):
         js_code = """
@@ -85,65 +132,141 @@ class Player:
         document.body.appendChild(playingIndicator);
         """
         self.driver.execute_script(js_code)
+        if self.show_overlay:
+            self.install_click_indicator()
 
     def setup_start_trigger(self):
         js_code = """
-        document.addEventListener('keydown', function(e) {
-            if (e.key === '9') {
-                window.dispatchEvent(new CustomEvent('startPlayback'));
-            } else if (e.key === '0') {
-                window.dispatchEvent(new CustomEvent('stopPlayback'));
-            }
-        });
-        """
+        if (!window.playbackTriggerInstalled) {
+            window.playbackTriggerInstalled = true;
+            document.addEventListener('keydown', function(e) {
+                var signal = e.key === '9' ? 'start' : e.key === '0' ? 'stop' : null;
+                if (!signal) {
+                    return;
+                }
+                // Pushed straight to the player through the DevTools binding when it is attached
+                if (typeof window.%s === 'function') {
+                    window.%s(signal);
+                }
+                window.dispatchEvent(new CustomEvent(signal === 'start' ? 'startPlayback' : 'stopPlayback'));
+            });
+        }
+        """ % (SIGNAL_BINDING, SIGNAL_BINDING)
         self.driver.execute_script(js_code)
 
     def wait_for_start_signal(self):
         logger.info("Waiting for '9' key press to start/resume playback...")
         self.driver.execute_script("""
         window.playbackStarted = false;
-        window.addEventListener('startPlayback', function() {
-            window.playbackStarted = true;
-        });
-        window.addEventListener('stopPlayback', function() {
-            window.playbackStopped = true;
-        });
+        if (!window.playbackListenersInstalled) {
+            window.playbackListenersInstalled = true;
+            window.addEventListener('startPlayback', function() {
+                window.playbackStarted = true;
+            });
+            window.addEventListener('stopPlayback', function() {
+                window.playbackStopped = true;
+            });
+        }
         """)
         
-        try:
-            WebDriverWait(self.driver, 600).until(
-                lambda d: d.execute_script("return window.playbackStarted === true || window.playbackStopped === true;")
-            )
-        except TimeoutException:
+        if self.signals.push_enabled:
+            self.signals.clear()
+            signal = self.signals.wait(600)
+            # Pause and resume only mean something once playback is running
+            while signal in ('pause', 'resume'):
+                signal = self.signals.wait(600)
+            if signal == 'crashed':
+                raise BrowserCrashed("Browser stopped responding while waiting for the start signal")
+        else:
+            signal = self.poll_start_signal()
+
+        if signal is None:
             logger.info("Playback start/stop timed out after 10 minutes.")
             self.session_active = False
             return
         
-        if self.driver.execute_script("return window.playbackStopped === true;"):
+        if signal == 'stop':
             logger.info("Stop signal received. Closing session.")
             self.session_active = False
             return
 
         logger.info("Playback start signal received.")
-        self.start_time = time.time()
+        self.begin_playback()
+
+    def begin_playback(self):
+        self.scheduler.start()
         self.is_playing = True
         self.stop_requested = False
         self.driver.execute_script("document.getElementById('playing-indicator').style.display = 'block';")
 
+    def poll_start_signal(self):
+        # Fallback for drivers without a reachable DevTools endpoint
+        remote = []
+        def signalled(driver):
+            # Remote start/stop still arrive through the signal queue
+            signal = self.signals.poll()
+            if signal in ('start', 'stop'):
+                remote.append(signal)
+                return True
+            return driver.execute_script("return window.playbackStarted === true || window.playbackStopped === true;")
+        try:
+            WebDriverWait(self.driver, 600).until(signalled)
+        except TimeoutException:
+            return None
+        if remote:
+            return remote[0]
+        if self.driver.execute_script("return window.playbackStopped === true;"):
+            return 'stop'
+        return 'start'
+
+    def handle_signals(self):
+        # Non-blocking unless paused; a pushed stop takes effect before the next action
+        signal = self.signals.poll()
+        while signal is not None:
+            if signal == 'crashed':
+                raise BrowserCrashed(f"Browser stopped responding during routine {self.routine_name}")
+            if signal == 'stop':
+                logger.info("Stop signal received during playback. Closing session.")
+                self.stop_requested = True
+                self.is_playing = False
+                self.session_active = False
+                self.paused = False
+                return
+            if signal == 'pause' and not self.paused:
+                logger.info("Playback paused")
+                self.paused = True
+                self.scheduler.pause()
+            elif signal == 'resume' and self.paused:
+                logger.info("Playback resumed")
+                self.paused = False
+                self.scheduler.resume()
+            if self.paused:
+                # Block here until resume or stop; nothing else runs while paused
+                signal = self.signals.wait(Config.PLAYER_PAUSE_TIMEOUT)
+                if signal is None:
+                    logger.info("Playback paused for too long, stopping")
+                    signal = 'stop'
+            else:
+                signal = self.signals.poll()
+
     def play(self):
-        if not self.actions['actions']:
+        if not len(self.routine):
             logger.warning("No actions to play")
             return
 
+        if self.reporter:
+            self.reporter.watch(self)
         while self.session_active:
             if self.is_playing:
-                for action in self.actions['actions']:
-                    if self.stop_requested:
-                        break
-                    self.wait_for_action_time(action['time'])
-                    if action['type'] == 'click':
-                        self.perform_click(action['x'], action['y'])
+                self.play_pass(self.resume_index)
+                self.resume_index = 0
                 
+                if not self.session_active:
+                    break
+                self.loop += 1
+                if not self.repeat and self.autostart:
+                    logger.info("Solo playback completed")
+                    break
                 if not self.repeat:
                     self.is_playing = False
                     logger.info("Solo playback completed, waiting for user input")
@@ -152,67 +275,148 @@ class Player:
                     document.getElementById('playing-indicator').style.display = 'none';
                     """)
                 else:
-                    self.start_time = time.time()  # Reset start time for next iteration
+                    if self.governor and self.governor.check(self):
+                        self.recycle_browser()
+                    self.scheduler.start()  # Reset start time for next iteration
             else:
                 # Wait for user input to start playing again or stop
                 self.wait_for_start_signal()
                 if not self.session_active:
                     break
 
-        logger.info("Playback session ended")
+        logger.info(f"Playback session ended, drift: {self.scheduler.stats()}")
         self.driver.execute_script("""
         document.getElementById('playback-status').innerHTML = 'Playback session ended';
         document.getElementById('playing-indicator').style.display = 'none';
         """)
-        self.driver.quit()
+        self.close_driver()
+
+    def play_pass(self, start_index=0):
+        """One pass over the routine from the current scheduler origin; False if it was stopped."""
+        actions = enumerate(self.routine)
+        if start_index:
+            actions = islice(actions, start_index, None)
+        for index, action in actions:
+            self.action_index = index
+            self.handle_signals()
+            if self.stop_requested:
+                return False
+            if not self.wait_for_action_time(action.time):
+                continue
+            if action.type == 'click':
+                self.perform_click(action.x, action.y)
+                if index == 0:
+                    self.trace.mark('first_action')
+        return not self.stop_requested
+
+    def recycle_browser(self):
+        # Between loops only, so the next iteration simply starts in a fresh browser
+        self.recycling = True
+        try:
+            if self.session:
+                self.session.relaunch()
+                self.driver = self.session.driver
+            else:
+                try:
+                    self.driver.quit()
+                except WebDriverException as e:
+                    logger.warning(f"Failed to quit browser before relaunch: {str(e)}")
+                self.driver = launch_browser(self.chrome_options)
+        finally:
+            self.recycling = False
+        self.invalidate_viewport()
+        self.signals.reattach(self.driver)
+        self.setup_ui()
+        self.setup_start_trigger()
+        self.driver.execute_script("document.getElementById('playing-indicator').style.display = 'block';")
+        self.governor.recycled()
+        logger.info(f"Relaunched browser for routine {self.routine_name} ({self.governor.recycles} so far)")
 
     def wait_for_action_time(self, action_time):
-        current_time = time.time() - self.start_time
-        wait_time = max(0, action_time - current_time)
-        if wait_time > 0:
-            logger.debug(f"Waiting for {wait_time:.2f} seconds before next action")
-            time.sleep(wait_time)
+        # Signals cut the wait short, so stop/pause land within milliseconds even across long gaps
+        while True:
+            due = self.scheduler.wait_until(action_time, interrupt=self.signals.pending)
+            if due is not None:
+                return due
+            self.handle_signals()
+            if self.stop_requested:
+                return False
+
+    def viewport_size(self):
+        # Cached per session; only refreshed after a resize invalidates it
+        if self.viewport is None:
+            self.viewport = self.driver.get_window_size()
+        return self.viewport
+
+    def invalidate_viewport(self):
+        self.viewport = None
 
     def perform_click(self, x, y):
-        window_size = self.driver.get_window_size()
+        self.busy_since = time.monotonic()
+        window_size = self.viewport_size()
         actual_x = int(x * window_size['width'])
         actual_y = int(y * window_size['height'])
-        logger.info(f"Clicking at relative position ({x}, {y}), actual position ({actual_x}, {actual_y})")
-        self.show_click_indicator(actual_x, actual_y)
-        actions = ActionChains(self.driver)
-        actions.move_by_offset(actual_x, actual_y).click().perform()
-        actions.move_by_offset(-actual_x, -actual_y).perform()  # Reset mouse position
+        logger.debug(f"Clicking at relative position ({x}, {y}), actual position ({actual_x}, {actual_y})")
+        try:
+            self.dispatch_click(actual_x, actual_y)
+        except MoveTargetOutOfBoundsException:
+            # The window was resized since the viewport was cached
+            self.invalidate_viewport()
+            window_size = self.viewport_size()
+            self.dispatch_click(int(x * window_size['width']), int(y * window_size['height']))
+        self.busy_since = None
 
-    def show_click_indicator(self, x, y):
+    def dispatch_click(self, x, y):
+        # Absolute pointer move plus click in a single W3C actions request
+        actions = ActionBuilder(self.driver)
+        actions.pointer_action.move_to_location(x, y).click()
+        actions.perform()
+
+    def install_click_indicator(self):
+        # Draws indicators from the page's own pointer events, so clicks need no extra round trip
         js_code = """
-        var clickIndicator = document.createElement('div');
-        clickIndicator.style.position = 'fixed';
-        clickIndicator.style.left = arguments[0] + 'px';
-        clickIndicator.style.top = arguments[1] + 'px';
-        clickIndicator.style.width = '10px';
-        clickIndicator.style.height = '10px';
-        clickIndicator.style.borderRadius = '50%';
-        clickIndicator.style.backgroundColor = 'rgba(0, 255, 0, 0.5)';
-        clickIndicator.style.zIndex = '9999';
-        document.body.appendChild(clickIndicator);
-        setTimeout(function() {
-            clickIndicator.remove();
-        }, 2000);
+        if (!window.clickIndicatorInstalled) {
+            window.clickIndicatorInstalled = true;
+            document.addEventListener('pointerdown', function(e) {
+                var clickIndicator = document.createElement('div');
+                clickIndicator.style.position = 'fixed';
+                clickIndicator.style.left = e.clientX + 'px';
+                clickIndicator.style.top = e.clientY + 'px';
+                clickIndicator.style.width = '10px';
+                clickIndicator.style.height = '10px';
+                clickIndicator.style.borderRadius = '50%';
+                clickIndicator.style.backgroundColor = 'rgba(0, 255, 0, 0.5)';
+                clickIndicator.style.zIndex = '9999';
+                clickIndicator.style.pointerEvents = 'none';
+                document.body.appendChild(clickIndicator);
+                setTimeout(function() {
+                    clickIndicator.remove();
+                }, 2000);
+            }, {capture: true, passive: true});
+        }
         """
-        self.driver.execute_script(js_code, x, y)
+        self.driver.execute_script(js_code)
 
     def stop(self):
         self.stop_requested = True
         self.is_playing = False
         self.session_active = False
-        if self.driver:
-            self.driver.quit()
+        self.signals.post('stop')
+        self.close_driver()
         logger.info(f"Stopped playback for routine: {self.routine_name}")
 
-def start_playback(routine_name, actions, repeat=False):
+    def close_driver(self):
+        self.signals.detach()
+        # Leased sessions are handed back to the pool by the caller instead
+        if self.driver and not self.session:
+            self.driver.quit()
+
+def start_playback(routine_name, actions, repeat=False, session=None, show_overlay=None, reporter=None, run_id=None, trace=None,
+                   autostart=False):
     logger.info(f"Starting {'repeat' if repeat else 'solo'} playback for routine: {routine_name}")
-    logger.info(f"Number of actions: {len(actions['actions'])}")
     logger.info(f"Repeat: {repeat}")
-    player = Player(routine_name, actions, repeat)
+    player = Player(routine_name, actions, repeat, session=session, show_overlay=show_overlay, reporter=reporter, run_id=run_id, trace=trace,
+                    autostart=autostart)
+    logger.info(f"Number of actions: {len(player.routine)}")
     player.start()
     return player
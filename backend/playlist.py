@@ -0,0 +1,219 @@
+"""Playlists: several routines played back to back in one browser session.
+
+Each item names a routine and can add
+
+    repeat    how many passes of the routine to play (default 1)
+    navigate  steps run before its first pass: {"type": "navigate", "url": ...},
+              {"type": "click", "x": ..., "y": ...} (window fractions) or {"type": "wait", "seconds": ...}
+    reset     how the page is brought back before the item runs: none, reload, home or session
+              (default PLAYLIST_RESET; the first item starts from a freshly leased session)
+
+Items that fail are recorded and followed by a full session reset, so one broken routine does not
+end the playlist. A stop ends the current item and skips the rest.
+"""
+import time
+import logging
+from selenium.common.exceptions import WebDriverException
+from .browser import TELEGRAM_WEB_URL
+from .config import Config
+from .player import Player
+from .timing import ActionScheduler
+
+logger = logging.getLogger(__name__)
+
+NAVIGATION_STEPS = ('navigate', 'click', 'wait')
+
+def reset_none(player):
+    pass
+
+def reset_reload(player):
+    player.driver.refresh()
+
+def reset_home(player):
+    player.driver.get(TELEGRAM_WEB_URL)
+
+def reset_session(player):
+    # Same cleanup the pool runs between leases: extra windows closed, back on Telegram
+    if player.session:
+        player.session.reset()
+    else:
+        reset_home(player)
+
+RESET_HOOKS = {
+    'none': reset_none,
+    'reload': reset_reload,
+    'home': reset_home,
+    'session': reset_session,
+}
+
+class PlaylistItem:
+    def __init__(self, name, repeat=1, navigate=None, reset=None):
+        self.name = name
+        self.repeat = int(repeat)
+        self.navigate = list(navigate or [])
+        self.reset = reset or Config.PLAYLIST_RESET
+        # Set by the task once the item's plan is loaded
+        self.routine = None
+        if not name:
+            raise ValueError("Every playlist item needs a routine name")
+        if self.repeat < 1:
+            raise ValueError(f"Repeat count for {name} must be at least 1")
+        if self.reset not in RESET_HOOKS:
+            raise ValueError(f"Unknown reset hook for {name}: {self.reset}")
+        for step in self.navigate:
+            if not isinstance(step, dict) or step.get('type') not in NAVIGATION_STEPS:
+                raise ValueError(f"Navigation steps for {name} must be one of: {', '.join(NAVIGATION_STEPS)}")
+
+    @classmethod
+    def from_options(cls, options):
+        if isinstance(options, str):
+            return cls(options)
+        if not isinstance(options, dict):
+            raise ValueError("Playlist items must be routine names or objects")
+        return cls(options.get('name'), options.get('repeat', 1), options.get('navigate'), options.get('reset'))
+
+    def to_dict(self):
+        return {'name': self.name, 'repeat': self.repeat, 'navigate': self.navigate, 'reset': self.reset}
+
+def parse_playlist(items):
+    if not isinstance(items, list) or not items:
+        raise ValueError("A playlist needs at least one item")
+    if len(items) > Config.PLAYLIST_MAX_ITEMS:
+        raise ValueError(f"A playlist can have at most {Config.PLAYLIST_MAX_ITEMS} items")
+    return [PlaylistItem.from_options(item) for item in items]
+
+class PlaylistPlayer(Player):
+    """Plays every item of a playlist after a single start signal, reusing one driver throughout.
+
+    Each item gets its own scheduler, so the drift reported per item is that routine's alone.
+    """
+
+    def __init__(self, playlist_name, items, session=None, show_overlay=None, reporter=None, run_id=None, trace=None):
+        super().__init__(playlist_name, items[0].routine, session=session, show_overlay=show_overlay,
+                         reporter=reporter, run_id=run_id, trace=trace)
+        self.items = items
+        self.item_index = 0
+        self.results = []
+
+    def play(self):
+        if self.reporter:
+            self.reporter.watch(self)
+        needs_reset = False
+        for position, item in enumerate(self.items):
+            if not self.session_active:
+                self.results.append(self.item_result(position, item, 'skipped'))
+                continue
+            result = self.play_item(position, item, needs_reset)
+            self.results.append(result)
+            # After a failure the page is in an unknown state, whatever the next item asks for
+            needs_reset = result['status'] == 'failed'
+            if self.reporter:
+                self.reporter.context['items'] = self.results
+                self.reporter.publish('item_finished', item=result)
+
+        self.is_playing = False
+        logger.info(f"Playlist {self.routine_name} ended: {self.summary()}")
+        try:
+            self.driver.execute_script("""
+            document.getElementById('playback-status').innerHTML = 'Playlist ended';
+            document.getElementById('playing-indicator').style.display = 'none';
+            """)
+        except WebDriverException as e:
+            logger.warning(f"Failed to update playlist status: {str(e)}")
+        self.close_driver()
+
+    def play_item(self, position, item, force_reset=False):
+        self.item_index = position
+        self.routine = item.routine
+        self.scheduler = ActionScheduler()
+        self.action_index = 0
+        self.loop = 0
+        if self.reporter:
+            self.reporter.context['item'] = {'index': position, 'routine_name': item.name, 'repeat': item.repeat}
+        logger.info(f"Playlist {self.routine_name}: item {position + 1}/{len(self.items)} {item.name} x{item.repeat}")
+
+        started = time.monotonic()
+        try:
+            if position or force_reset:
+                self.reset_page('session' if force_reset else item.reset)
+            self.show_item_status(position, item)
+            self.run_navigation(item.navigate)
+            while self.loop < item.repeat and not self.stop_requested:
+                self.scheduler.start()
+                if not self.play_pass():
+                    break
+                self.loop += 1
+        except WebDriverException as e:
+            logger.error(f"Playlist item {item.name} failed: {str(e)}")
+            return self.item_result(position, item, 'failed', time.monotonic() - started, error=str(e))
+        status = 'stopped' if self.stop_requested else 'completed'
+        return self.item_result(position, item, status, time.monotonic() - started)
+
+    def item_result(self, position, item, status, duration=0.0, error=None):
+        result = {
+            'index': position,
+            'routine_name': item.name,
+            'repeat': item.repeat,
+            'passes': self.loop if status != 'skipped' else 0,
+            'status': status,
+            'duration_s': round(duration, 3),
+        }
+        if status != 'skipped':
+            result['drift'] = self.scheduler.stats()
+        if error:
+            result['error'] = error
+        return result
+
+    def summary(self):
+        counts = {}
+        for result in self.results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        return counts
+
+    def reset_page(self, hook):
+        if hook == 'none':
+            return
+        logger.debug(f"Resetting page with '{hook}' before next playlist item")
+        RESET_HOOKS[hook](self)
+        # Reloads and navigations drop the overlay and the key trigger; the window may have changed too
+        self.invalidate_viewport()
+        self.setup_ui()
+        self.setup_start_trigger()
+
+    def show_item_status(self, position, item):
+        self.driver.execute_script("""
+        var status = document.getElementById('playback-status');
+        if (status) { status.innerHTML = arguments[0]; }
+        var indicator = document.getElementById('playing-indicator');
+        if (indicator) { indicator.style.display = 'block'; }
+        """, f"Playlist item {position + 1}/{len(self.items)}: {item.name}<br>Press 0 to stop and close")
+
+    def run_navigation(self, steps):
+        for step in steps:
+            self.handle_signals()
+            if self.stop_requested:
+                return
+            if step['type'] == 'navigate':
+                self.driver.get(step['url'])
+                self.invalidate_viewport()
+                self.setup_ui()
+                self.setup_start_trigger()
+            elif step['type'] == 'click':
+                self.perform_click(float(step['x']), float(step['y']))
+            else:
+                self.wait_interruptibly(float(step.get('seconds', 0)))
+
+    def wait_interruptibly(self, seconds):
+        # Like the gaps between actions, a stop or pause cuts a navigation wait short
+        deadline = time.monotonic() + seconds
+        remaining = seconds
+        while remaining > 0 and not self.stop_requested:
+            if self.signals.pending.wait(remaining):
+                self.handle_signals()
+            remaining = deadline - time.monotonic()
+
+def start_playlist(playlist_name, items, session=None, show_overlay=None, reporter=None, run_id=None, trace=None):
+    logger.info(f"Starting playlist {playlist_name}: {', '.join(item.name for item in items)}")
+    player = PlaylistPlayer(playlist_name, items, session=session, show_overlay=show_overlay, reporter=reporter, run_id=run_id, trace=trace)
+    player.start()
+    return player
@@ -0,0 +1,406 @@
+"""Browser profile provisioning: working copies cloned from one golden template profile.
+
+The template (PROFILE_TEMPLATE_DIR, by default CHROME_USER_DATA_DIR) is the profile an operator
+logs into once. Chrome refuses to share a profile between processes, so every slot, pooled
+session and standalone player gets its own working copy under PROFILE_ROOT, cloned file by file
+as cheaply as the filesystem allows:
+
+    reflink   copy-on-write clone (Btrfs, XFS, APFS, ...): no data is copied until a side writes
+    hardlink  only for files Chrome never rewrites in place (LevelDB tables), shares the inode
+    copy      everything else, and every file when PROFILE_CLONE_METHOD=copy
+
+Caches, crash dumps and lock files are never cloned. Each copy keeps a manifest of the template
+files it was made from, so provisioning an existing copy only re-clones what the template changed
+since; state the copy changed itself is kept otherwise. With PROFILE_SYNC_BACK, the state
+directories in PROFILE_SYNC_PATHS (logins, local storage) that a session changed are written
+back to the template when the session closes, for every other copy to pick up. Copies unused for
+PROFILE_MAX_IDLE are removed by collect_garbage().
+
+    python -m backend.profiles status|gc|provision NAME|sync NAME
+"""
+import os
+import sys
+import json
+import stat
+import time
+import errno
+import shutil
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from .config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: no reflinks, and template access is not locked across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = '.dropfarm-profile.json'
+TEMPLATE_LOCK = '.template.lock'
+# Linux FICLONE ioctl
+FICLONE = 0x40049409
+
+# Rebuilt by Chrome on demand, or only meaningful to the process that wrote them
+SKIPPED_NAMES = frozenset({
+    'SingletonLock', 'SingletonSocket', 'SingletonCookie', 'lockfile', 'LOCK',
+    'Cache', 'Code Cache', 'GPUCache', 'ShaderCache', 'GrShaderCache', 'GraphiteDawnCache', 'DawnCache',
+    'Crashpad', 'Crash Reports', 'BrowserMetrics',
+})
+# LevelDB tables are written once and only ever deleted, so a shared inode is never modified
+IMMUTABLE_SUFFIXES = ('.ldb', '.sst')
+# errnos meaning "this filesystem cannot reflink", as opposed to a real I/O failure
+NO_REFLINK_ERRNOS = {errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS}
+
+def scan(root, top=''):
+    """Relative path -> [size, mtime_ns] for every clonable regular file under root/top."""
+    files = {}
+    start = os.path.join(root, top)
+    if top and os.path.isfile(start):
+        return {os.path.normpath(top): file_stat(start)}
+    for dirpath, dirnames, filenames in os.walk(start):
+        dirnames[:] = [name for name in dirnames if name not in SKIPPED_NAMES]
+        for name in filenames:
+            if name in SKIPPED_NAMES or name == MANIFEST or name == TEMPLATE_LOCK:
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files[os.path.relpath(path, root)] = [st.st_size, st.st_mtime_ns]
+    return files
+
+def file_stat(path):
+    st = os.lstat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks need fcntl")
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+def in_use(path):
+    """Whether a Chrome process still holds the profile; unknown owners count as running."""
+    try:
+        owner = os.readlink(os.path.join(path, 'SingletonLock'))
+    except OSError:
+        return False
+    host, _, pid = owner.rpartition('-')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError):
+        return True
+    return True
+
+def _within(rel, unit):
+    return rel == unit or rel.startswith(unit + os.sep)
+
+class ProfileManager:
+    def __init__(self, template_dir=None, root=None, method=None):
+        self.template_dir = template_dir or Config.PROFILE_TEMPLATE_DIR
+        self.root = root or Config.PROFILE_ROOT
+        self.method = method or Config.PROFILE_CLONE_METHOD
+        if self.method not in ('reflink', 'hardlink', 'copy'):
+            raise ValueError(f"Unknown profile clone method: {self.method}")
+        # Flipped off on the first clone the filesystem refuses, so later files skip the attempt
+        self.reflink_supported = self.method == 'reflink'
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, name):
+        return os.path.join(self.root, name)
+
+    def manages(self, path):
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.root)
+
+    @contextmanager
+    def template_lock(self, exclusive=False):
+        # Provisioning reads the template under a shared lock; sync-back replaces parts of it exclusively
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, TEMPLATE_LOCK), 'a+') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def clone_file(self, src, dst):
+        if self.reflink_supported:
+            try:
+                reflink(src, dst)
+                return 'reflink'
+            except OSError as e:
+                if os.path.exists(dst):
+                    os.unlink(dst)
+                if e.errno not in NO_REFLINK_ERRNOS:
+                    raise
+                logger.info(f"Reflinks unsupported under {self.root} ({str(e)}), falling back to hardlinks and copies")
+                self.reflink_supported = False
+        if self.method != 'copy' and src.endswith(IMMUTABLE_SUFFIXES):
+            try:
+                os.link(src, dst)
+                return 'hardlink'
+            except OSError:
+                pass
+        shutil.copy2(src, dst)
+        return 'copy'
+
+    def read_manifest(self, path):
+        try:
+            with open(os.path.join(path, MANIFEST)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_manifest(self, path, manifest):
+        target = os.path.join(path, MANIFEST)
+        with open(target + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(target + '.tmp', target)
+
+    def provision(self, name):
+        """Create or refresh the working copy `name` and return its path."""
+        path = self.path_for(name)
+        if in_use(path):
+            logger.warning(f"Profile {name} is in use, launching on it unchanged")
+            return path
+        started = time.monotonic()
+        with self.template_lock():
+            template_files = scan(self.template_dir)
+            manifest = self.read_manifest(path)
+            if manifest is None:
+                manifest = self._clone_fresh(path, template_files)
+            else:
+                self._refresh(path, manifest, template_files)
+            manifest['provisioned_at'] = time.time()
+            manifest['seconds'] = round(time.monotonic() - started, 3)
+            self.write_manifest(path, manifest)
+        logger.info(f"Provisioned profile {name} in {manifest['seconds']}s: {manifest['last_clone']}")
+        return path
+
+    def _clone_fresh(self, path, template_files):
+        # Built next to the target and renamed into place, so an interrupted clone never looks complete
+        staging = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        if os.path.exists(path):
+            # A copy without a manifest is left over from before cloning, or broken: start over
+            shutil.rmtree(path)
+        manifest = {'template': self.template_dir, 'files': {}}
+        counts = self._clone_files(self.template_dir, staging, template_files, manifest['files'])
+        os.makedirs(staging, exist_ok=True)
+        os.rename(staging, path)
+        manifest['last_clone'] = counts
+        return manifest
+
+    def _refresh(self, path, manifest, template_files):
+        files = manifest['files']
+        changed = {rel: st for rel, st in template_files.items() if files.get(rel, [None, None])[:2] != st}
+        # A LevelDB directory only makes sense whole: the copy's own tables could share file names with
+        # the template's, so any change in one replaces the copy's directory entirely
+        for directory in {os.path.dirname(rel) for rel in changed}:
+            if not os.path.exists(os.path.join(self.template_dir, directory, 'CURRENT')):
+                continue
+            shutil.rmtree(os.path.join(path, directory), ignore_errors=True)
+            for rel in [rel for rel in files if os.path.dirname(rel) == directory]:
+                del files[rel]
+            changed.update((rel, st) for rel, st in template_files.items() if os.path.dirname(rel) == directory)
+        for rel in set(files) - set(template_files):
+            # Gone from the template (e.g. compacted LevelDB tables)
+            try:
+                os.unlink(os.path.join(path, rel))
+            except FileNotFoundError:
+                pass
+            del files[rel]
+        for rel in changed:
+            try:
+                os.unlink(os.path.join(path, rel))
+            except FileNotFoundError:
+                pass
+        manifest['last_clone'] = self._clone_files(self.template_dir, path, changed, files)
+
+    def _clone_files(self, source_root, target_root, source_files, entries):
+        counts = {'reflink': [0, 0], 'hardlink': [0, 0], 'copy': [0, 0]}
+        for rel, source_stat in source_files.items():
+            dst = os.path.join(target_root, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                used = self.clone_file(os.path.join(source_root, rel), dst)
+            except FileNotFoundError:
+                # Removed while we walked; the next provisioning sees the new state
+                continue
+            counts[used][0] += 1
+            counts[used][1] += source_stat[0]
+            # Template stat to spot template changes, copy stat to spot session changes
+            entries[rel] = source_stat + file_stat(dst)
+        return {method: {'files': files, 'bytes': size} for method, (files, size) in counts.items()}
+
+    def sync_back(self, name, paths=None):
+        """Write the state directories the copy changed back into the template; returns them."""
+        path = self.path_for(name)
+        manifest = self.read_manifest(path)
+        if manifest is None or in_use(path):
+            return []
+        files = manifest['files']
+        synced = []
+        with self.template_lock(exclusive=True):
+            for unit in paths or Config.PROFILE_SYNC_PATHS:
+                unit = os.path.normpath(unit)
+                current = scan(path, unit) if os.path.exists(os.path.join(path, unit)) else {}
+                recorded = {rel: st[2:] for rel, st in files.items() if _within(rel, unit)}
+                if current == recorded:
+                    continue
+                # A LevelDB directory is only consistent as a whole, so units are swapped, not merged
+                self._replace_template_unit(path, unit, current)
+                for rel in recorded:
+                    del files[rel]
+                template_unit = scan(self.template_dir, unit)
+                for rel, copy_stat in current.items():
+                    files[rel] = template_unit.get(rel, [None, None]) + copy_stat
+                synced.append(unit)
+            if synced:
+                self.write_manifest(path, manifest)
+        if synced:
+            logger.info(f"Synced {', '.join(synced)} from profile {name} back to the template")
+        return synced
+
+    def _replace_template_unit(self, path, unit, current):
+        target = os.path.join(self.template_dir, unit)
+        staging, retired = f"{target}.sync-tmp", f"{target}.sync-old"
+        for leftover in (staging, retired):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover)
+            elif os.path.exists(leftover):
+                os.unlink(leftover)
+        source = os.path.join(path, unit)
+        if os.path.isdir(source):
+            shutil.copytree(source, staging, ignore=lambda _, names: [n for n in names if n in SKIPPED_NAMES])
+        elif os.path.exists(source):
+            os.makedirs(os.path.dirname(staging), exist_ok=True)
+            shutil.copy2(source, staging)
+        if os.path.exists(target):
+            os.rename(target, retired)
+        if os.path.exists(staging):
+            os.rename(staging, target)
+        if os.path.isdir(retired):
+            shutil.rmtree(retired)
+        elif os.path.exists(retired):
+            os.unlink(retired)
+
+    def last_used(self, path):
+        try:
+            return os.path.getmtime(os.path.join(path, MANIFEST))
+        except OSError:
+            return os.path.getmtime(path)
+
+    def collect_garbage(self, max_idle=None):
+        """Remove copies idle longer than max_idle seconds and leftovers of interrupted clones."""
+        max_idle = Config.PROFILE_MAX_IDLE if max_idle is None else max_idle
+        now = time.time()
+        removed = []
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if entry.startswith('.') or not os.path.isdir(path):
+                continue
+            if '.tmp-' in entry:
+                pid = entry.rpartition('.tmp-')[2]
+                if pid.isdigit() and int(pid) == os.getpid():
+                    continue
+                idle = now - os.path.getmtime(path)
+                stale = idle > 3600
+            else:
+                stale = not in_use(path) and now - self.last_used(path) > max_idle
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(entry)
+        if removed:
+            logger.info(f"Removed stale profiles: {', '.join(removed)}")
+        return removed
+
+    def status(self):
+        profiles = []
+        for entry in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, entry)
+            if entry.startswith('.') or not os.path.isdir(path):
+                continue
+            manifest = self.read_manifest(path) or {}
+            profiles.append({
+                'name': entry,
+                'in_use': in_use(path),
+                'idle_s': round(time.time() - self.last_used(path)),
+                'files': len(manifest.get('files', {})),
+                'last_clone': manifest.get('last_clone'),
+                'provision_s': manifest.get('seconds'),
+            })
+        return {'template': self.template_dir, 'root': self.root, 'method': self.method, 'profiles': profiles}
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_profile_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ProfileManager()
+        return _manager
+
+def profile_path(name):
+    return os.path.join(Config.PROFILE_ROOT, name)
+
+def provision_profile(user_data_dir):
+    """Bring a managed working copy up to date before Chrome starts on it; other paths are left alone."""
+    if not Config.PROFILE_CLONING:
+        return user_data_dir
+    manager = get_profile_manager()
+    if manager.manages(user_data_dir):
+        manager.provision(os.path.basename(user_data_dir))
+    return user_data_dir
+
+def sync_back_profile(user_data_dir):
+    if not (Config.PROFILE_CLONING and Config.PROFILE_SYNC_BACK):
+        return
+    manager = get_profile_manager()
+    if not manager.manages(user_data_dir):
+        return
+    try:
+        manager.sync_back(os.path.basename(user_data_dir))
+    except OSError as e:
+        logger.error(f"Failed to sync profile {user_data_dir} back to the template: {str(e)}")
+
+def provision_standalone_profile():
+    """Profile for a player or recorder that launches its own browser outside the session pool."""
+    if not Config.PROFILE_CLONING:
+        return None
+    return provision_profile(profile_path(f"standalone-{os.getpid()}"))
+
+def collect_garbage_async():
+    def collect():
+        try:
+            get_profile_manager().collect_garbage()
+        except OSError as e:
+            logger.error(f"Failed to collect stale profiles: {str(e)}")
+    threading.Thread(target=collect, name='profile-gc', daemon=True).start()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    manager = ProfileManager()
+    if command == 'gc':
+        print(json.dumps(manager.collect_garbage()))
+    elif command == 'provision' and len(sys.argv) > 2:
+        print(manager.provision(sys.argv[2]))
+    elif command == 'sync' and len(sys.argv) > 2:
+        print(json.dumps(manager.sync_back(sys.argv[2])))
+    elif command == 'status':
+        print(json.dumps(manager.status(), indent=2))
+    else:
+        raise SystemExit(__doc__.strip().splitlines()[-1].strip())
@@ -1,19 +1,24 @@
+import json
 import time
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from pynput import mouse, keyboard
-import os
+import threading
+from .browser import build_chrome_options, launch_browser
+from .profiles import provision_standalone_profile
+from .capture import CaptureChannel, CaptureStats, RingBuffer, BatchStats
+from .config import Config
+from .devtools import DevToolsConnection
+from .tracing import StartupTrace
+
+try:
+    from pynput import mouse, keyboard
+except ImportError:  # No display to hook (e.g. a server); only page mode can record
+    mouse = keyboard = None
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class Recorder:
-    def __init__(self, routine_name):
+    def __init__(self, routine_name, session=None, trace=None):
         self.routine_name = routine_name
         self.actions = []
         self.start_time = None
@@ -21,70 +26,62 @@ class Recorder:
         self.is_recording = False
         self.mouse_listener = None
         self.keyboard_listener = None
-        self.chrome_options = self.setup_chrome_options()
+        self.session = session
+        # One ring per listener thread keeps every buffer single-producer
+        self.mouse_channel = CaptureChannel(Config.RECORDER_BUFFER_SIZE)
+        self.keyboard_channel = CaptureChannel(Config.RECORDER_BUFFER_SIZE)
+        self.capture_stats = CaptureStats()
+        self.consumer = None
+        self.poll_interval = Config.RECORDER_CONSUMER_INTERVAL
+        self.finished = threading.Event()
+        self.stop_requested = threading.Event()
+        self.trace = trace or StartupTrace(kind='recording', routine_name=routine_name)
+        # Only needed when no leased session is passed in
+        self.chrome_options = None if session else self.setup_chrome_options()
 
     def setup_chrome_options(self):
-        chrome_options = Options()
-        chrome_options.add_argument("--start-maximized")
-        chrome_options.add_argument("--disable-notifications")
-        chrome_options.add_argument("--disable-infobars")
-        chrome_options.add_argument("--disable-extensions")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        
-        prefs = {"credentials_enable_service": False,
-                 "profile.password_manager_enabled": False}
-        chrome_options.add_experimental_option("prefs", prefs)
-        
-        # Use the root chrome_user_data directory
-        user_data_dir = os.path.join(os.getcwd(), "chrome_user_data")
-        chrome_options.add_argument(f"user-data-dir={user_data_dir}")
-        
-        return chrome_options
+        # Its own working copy of the template profile, never the template itself
+        return build_chrome_options(provision_standalone_profile())
 
     def start(self):
-        self.driver = webdriver.Chrome(options=self.chrome_options)
-        self.driver.get('https://web.telegram.org/k/')
-        self.driver.fullscreen_window()
+        if self.session:
+            # Leased sessions are already launched, navigated and fullscreen
+            self.driver = self.session.driver
+        else:
+            self.driver = launch_browser(self.chrome_options, self.trace)
         logger.info(f"Started recorder for routine: {self.routine_name}")
         
-        self.setup_listeners()
-        self.setup_ui()
+        with self.trace.span('setup_ui'):
+            self.setup_ui()
+        with self.trace.span('setup_listeners'):
+            self.setup_listeners()
+        # From here on only the consumer thread talks to the driver
+        self.consumer = threading.Thread(target=self.consume, name='recorder-consumer', daemon=True)
+        self.consumer.start()
+        self.trace.mark('ready')
         
-        try:
-            WebDriverWait(self.driver, 600).until(
-                EC.presence_of_element_located((By.ID, "recording-complete"))
-            )
-        except TimeoutException:
+        if not self.finished.wait(600):
             logger.info("Recording timed out after 10 minutes.")
-        finally:
-            self.stop_recording()
+            self.stop_requested.set()
+        self.consumer.join()
 
     def setup_listeners(self):
+        if mouse is None:
+            raise RuntimeError("OS input hooks are unavailable here; record with mode='page' instead")
+        # Runs on the OS input hook threads: timestamp and hand off, nothing else
+        mouse_capture = self.mouse_channel.capture
+        keyboard_capture = self.keyboard_channel.capture
+
         def on_click(x, y, button, pressed):
-            if pressed and self.is_recording:
-                current_time = time.time() - self.start_time
-                self.actions.append({
-                    'type': 'click',
-                    'time': current_time,
-                    'x': x,
-                    'y': y
-                })
-                logger.debug(f"Recorded click at ({x}, {y}) at time {current_time:.2f}s")
-                self.show_click_indicator(x, y)
+            if pressed:
+                mouse_capture('click', x, y)
 
         def on_press(key):
-            try:
-                if key.char == '7' and not self.is_recording:
-                    self.start_recording()
-                elif key.char == '8' and self.is_recording:
-                    self.stop_recording()
-            except AttributeError:
-                pass
+            char = getattr(key, 'char', None)
+            if char == '7':
+                keyboard_capture('start')
+            elif char == '8':
+                keyboard_capture('stop')
 
         self.mouse_listener = mouse.Listener(on_click=on_click)
         self.mouse_listener.start()
@@ -92,6 +89,57 @@ class Recorder:
         self.keyboard_listener = keyboard.Listener(on_press=on_press)
         self.keyboard_listener.start()
 
+    def collect_events(self):
+        return self.mouse_channel.events.drain() + self.keyboard_channel.events.drain()
+
+    def record_stats(self, events):
+        self.capture_stats.record((self.mouse_channel, self.keyboard_channel), events, time.perf_counter())
+
+    def stats_snapshot(self):
+        return self.capture_stats.snapshot((self.mouse_channel, self.keyboard_channel))
+
+    def consume(self):
+        while not self.finished.is_set():
+            try:
+                events = self.collect_events()
+            except Exception as e:
+                logger.error(f"Failed to collect captured events: {str(e)}")
+                events = []
+            if events:
+                events.sort(key=lambda event: event[0])
+                self.record_stats(events)
+                indicators = []
+                for event in events:
+                    try:
+                        self.handle_event(event, indicators)
+                    except Exception as e:
+                        logger.error(f"Failed to handle captured {event[1]} event: {str(e)}")
+                if indicators and not self.finished.is_set():
+                    self.show_click_indicators(indicators)
+            elif self.stop_requested.is_set():
+                self.stop_recording()
+            else:
+                time.sleep(self.poll_interval)
+        logger.info(f"Capture stats: {self.stats_snapshot()}")
+
+    def handle_event(self, event, indicators):
+        captured_at, kind = event[0], event[1]
+        if kind == 'start' and not self.is_recording and not self.finished.is_set():
+            self.start_recording(captured_at)
+        elif kind == 'stop' and self.is_recording:
+            self.stop_recording()
+        elif kind == 'click' and self.is_recording:
+            x, y = event[2], event[3]
+            current_time = captured_at - self.start_time
+            self.actions.append({
+                'type': 'click',
+                'time': current_time,
+                'x': x,
+                'y': y
+            })
+            logger.debug(f"Recorded click at ({x}, {y}) at time {current_time:.2f}s")
+            indicators.append((x, y))
+
     def setup_ui(self):
         js_code = """
         var statusDiv = document.createElement('div');
@@ -108,9 +156,10 @@ class Recorder:
         """
         self.driver.execute_script(js_code)
 
-    def start_recording(self):
+    def start_recording(self, started_at=None):
         self.is_recording = True
-        self.start_time = time.time()
+        # Same clock as the capture timestamps
+        self.start_time = time.perf_counter() if started_at is None else started_at
         logger.info("Recording started")
         self.driver.execute_script("document.getElementById('recording-status').innerHTML = 'Recording... Press 8 to stop';")
 
@@ -120,42 +169,201 @@ class Recorder:
             self.mouse_listener.stop()
         if self.keyboard_listener:
             self.keyboard_listener.stop()
-        self.driver.execute_script("""
-            document.getElementById('recording-status').innerHTML = 'Recording stopped';
-            var completionSignal = document.createElement('div');
-            completionSignal.id = 'recording-complete';
-            document.body.appendChild(completionSignal);
-        """)
-
-    def show_click_indicator(self, x, y):
+        try:
+            self.driver.execute_script("""
+                document.getElementById('recording-status').innerHTML = 'Recording stopped';
+                var completionSignal = document.createElement('div');
+                completionSignal.id = 'recording-complete';
+                document.body.appendChild(completionSignal);
+            """)
+        finally:
+            self.finished.set()
+
+    def show_click_indicators(self, points):
+        # One round trip per drained batch, however many clicks it holds
         js_code = """
-        var clickIndicator = document.createElement('div');
-        clickIndicator.style.position = 'fixed';
-        clickIndicator.style.left = arguments[0] + 'px';
-        clickIndicator.style.top = arguments[1] + 'px';
-        clickIndicator.style.width = '10px';
-        clickIndicator.style.height = '10px';
-        clickIndicator.style.borderRadius = '50%';
-        clickIndicator.style.backgroundColor = 'rgba(255, 0, 0, 0.5)';
-        clickIndicator.style.zIndex = '9999999';
-        clickIndicator.style.pointerEvents = 'none';
-        document.body.appendChild(clickIndicator);
-        setTimeout(function() {
-            clickIndicator.remove();
-        }, 2000);
+        arguments[0].forEach(function(point) {
+            var clickIndicator = document.createElement('div');
+            clickIndicator.style.position = 'fixed';
+            clickIndicator.style.left = point[0] + 'px';
+            clickIndicator.style.top = point[1] + 'px';
+            clickIndicator.style.width = '10px';
+            clickIndicator.style.height = '10px';
+            clickIndicator.style.borderRadius = '50%';
+            clickIndicator.style.backgroundColor = 'rgba(255, 0, 0, 0.5)';
+            clickIndicator.style.zIndex = '9999999';
+            clickIndicator.style.pointerEvents = 'none';
+            document.body.appendChild(clickIndicator);
+            setTimeout(function() {
+                clickIndicator.remove();
+            }, 2000);
+        });
         """
         try:
-            self.driver.execute_script(js_code, x, y)
+            self.driver.execute_script(js_code, points)
         except Exception as e:
             logger.error(f"Failed to show click indicator: {str(e)}")
 
     def stop(self):
-        if self.driver:
+        # Leased sessions are handed back to the pool by the caller instead
+        if self.driver and not self.session:
             self.driver.quit()
         logger.info(f"Stopped recording for routine: {self.routine_name}")
-        return {'actions': self.actions}
+        return {'actions': self.actions, 'capture': self.stats_snapshot()}
+
+# Installed in every document of a page-mode recording. Events are timestamped on the page's
+# high-resolution clock (performance.timeOrigin + event.timeStamp, the same clock as
+# performance.now()) and stored as viewport fractions, so nothing runs per event outside the page.
+PAGE_CAPTURE_SCRIPT = """
+(function(config) {
+    if (window.__dropfarmCapture) return;
+    var buffer = [];
+    var timer = null;
+    var state = window.__dropfarmCapture = {
+        take: function() {
+            var batch = buffer;
+            buffer = [];
+            return batch;
+        },
+        disable: function() {
+            document.removeEventListener('pointerdown', onPointerDown, true);
+            document.removeEventListener('keydown', onKeyDown, true);
+            window.removeEventListener('pagehide', flush);
+            clearInterval(timer);
+            buffer = [];
+        }
+    };
+    function timestamp(event) {
+        return (performance.timeOrigin + event.timeStamp) / 1000;
+    }
+    function flush() {
+        // Without the binding the batch stays here until the recorder polls for it
+        if (!buffer.length || typeof window[config.binding] !== 'function') return;
+        window[config.binding](JSON.stringify(state.take()));
+    }
+    function capture(entry) {
+        buffer.push(entry);
+        if (buffer.length >= config.batchSize) flush();
+    }
+    function showIndicator(x, y) {
+        if (!document.body) return;
+        var clickIndicator = document.createElement('div');
+        clickIndicator.style.cssText = 'position:fixed;width:10px;height:10px;border-radius:5px;' +
+            'background-color:rgba(255,0,0,0.5);z-index:9999999;pointer-events:none;' +
+            'left:' + x + 'px;top:' + y + 'px';
+        document.body.appendChild(clickIndicator);
+        setTimeout(function() { clickIndicator.remove(); }, 2000);
+    }
+    function onPointerDown(event) {
+        if (!event.isPrimary) return;
+        capture([timestamp(event), 'click',
+                 event.clientX / window.innerWidth, event.clientY / window.innerHeight]);
+        showIndicator(event.clientX, event.clientY);
+    }
+    function onKeyDown(event) {
+        if (event.key === '7') capture([timestamp(event), 'start']);
+        else if (event.key === '8') capture([timestamp(event), 'stop']);
+    }
+    document.addEventListener('pointerdown', onPointerDown, {capture: true, passive: true});
+    document.addEventListener('keydown', onKeyDown, true);
+    // Flush before the document goes away; its buffer doesn't survive a navigation
+    window.addEventListener('pagehide', flush);
+    timer = setInterval(flush, config.flushInterval);
+})(__CONFIG__);
+"""
+
+# Name of the page function the capture script flushes batches through
+CAPTURE_BINDING = 'dropfarmCapture'
+
+class PageRecorder(Recorder):
+    """Records by injecting a capture script into the page instead of hooking OS input.
+
+    The page buffers events and flushes them in batches over a DevTools binding (or, if that
+    can't be set up, the recorder polls the buffer), so there is no per-event cross-process hop
+    and no display is needed. Coordinates are viewport fractions, which playback uses as-is.
+    """
+
+    def __init__(self, routine_name, session=None, trace=None):
+        super().__init__(routine_name, session=session, trace=trace)
+        # Only the DevTools reader thread pushes, only the consumer drains
+        self.batches = RingBuffer(Config.RECORDER_BUFFER_SIZE)
+        self.batch_stats = BatchStats()
+        self.devtools = None
+        self.script_id = None
+        self.transport = 'poll'
+        self.poll_interval = Config.RECORDER_FLUSH_INTERVAL
+
+    def setup_listeners(self):
+        try:
+            self.devtools = DevToolsConnection.for_driver(self.driver)
+            self.devtools.add_binding(CAPTURE_BINDING, self.batches.push)
+            self.transport = 'binding'
+            self.poll_interval = Config.RECORDER_CONSUMER_INTERVAL
+        except Exception as e:
+            logger.warning(f"DevTools capture binding unavailable, polling the page instead: {str(e)}")
+            self.close_devtools()
+        source = PAGE_CAPTURE_SCRIPT.replace('__CONFIG__', json.dumps({
+            'binding': CAPTURE_BINDING,
+            'batchSize': Config.RECORDER_BATCH_SIZE,
+            'flushInterval': int(Config.RECORDER_FLUSH_INTERVAL * 1000),
+        }))
+        # Future documents get it before their own scripts run; the current one gets it now
+        self.script_id = self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': source}).get('identifier')
+        self.driver.execute_script(source)
+
+    def collect_events(self):
+        if self.transport == 'binding':
+            batches = [json.loads(payload) for payload in self.batches.drain()]
+        else:
+            batches = [self.driver.execute_script("return window.__dropfarmCapture ? window.__dropfarmCapture.take() : [];")]
+        events = []
+        for batch in batches:
+            if batch:
+                events.extend(tuple(event) for event in batch)
+                self.batch_stats.record(batch, time.time())
+        return events
+
+    def record_stats(self, events):
+        # Recorded per batch in collect_events
+        pass
+
+    def stats_snapshot(self):
+        return dict(self.batch_stats.snapshot(), transport=self.transport, dropped_batches=self.batches.dropped)
+
+    def show_click_indicators(self, points):
+        # Drawn by the capture script as the click happens
+        pass
+
+    def close_devtools(self):
+        if self.devtools:
+            try:
+                self.devtools.send('Runtime.removeBinding', {'name': CAPTURE_BINDING})
+            except Exception:
+                pass
+            self.devtools.close()
+            self.devtools = None
+
+    def remove_capture_script(self):
+        # Leased sessions go back to the pool, so later runs must not inherit the capture hooks
+        try:
+            if self.script_id:
+                self.driver.execute_cdp_cmd('Page.removeScriptToEvaluateOnNewDocument', {'identifier': self.script_id})
+            self.driver.execute_script("if (window.__dropfarmCapture) { window.__dropfarmCapture.disable(); delete window.__dropfarmCapture; }")
+        except Exception as e:
+            logger.warning(f"Failed to remove capture script: {str(e)}")
+
+    def stop(self):
+        if self.driver:
+            self.remove_capture_script()
+        self.close_devtools()
+        result = super().stop()
+        result['coordinates'] = 'viewport'
+        return result
+
+RECORDER_MODES = {'os': Recorder, 'page': PageRecorder}
 
-def start_recording(routine_name):
-    recorder = Recorder(routine_name)
+def start_recording(routine_name, session=None, mode=None, trace=None):
+    recorder_class = RECORDER_MODES[mode or Config.RECORDER_MODE]
+    recorder = recorder_class(routine_name, session=session, trace=trace)
     recorder.start()
     return recorder.stop()
@@ -0,0 +1,4 @@
+from redis import Redis
+from .config import Config
+
+redis_client: Redis = Redis.from_url(Config.REDIS_URL)
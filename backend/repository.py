@@ -0,0 +1,437 @@
+"""Data access for routines, activities, user_stats, calibrations and schedules.
+
+Callers go through the repositories at the bottom of this module instead of building queries
+themselves. Reads name the columns they need (a routine's steps can be hundreds of KB), and
+reads that cover several users or routines take the whole id list in one query.
+
+Two stores implement the same five primitives: SupabaseStore (hosted Postgres through
+PostgREST) and SQLiteStore (an embedded file with its own indexes, for single-host deployments
+and offline load tests). DATABASE_BACKEND picks one per process.
+"""
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from .config import Config
+from .utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+# Column kinds: how SQLiteStore converts values on the way in and out
+TEXT, INTEGER, REAL, BOOL, JSON = 'text', 'integer', 'real', 'bool', 'json'
+
+TABLES = {
+    'routines': {
+        'id': TEXT, 'user_id': TEXT, 'name': TEXT, 'steps': JSON, 'tokens_per_run': REAL,
+        'created_at': TEXT, 'updated_at': TEXT,
+    },
+    'activities': {
+        'id': TEXT, 'user_id': TEXT, 'action_type': TEXT, 'details': TEXT, 'created_at': TEXT,
+    },
+    'user_stats': {
+        'id': TEXT, 'user_id': TEXT, 'total_earnings': REAL, 'total_tokens_generated': REAL,
+        'total_routine_runs': INTEGER, 'last_run_date': TEXT, 'created_at': TEXT, 'updated_at': TEXT,
+    },
+    'user_calibrations': {
+        'id': TEXT, 'user_id': TEXT, 'browser_calibration': TEXT, 'recorder_calibration': TEXT,
+        'player_calibration': TEXT, 'calibration_data': TEXT, 'aspect_ratio': REAL,
+        'created_at': TEXT, 'updated_at': TEXT,
+    },
+    'bot_settings': {
+        'id': TEXT, 'user_id': TEXT, 'is_active': BOOL, 'run_interval': INTEGER, 'max_daily_runs': INTEGER,
+        'created_at': TEXT, 'updated_at': TEXT,
+    },
+    'projects': {
+        'id': TEXT, 'user_id': TEXT, 'name': TEXT, 'enabled': BOOL, 'interval': INTEGER, 'max_daily_runs': INTEGER,
+        'created_at': TEXT, 'updated_at': TEXT,
+    },
+}
+
+# Defaults the Postgres tables declare; SQLite gets the same ones
+DEFAULTS = {
+    'bot_settings': {'is_active': 0, 'run_interval': 60, 'max_daily_runs': 5},
+    'projects': {'enabled': 1, 'interval': 60, 'max_daily_runs': 5},
+    'user_stats': {'total_earnings': 0, 'total_tokens_generated': 0, 'total_routine_runs': 0},
+}
+
+# One per query shape the repositories run
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS routines_user_name ON routines (user_id, name, created_at)',
+    'CREATE INDEX IF NOT EXISTS activities_user_created ON activities (user_id, created_at)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS user_stats_user ON user_stats (user_id)',
+    'CREATE INDEX IF NOT EXISTS user_calibrations_user_updated ON user_calibrations (user_id, updated_at)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS bot_settings_user ON bot_settings (user_id)',
+    'CREATE INDEX IF NOT EXISTS bot_settings_active ON bot_settings (is_active)',
+    'CREATE INDEX IF NOT EXISTS projects_user_enabled ON projects (user_id, enabled)',
+    'CREATE INDEX IF NOT EXISTS projects_enabled ON projects (enabled)',
+)
+
+SQL_TYPES = {TEXT: 'TEXT', INTEGER: 'INTEGER', REAL: 'REAL', BOOL: 'INTEGER', JSON: 'TEXT'}
+
+def _quote(names):
+    return ', '.join(f'"{name}"' for name in names)
+
+class SupabaseStore:
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .supabase_client import supabase
+            self._client = supabase
+        return self._client
+
+    @staticmethod
+    def _filter(query, filters):
+        for column, value in (filters or {}).items():
+            query = query.eq(column, value)
+        return query
+
+    def select(self, table, columns='*', filters=None, within=None, order=None, desc=False, limit=None, offset=0):
+        query = self._filter(self.client.table(table).select(columns), filters)
+        if within:
+            column, values = within
+            query = query.in_(column, list(values))
+        if order:
+            query = query.order(order, desc=desc)
+        if limit is not None:
+            query = query.range(offset, offset + limit - 1)
+        return query.execute().data or []
+
+    def insert(self, table, rows):
+        return self.client.table(table).insert(rows).execute().data or []
+
+    def update(self, table, values, filters):
+        return self._filter(self.client.table(table).update(values), filters).execute().data or []
+
+    def delete(self, table, filters):
+        return self._filter(self.client.table(table).delete(), filters).execute().data or []
+
+class SQLiteStore:
+    """Embedded store; one connection per thread, WAL so readers never wait on the writer."""
+
+    # Bound parameters per statement; older SQLite builds cap it at 999
+    MAX_VARIABLES = 900
+
+    def __init__(self, path=None):
+        self.path = path or Config.SQLITE_PATH
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self.create_schema(connection)
+        return connection
+
+    def create_schema(self, connection):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            for table, columns in TABLES.items():
+                defaults = DEFAULTS.get(table, {})
+                definitions = []
+                for column, kind in columns.items():
+                    definition = f'"{column}" {SQL_TYPES[kind]}'
+                    if column == 'id':
+                        definition += ' PRIMARY KEY'
+                    elif column in defaults:
+                        definition += f' DEFAULT {defaults[column]}'
+                    definitions.append(definition)
+                connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({", ".join(definitions)})')
+            for statement in INDEXES:
+                connection.execute(statement)
+            self._schema_ready = True
+
+    @staticmethod
+    def _columns(table, columns):
+        # Identifiers can't be bound, so only known column names ever reach the SQL text
+        schema = TABLES[table]
+        if columns == '*':
+            return list(schema)
+        names = [column.strip() for column in columns.split(',')]
+        unknown = [name for name in names if name not in schema]
+        if unknown:
+            raise ValueError(f"Unknown columns for {table}: {', '.join(unknown)}")
+        return names
+
+    @staticmethod
+    def _encode(table, column, value):
+        kind = TABLES[table].get(column)
+        if kind is None:
+            raise ValueError(f"Unknown column for {table}: {column}")
+        if value is None:
+            return None
+        if kind == JSON:
+            return json.dumps(value)
+        if kind == BOOL:
+            return int(bool(value))
+        return value
+
+    @staticmethod
+    def _decode(table, row):
+        schema = TABLES[table]
+        decoded = {}
+        for column in row.keys():
+            value = row[column]
+            kind = schema[column]
+            if value is not None and kind == JSON:
+                value = json.loads(value)
+            elif value is not None and kind == BOOL:
+                value = bool(value)
+            decoded[column] = value
+        return decoded
+
+    def _where(self, table, filters, within=None):
+        clauses, params = [], []
+        for column, value in (filters or {}).items():
+            clauses.append(f'"{column}" = ?')
+            params.append(self._encode(table, column, value))
+        if within:
+            column, values = within
+            clauses.append(f'"{column}" IN ({", ".join("?" * len(values))})')
+            params.extend(self._encode(table, column, value) for value in values)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def select(self, table, columns='*', filters=None, within=None, order=None, desc=False, limit=None, offset=0):
+        # Long IN lists are split across statements; callers of such batches don't order or page them
+        if within and len(within[1]) > self.MAX_VARIABLES:
+            column, values = within[0], list(within[1])
+            rows = []
+            for start in range(0, len(values), self.MAX_VARIABLES):
+                rows.extend(self.select(table, columns, filters, (column, values[start:start + self.MAX_VARIABLES])))
+            return rows
+        names = self._columns(table, columns)
+        where, params = self._where(table, filters, within)
+        sql = f'SELECT {_quote(names)} FROM {table}{where}'
+        if order:
+            self._columns(table, order)
+            sql += f' ORDER BY "{order}" {"DESC" if desc else "ASC"}'
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend((limit, offset))
+        return [self._decode(table, row) for row in self.connection.execute(sql, params)]
+
+    def insert(self, table, rows):
+        rows = [rows] if isinstance(rows, dict) else list(rows)
+        if not rows:
+            return []
+        now = utcnow()
+        prepared = []
+        for row in rows:
+            row = dict(row)
+            # What Postgres fills in by default
+            row.setdefault('id', str(uuid.uuid4()))
+            row.setdefault('created_at', now)
+            if 'updated_at' in TABLES[table]:
+                row.setdefault('updated_at', now)
+            prepared.append(row)
+        connection = self.connection
+        inserted = []
+        connection.execute('BEGIN')
+        try:
+            for row in prepared:
+                names = list(row)
+                values = [self._encode(table, name, row[name]) for name in names]
+                sql = f'INSERT INTO {table} ({_quote(names)}) VALUES ({", ".join("?" * len(names))}) RETURNING *'
+                inserted.append(self._decode(table, connection.execute(sql, values).fetchone()))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return inserted
+
+    def update(self, table, values, filters):
+        names = list(values)
+        assignments = ', '.join(f'"{name}" = ?' for name in names)
+        params = [self._encode(table, name, values[name]) for name in names]
+        where, where_params = self._where(table, filters)
+        sql = f'UPDATE {table} SET {assignments}{where} RETURNING *'
+        return [self._decode(table, row) for row in self.connection.execute(sql, params + where_params).fetchall()]
+
+    def delete(self, table, filters):
+        where, params = self._where(table, filters)
+        sql = f'DELETE FROM {table}{where} RETURNING *'
+        return [self._decode(table, row) for row in self.connection.execute(sql, params).fetchall()]
+
+STORES = {'supabase': SupabaseStore, 'sqlite': SQLiteStore}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            if Config.DATABASE_BACKEND not in STORES:
+                raise ValueError(f"DATABASE_BACKEND must be one of {tuple(STORES)}")
+            _store = STORES[Config.DATABASE_BACKEND]()
+            logger.info(f"Using {Config.DATABASE_BACKEND} data store")
+        return _store
+
+class Repository:
+    def __init__(self, store=None):
+        self._store = store
+
+    @property
+    def store(self):
+        return self._store or get_store()
+
+    def _first(self, rows):
+        return rows[0] if rows else None
+
+class RoutineRepository(Repository):
+    TABLE = 'routines'
+    # The list view never needs a routine's steps, which can be hundreds of KB each
+    SUMMARY_COLUMNS = 'id,name,tokens_per_run,created_at,updated_at'
+    PLAYBACK_COLUMNS = 'id,name,steps,tokens_per_run,created_at,updated_at'
+
+    def get(self, routine_id, user_id=None, columns=PLAYBACK_COLUMNS):
+        filters = {'id': routine_id}
+        if user_id is not None:
+            filters['user_id'] = str(user_id)
+        return self._first(self.store.select(self.TABLE, columns, filters, limit=1))
+
+    def get_many(self, routine_ids, columns=SUMMARY_COLUMNS):
+        if not routine_ids:
+            return []
+        return self.store.select(self.TABLE, columns, within=('id', list(dict.fromkeys(routine_ids))))
+
+    def latest_by_name(self, user_id, name, columns=PLAYBACK_COLUMNS):
+        # Newest routine with this name; the database picks it instead of shipping every row here
+        rows = self.store.select(self.TABLE, columns, {'user_id': str(user_id), 'name': name},
+                                 order='created_at', desc=True, limit=1)
+        return self._first(rows)
+
+    def summaries(self, user_id):
+        return self.store.select(self.TABLE, self.SUMMARY_COLUMNS, {'user_id': str(user_id)})
+
+    def create(self, user_id, name, steps, tokens_per_run):
+        return self._first(self.store.insert(self.TABLE, {
+            'user_id': str(user_id),
+            'name': name,
+            'steps': steps,
+            'tokens_per_run': tokens_per_run,
+        }))
+
+    def create_many(self, rows):
+        return self.store.insert(self.TABLE, rows)
+
+    def save_steps(self, user_id, name, steps, tokens_per_run):
+        """Overwrite the steps of the user's routines with this name, or create the routine."""
+        updated = self.store.update(self.TABLE, {'steps': steps, 'tokens_per_run': tokens_per_run, 'updated_at': utcnow()},
+                                    {'user_id': str(user_id), 'name': name})
+        if updated:
+            return updated[0]
+        return self.create(user_id, name, steps, tokens_per_run)
+
+    def update(self, routine_id, user_id, values):
+        updated = self.store.update(self.TABLE, dict(values, updated_at=utcnow()), {'id': routine_id, 'user_id': str(user_id)})
+        return self._first(updated)
+
+    def delete(self, routine_id, user_id):
+        return self.store.delete(self.TABLE, {'id': routine_id, 'user_id': str(user_id)})
+
+    def delete_by_name(self, name, user_id=None):
+        filters = {'name': name}
+        if user_id is not None:
+            filters['user_id'] = str(user_id)
+        return self.store.delete(self.TABLE, filters)
+
+class ActivityRepository(Repository):
+    TABLE = 'activities'
+    COLUMNS = 'id,user_id,action_type,details,created_at'
+
+    def recent(self, user_id, limit=10, columns=COLUMNS):
+        return self.store.select(self.TABLE, columns, {'user_id': str(user_id)}, order='created_at', desc=True, limit=limit)
+
+    def insert_many(self, rows):
+        return self.store.insert(self.TABLE, rows)
+
+class UserStatsRepository(Repository):
+    TABLE = 'user_stats'
+    COLUMNS = 'id,user_id,total_earnings,total_tokens_generated,total_routine_runs,last_run_date'
+
+    def get(self, user_id, columns=COLUMNS):
+        return self._first(self.store.select(self.TABLE, columns, {'user_id': str(user_id)}, limit=1))
+
+    def get_many(self, user_ids, columns=COLUMNS):
+        """Rows keyed by user_id, fetched in one query; users without stats are absent."""
+        if not user_ids:
+            return {}
+        rows = self.store.select(self.TABLE, columns, within=('user_id', list(dict.fromkeys(str(user_id) for user_id in user_ids))))
+        return {row['user_id']: row for row in rows}
+
+    def create(self, user_id, values):
+        return self._first(self.store.insert(self.TABLE, dict(values, user_id=str(user_id))))
+
+    def update(self, stats_id, changes):
+        return self._first(self.store.update(self.TABLE, dict(changes, updated_at=utcnow()), {'id': stats_id}))
+
+class CalibrationRepository(Repository):
+    TABLE = 'user_calibrations'
+    COLUMNS = 'id,browser_calibration,recorder_calibration,player_calibration,calibration_data,aspect_ratio,updated_at'
+
+    def latest(self, user_id, columns=COLUMNS):
+        rows = self.store.select(self.TABLE, columns, {'user_id': str(user_id)}, order='updated_at', desc=True, limit=1)
+        return self._first(rows)
+
+    def save(self, user_id, values):
+        """Update the user's calibration row in place, creating it on first save."""
+        values = dict(values, updated_at=utcnow())
+        existing = self.latest(user_id, columns='id')
+        if existing:
+            return self._first(self.store.update(self.TABLE, values, {'id': existing['id']}))
+        return self._first(self.store.insert(self.TABLE, dict(values, user_id=str(user_id))))
+
+class ScheduleRepository(Repository):
+    SETTINGS_TABLE = 'bot_settings'
+    PROJECTS_TABLE = 'projects'
+    SETTINGS_COLUMNS = 'user_id,is_active,run_interval,max_daily_runs'
+    PROJECT_COLUMNS = 'id,user_id,name,enabled,interval,max_daily_runs'
+
+    def _select_all(self, table, columns, filters, page_size=1000):
+        # PostgREST caps each response, so large tables are read page by page in a stable order
+        rows = []
+        offset = 0
+        while True:
+            page = self.store.select(table, columns, filters, order='id', limit=page_size, offset=offset)
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+            offset += page_size
+
+    def active_settings(self, user_id=None, columns=SETTINGS_COLUMNS):
+        filters = {'is_active': True}
+        if user_id:
+            filters['user_id'] = str(user_id)
+        return self._select_all(self.SETTINGS_TABLE, columns, filters)
+
+    def enabled_projects(self, user_id=None, project_id=None, columns=PROJECT_COLUMNS):
+        filters = {'enabled': True}
+        if user_id:
+            filters['user_id'] = str(user_id)
+        if project_id:
+            filters['id'] = project_id
+        return self._select_all(self.PROJECTS_TABLE, columns, filters)
+
+    def set_bot_active(self, user_id, active):
+        # bot_settings.is_active switches all of the user's scheduled projects on or off
+        filters = {'user_id': str(user_id)}
+        if not self.store.update(self.SETTINGS_TABLE, {'is_active': bool(active), 'updated_at': utcnow()}, filters):
+            self.store.insert(self.SETTINGS_TABLE, dict(filters, is_active=bool(active)))
+
+routines = RoutineRepository()
+activities = ActivityRepository()
+user_stats = UserStatsRepository()
+calibrations = CalibrationRepository()
+schedules = ScheduleRepository()
@@ -1,18 +1,26 @@
 import logging
-from flask import Blueprint, jsonify, request, render_template
+from flask import Blueprint, jsonify, request, render_template, Response, stream_with_context
 from flask_cors import cross_origin
 from functools import wraps
 from datetime import datetime, timedelta
-from .models import User, Routine, UserStats
+from .models import User, UserStats
 from .supabase_client import supabase
 from .config import Config
-from .tasks import start_recording_task, start_playback_task, get_recording_status, stop_playback_task, get_dashboard_data
+from .tasks import start_recording_task, start_playback_task, get_recording_status, control_playback, translate_to_headless, start_headless_playback_task, refresh_playback_plan, preview_pacing, report_pacing_failure, start_playlist_task
+from .pacing import Pacing
+from .playlist import parse_playlist
+from .dashboard import get_dashboard_data, invalidate_dashboard
+from .playback_plan import invalidate_plan, invalidate_user_plans
+from .status_stream import stream_status
+from .tracing import load_trace, recent_traces, summarize
+from .memory import load_memory_samples
+from .scheduler import notify_schedule_changed
+from .repository import routines, user_stats, calibrations, schedules
 from . import auth
 from .celery_worker import celery
-import signal
 from celery.result import AsyncResult
 import json
-from .recorder import Recorder
+from .recorder import Recorder, RECORDER_MODES
 from .player import Player
 
 # Set up logger
@@ -90,15 +98,12 @@ def test_celery():
 @auth.token_required
 def toggle_bot(current_user):
     try:
-        db_user = User.query.filter_by(supabase_uid=current_user['id']).first()
-        if not db_user:
-            return jsonify({"msg": "User not found"}), 404
-        
         status = request.json.get('status')
         if status is None:
             return jsonify({"msg": "Missing status in request body"}), 400
         
-        # Here you would implement the logic to actually start or stop the bot
+        schedules.set_bot_active(current_user.id, status)
+        notify_schedule_changed(user_id=str(current_user.id))
         action = "started" if status else "stopped"
         return jsonify({"msg": f"Bot {action} successfully"}), 200
     except Exception as e:
@@ -110,39 +115,41 @@ def toggle_bot(current_user):
 def add_routine(current_user):
     try:
         routine_data = request.json
-        new_routine = {
-            'name': routine_data['name'],
-            'steps': routine_data['steps'],
-            'tokens_per_run': routine_data['tokens_per_run'],
-            'user_id': str(current_user.id)
-        }
-        result = supabase.table('routines').insert(new_routine).execute()
+        routine = routines.create(current_user.id, routine_data['name'], routine_data['steps'], routine_data['tokens_per_run'])
+        try:
+            refresh_playback_plan(routine, str(current_user.id))
+        except Exception as e:
+            logger.error(f"Failed to compile playback plan for routine {routine_data['name']}: {str(e)}")
+        invalidate_dashboard(current_user.id)
         
-        return jsonify({"msg": "Routine added successfully", "id": result.data[0]['id']}), 201
+        return jsonify({"msg": "Routine added successfully", "id": routine['id']}), 201
     except Exception as e:
         logger.error(f"Error adding routine: {str(e)}")
         return jsonify({"msg": str(e)}), 500
 
-@bot_routes.route('/routines/<int:routine_id>', methods=['PUT'])
+@bot_routes.route('/routines/<routine_id>', methods=['PUT'])
 @auth.token_required
 def edit_routine(current_user, routine_id):
     try:
-        db_user = User.query.filter_by(supabase_uid=current_user['id']).first()
-        if not db_user:
-            return jsonify({"msg": "User not found"}), 404
-        
-        routine = Routine.query.filter_by(id=routine_id, user_id=db_user.id).first()
+        routine = routines.get(routine_id, current_user.id, columns='id,name')
         if not routine:
             return jsonify({"msg": "Routine not found"}), 404
         
-        routine_data = request.json
-        routine.name = routine_data['name']
-        routine.steps = routine_data['steps']
-        routine.updated_at = datetime.utcnow()
+        routine_data = request.json or {}
+        changes = {key: routine_data[key] for key in ('name', 'steps', 'tokens_per_run') if key in routine_data}
+        if not changes:
+            return jsonify({"msg": "Nothing to update"}), 400
+        updated = routines.update(routine_id, current_user.id, changes)
+        if not updated:
+            return jsonify({"msg": "Routine not found"}), 404
         
-        # Replace db.session with Supabase queries
-        # For example:
-        # supabase.table('routines').update({"name": routine_data['name'], "steps": routine_data['steps'], "updated_at": datetime.utcnow()}).eq('id', routine_id).execute()
+        # The plan is cached by name, and the name may have changed too
+        invalidate_plan(current_user.id, routine['name'])
+        try:
+            refresh_playback_plan(updated, str(current_user.id))
+        except Exception as e:
+            logger.error(f"Failed to compile playback plan for routine {updated['name']}: {str(e)}")
+        invalidate_dashboard(current_user.id)
         
         return jsonify({"msg": "Routine updated successfully"}), 200
     except Exception as e:
@@ -159,9 +166,12 @@ def record_routine(current_user):
     if not routine_name or tokens_per_run is None:
         logging.error(f"Missing required data: name={routine_name}, tokens_per_run={tokens_per_run}")
         return jsonify({"error": "Routine name and tokens per run are required"}), 400
+    mode = data.get('mode')
+    if mode is not None and mode not in RECORDER_MODES:
+        return jsonify({"error": f"Recording mode must be one of {sorted(RECORDER_MODES)}"}), 400
     
     try:
-        task = start_recording_task.apply_async(args=[routine_name, tokens_per_run, str(current_user.id)], expires=600)
+        task = start_recording_task.apply_async(args=[routine_name, tokens_per_run, str(current_user.id), mode], expires=600)
         return jsonify({
             "message": f"Recording task started for routine: {routine_name}",
             "task_id": task.id,
@@ -203,43 +213,105 @@ def playback_saved_routine(current_user):
 @auth.token_required
 def translate_routine_to_headless(current_user):
     routine_name = request.json.get('name')
-    result = translate_to_headless(routine_name)
-    return jsonify({"message": result}), 200
+    repeat_indefinitely = request.json.get('repeat_indefinitely', False)
+    if not routine_name:
+        return jsonify({"error": "Routine name is required"}), 400
+    
+    try:
+        events = translate_to_headless(routine_name, str(current_user.id))
+        if events is None:
+            return jsonify({"error": f"Routine not found: {routine_name}"}), 404
+        # Compiled once, here; the task plays exactly these events
+        task = start_headless_playback_task.apply_async(args=[routine_name, str(current_user.id), repeat_indefinitely, events])
+        return jsonify({
+            "message": f"Headless playback task started for routine: {routine_name} ({len(events)} events)",
+            "task_id": task.id,
+            "routine_name": routine_name,
+            "event_count": len(events)
+        }), 202
+    except Exception as e:
+        logger.error(f"Error translating routine to headless: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
 @bot_routes.route('/populate_test_data', methods=['POST'])
 @auth.token_required
 def populate_test_data(current_user):
     try:
         # Create user stats if not exists
-        user_stats = supabase.table('user_stats').select('*').eq('user_id', str(current_user.id)).single().execute()
-        if not user_stats.data:
-            supabase.table('user_stats').insert({
-                'user_id': str(current_user.id),
-                'routine_runs': 10,
+        if not user_stats.get(current_user.id, columns='id'):
+            user_stats.create(current_user.id, {
+                'total_routine_runs': 10,
                 'total_earnings': 100.50,
-                'last_run': datetime.utcnow().isoformat()
-            }).execute()
+                'last_run_date': datetime.utcnow().isoformat()
+            })
 
         # Add some sample routines
         sample_routines = [
             {'name': 'Sample Routine 1', 'steps': ['Step 1', 'Step 2'], 'tokens_per_run': 5, 'user_id': str(current_user.id)},
             {'name': 'Sample Routine 2', 'steps': ['Step A', 'Step B', 'Step C'], 'tokens_per_run': 10, 'user_id': str(current_user.id)}
         ]
+        routines.create_many(sample_routines)
         for routine in sample_routines:
-            supabase.table('routines').insert(routine).execute()
+            # The newest routine of a name is the one played, so older plans of these names are stale
+            invalidate_plan(current_user.id, routine['name'])
+        invalidate_dashboard(current_user.id)
 
         return jsonify({"message": "Test data populated successfully"}), 200
     except Exception as e:
         logging.error(f"Error populating test data: {str(e)}")
         return jsonify({'message': 'Error populating test data'}), 500
 
+@bot_routes.route('/status/stream', methods=['GET'])
+@auth.stream_token_required
+def status_stream(current_user):
+    # One server-sent event stream per user covering all of their recordings and playbacks
+    return Response(stream_with_context(stream_status(current_user.id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bot_routes.route('/startup_traces', methods=['GET'])
+@auth.token_required
+def get_startup_traces(current_user):
+    # Recent startup traces with per-phase percentiles, grouped by the warm-start options in effect
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        traces = recent_traces(str(current_user.id), request.args.get('kind'), request.args.get('routine_name'), limit)
+        return jsonify({'traces': traces, 'summary': summarize(traces)}), 200
+    except Exception as e:
+        logger.error(f"Error fetching startup traces: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@bot_routes.route('/startup_traces/<run_id>', methods=['GET'])
+@auth.token_required
+def get_startup_trace(current_user, run_id):
+    try:
+        trace = load_trace(run_id)
+    except Exception as e:
+        logger.error(f"Error fetching startup trace: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    if not trace or trace.get('user_id') != str(current_user.id):
+        return jsonify({"error": "Trace not found"}), 404
+    return jsonify(trace), 200
+
+@bot_routes.route('/memory_samples/<run_id>', methods=['GET'])
+@auth.token_required
+def get_memory_samples(current_user, run_id):
+    # Browser memory over time for one repeat run, sampled between its loops
+    try:
+        return jsonify({'run_id': run_id, 'samples': load_memory_samples(str(current_user.id), run_id)}), 200
+    except Exception as e:
+        logger.error(f"Error fetching memory samples: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @bot_routes.route('/recording-status/<task_id>', methods=['GET'])
 @auth.token_required
 def get_recording_status(current_user, task_id):
     try:
         task = AsyncResult(task_id)
         status = task.state
-        if status == 'PENDING':
+        if status in ('PENDING', 'STARTED', 'RETRY'):
             return jsonify({'status': 'in_progress'})
         elif status == 'SUCCESS':
             return jsonify({'status': 'completed'})
@@ -266,20 +338,17 @@ def calibrate(current_user):
         logging.info(f"Calibrating for user {user_id}, type: {calibration_type}")
         
         # Fetch existing calibration data
-        existing_calibration = supabase.table('user_calibrations').select('*').eq('user_id', user_id).execute()
-        logging.info(f"Existing calibration data: {existing_calibration.data}")
+        existing_calibration = calibrations.latest(user_id, columns='id,calibration_data')
+        logging.info(f"Existing calibration data: {existing_calibration}")
         
         update_data = {
-            'user_id': user_id,
-            'updated_at': 'now()',
             f'{calibration_type}_calibration': json.dumps(calibration_data),
             'calibration_data': json.dumps({calibration_type: calibration_data})  # Add this line
         }
         
         # If there's existing data, merge it with the new data
-        if existing_calibration.data:
-            existing_data = existing_calibration.data[0]  # Get the first (and should be only) row
-            existing_calibration_data = json.loads(existing_data.get('calibration_data', '{}'))
+        if existing_calibration:
+            existing_calibration_data = json.loads(existing_calibration.get('calibration_data') or '{}')
             existing_calibration_data[calibration_type] = calibration_data
             update_data['calibration_data'] = json.dumps(existing_calibration_data)
         
@@ -287,8 +356,10 @@ def calibrate(current_user):
             update_data['aspect_ratio'] = aspect_ratio
         
         logging.info(f"Updating calibration data: {update_data}")
-        result = supabase.table('user_calibrations').upsert(update_data).execute()
+        result = calibrations.save(user_id, update_data)
         logging.info(f"Calibration update result: {result}")
+        # Cached playback plans were compiled against the previous calibration
+        invalidate_user_plans(user_id)
         
         return jsonify({"message": f"{calibration_type.capitalize()} calibration data saved successfully"}), 200
     except Exception as e:
@@ -354,10 +425,14 @@ def start_playback(current_user):
     
     if not routine_name:
         return jsonify({"error": "Routine name is required"}), 400
+    try:
+        pacing = Pacing.from_options(data).to_dict()
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     
     try:
         # Pass user_id as a string, it will be converted to UUID in the task
-        task = start_playback_task.apply_async(args=[routine_name, str(current_user.id), repeat_indefinitely])
+        task = start_playback_task.apply_async(args=[routine_name, str(current_user.id), repeat_indefinitely, pacing])
         return jsonify({
             "message": f"Playback task started for routine: {routine_name}",
             "task_id": task.id,
@@ -367,9 +442,86 @@ def start_playback(current_user):
         logger.error(f"Error starting playback: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@bot_routes.route('/start_playlist', methods=['POST', 'OPTIONS'])
+@cross_origin(supports_credentials=True)
+@auth.token_required
+def start_playlist(current_user):
+    if request.method == 'OPTIONS':
+        return jsonify({}), 200
+
+    data = request.json
+    playlist_name = data.get('name')
+    if not playlist_name:
+        return jsonify({"error": "Playlist name is required"}), 400
+    try:
+        items = [item.to_dict() for item in parse_playlist(data.get('items'))]
+        pacing = Pacing.from_options(data).to_dict()
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        task = start_playlist_task.apply_async(args=[playlist_name, str(current_user.id), items, pacing])
+        return jsonify({
+            "message": f"Playlist task started: {playlist_name}",
+            "task_id": task.id,
+            "playlist_name": playlist_name
+        }), 202
+    except Exception as e:
+        logger.error(f"Error starting playlist: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@bot_routes.route('/playback_timing/<routine_name>', methods=['GET'])
+@auth.token_required
+def get_playback_timing(current_user, routine_name):
+    # Routine duration as recorded and after compression with the given (or default) options
+    try:
+        pacing = Pacing(request.args.get('speed'), request.args.get('max_gap'),
+                        request.args.get('learn_delays', str(Config.PLAYBACK_LEARN_DELAYS)).lower() == 'true')
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        timing = preview_pacing(routine_name, str(current_user.id), pacing)
+        if timing is None:
+            return jsonify({"error": f"Routine not found: {routine_name}"}), 404
+        return jsonify(dict(timing, pacing=pacing.to_dict())), 200
+    except Exception as e:
+        logger.error(f"Error computing playback timing: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@bot_routes.route('/playback_outcome', methods=['POST'])
+@auth.token_required
+def report_playback_outcome(current_user):
+    # Runs only learn from crashes and dropped actions; this reports one that misbehaved otherwise
+    data = request.json or {}
+    routine_name = data.get('name')
+    if not routine_name:
+        return jsonify({"error": "Routine name is required"}), 400
+    if data.get('success', True):
+        return jsonify({"message": "Nothing to learn from a successful run"}), 200
+    try:
+        if not report_pacing_failure(routine_name, str(current_user.id)):
+            return jsonify({"error": f"Routine not found: {routine_name}"}), 404
+        return jsonify({"message": f"Learned pacing for {routine_name} backed off"}), 200
+    except Exception as e:
+        logger.error(f"Error recording playback outcome: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @bot_routes.route('/stop_playback', methods=['POST'])
 @auth.token_required
 def stop_playback(current_user):
+    return send_playback_control(current_user, 'stop')
+
+@bot_routes.route('/pause_playback', methods=['POST'])
+@auth.token_required
+def pause_playback(current_user):
+    return send_playback_control(current_user, 'pause')
+
+@bot_routes.route('/resume_playback', methods=['POST'])
+@auth.token_required
+def resume_playback(current_user):
+    return send_playback_control(current_user, 'resume')
+
+def send_playback_control(current_user, action):
     data = request.json
     routine_name = data.get('name')
     
@@ -377,14 +529,12 @@ def stop_playback(current_user):
         return jsonify({"error": "Routine name is required"}), 400
     
     try:
-        task_id = celery.backend.get(f'playback_task:{current_user.id}:{routine_name}')
-        if task_id:
-            result = stop_playback_task.delay(task_id)
-            return jsonify({"message": "Stop request sent successfully"}), 202
+        if control_playback(str(current_user.id), routine_name, action):
+            return jsonify({"message": f"{action.capitalize()} request sent successfully"}), 202
         else:
             return jsonify({"error": "No active playback found for the given routine"}), 404
     except Exception as e:
-        logger.error(f"Error stopping playback: {str(e)}")
+        logger.error(f"Error sending {action} to playback: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @bot_routes.route('/routines/<routine_id>', methods=['DELETE'])
@@ -395,18 +545,20 @@ def delete_routine(current_user, routine_id):
         logger.info(f"Attempting to delete routine {routine_id} for user {current_user.id}")
         
         # First, check if the routine exists and belongs to the current user
-        routine = supabase.table('routines').select('*').eq('id', routine_id).eq('user_id', current_user.id).single().execute()
+        routine = routines.get(routine_id, current_user.id, columns='id,name')
         logger.info(f"Routine query result: {routine}")
         
-        if not routine.data:
+        if not routine:
             logger.warning(f"Routine not found or user doesn't have permission: {routine_id}")
             return jsonify({"error": "Routine not found or you don't have permission to delete it"}), 404
         
         # If the routine exists and belongs to the user, delete it
-        result = supabase.table('routines').delete().eq('id', routine_id).eq('user_id', current_user.id).execute()
+        result = routines.delete(routine_id, current_user.id)
         logger.info(f"Delete operation result: {result}")
         
-        if result.data:
+        if result:
+            invalidate_plan(current_user.id, routine['name'])
+            invalidate_dashboard(current_user.id)
             logger.info(f"Routine deleted successfully: {routine_id}")
             return jsonify({"message": "Routine deleted successfully"}), 200
         else:
@@ -423,7 +575,7 @@ def get_playback_status(current_user, routine_name):
         task_id = celery.backend.get(f'playback_task:{current_user.id}:{routine_name}')
         if task_id:
             task = AsyncResult(task_id)
-            if task.state == 'PENDING':
+            if task.state in ('PENDING', 'STARTED', 'RETRY'):
                 return jsonify({"status": "in_progress"}), 200
             elif task.state == 'SUCCESS':
                 return jsonify({"status": "completed"}), 200
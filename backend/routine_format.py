@@ -0,0 +1,246 @@
+"""Compact binary encoding for recorded routines.
+
+Layout (little endian), version 1:
+
+    b'DFR' | version u8 | flags u8 | count u32 | coord_scale f64
+    flags: FLAG_COMPRESSED, FLAG_VIEWPORT_COORDS (x/y are viewport fractions captured in the page)
+    body (zlib-compressed when FLAG_COMPRESSED is set):
+        type table   u16 length + JSON list of type names
+        types        count x u8 (index into the type table)
+        times        count x i64 microsecond deltas
+        xs, ys       count x i32 deltas of round(value * coord_scale)
+        extras       u32 length + JSON {index: {field: value}} for anything else (urls, missing coords)
+
+Routines are stored in the `steps` column as ROUTINE_PREFIX + base64 of the above. Legacy JSON
+routines (a list of actions or {'actions': [...]}, optionally as a JSON string) load transparently.
+"""
+import sys
+import json
+import zlib
+import base64
+import struct
+from array import array
+from functools import partial
+from collections import namedtuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+MAGIC = b'DFR'
+ROUTINE_PREFIX = 'dfr1:'
+FLAG_COMPRESSED = 0x01
+FLAG_VIEWPORT_COORDS = 0x02
+
+_HEADER = struct.Struct('<3sBBId')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+
+Action = namedtuple('Action', ['time', 'type', 'x', 'y', 'extra'])
+# Action._make without its Python-level call; builds the same tuples straight from a zip
+_make_action = partial(tuple.__new__, Action)
+
+class RoutineFormatError(ValueError):
+    pass
+
+def _array(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _to_le_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _deltas(values):
+    previous = 0
+    for value in values:
+        yield value - previous
+        previous = value
+
+def coord_scale_for(coords):
+    # Pixel routines store exactly; fractional (player) coordinates keep 1e-6 of the window.
+    # Deltas must stay inside i32, which caps 1e-6 resolution at |value| <= 1000.
+    if all(float(value).is_integer() for value in coords):
+        return 1.0
+    if all(abs(value) <= 1000 for value in coords):
+        return 1e6
+    return 100.0
+
+class Routine:
+    """Columnar routine; iterating yields Action tuples without materialising a list of dicts."""
+
+    def __init__(self, types, times, xs, ys, type_names, extras=None, coord_scale=1.0, viewport_coords=False):
+        # times, xs and ys hold deltas; absolute values are rebuilt while iterating
+        self.types = types
+        self.times = times
+        self.xs = xs
+        self.ys = ys
+        self.type_names = list(type_names)
+        self.extras = extras or {}
+        self.coord_scale = coord_scale
+        # In-page recordings are already in the player's coordinate space and skip calibration
+        self.viewport_coords = viewport_coords
+
+    def __len__(self):
+        return len(self.types)
+
+    def time_at(self, index):
+        # Seconds from the start of the routine to action `index`
+        return sum(self.times[:index + 1]) / 1e6
+
+    def __iter__(self):
+        # Whole columns are rebuilt in numpy and zipped into Actions in C; a per-event Python loop
+        # would cost more than decoding the routine did
+        times = (np.cumsum(np.frombuffer(self.times, dtype=np.int64)) / 1e6).tolist()
+        xs = (np.cumsum(np.frombuffer(self.xs, dtype=np.int32), dtype=np.int64) / self.coord_scale).tolist()
+        ys = (np.cumsum(np.frombuffer(self.ys, dtype=np.int32), dtype=np.int64) / self.coord_scale).tolist()
+        types = np.array(self.type_names, dtype=object)[np.frombuffer(self.types, dtype=np.uint8)].tolist()
+        extras = [None] * len(times)
+        for index, extra in self.extras.items():
+            extras[index] = extra
+            if 'x' in extra:
+                xs[index] = extra['x']
+                ys[index] = extra['y']
+        return map(_make_action, zip(times, types, xs, ys, extras))
+
+    def to_actions(self):
+        actions = []
+        for action in self:
+            data = {'type': action.type, 'time': action.time}
+            if action.x is not None:
+                data['x'] = action.x
+                data['y'] = action.y
+            if action.extra:
+                data.update({key: value for key, value in action.extra.items() if key not in ('x', 'y')})
+            actions.append(data)
+        return actions
+
+    @classmethod
+    def from_actions(cls, actions, viewport_coords=False):
+        actions = list(_with_times(actions))
+        coords = [value for action in actions for value in (action.get('x'), action.get('y')) if value is not None]
+        coord_scale = coord_scale_for(coords)
+
+        type_names = []
+        type_index = {}
+        types = array('B')
+        times = array('q')
+        xs = array('i')
+        ys = array('i')
+        extras = {}
+        last_x = last_y = 0
+        for index, action in enumerate(actions):
+            action_type = action.get('type', 'unknown')
+            if action_type not in type_index:
+                type_index[action_type] = len(type_names)
+                type_names.append(action_type)
+            types.append(type_index[action_type])
+            times.append(round(action['time'] * 1e6))
+            if action.get('x') is None or action.get('y') is None:
+                extras[index] = {'x': action.get('x'), 'y': action.get('y')}
+            else:
+                last_x = round(action['x'] * coord_scale)
+                last_y = round(action['y'] * coord_scale)
+            xs.append(last_x)
+            ys.append(last_y)
+            extra = {key: value for key, value in action.items() if key not in ('type', 'time', 'x', 'y')}
+            if extra:
+                extras.setdefault(index, {}).update(extra)
+
+        if len(type_names) > 255:
+            raise RoutineFormatError("Routines support at most 255 distinct action types")
+        return cls(types, array('q', _deltas(times)), array('i', _deltas(xs)), array('i', _deltas(ys)),
+                   type_names, extras, coord_scale, viewport_coords)
+
+    def sorted_by_time(self):
+        # Time deltas are all non-negative exactly when the timeline is already ordered
+        if all(delta >= 0 for delta in self.times):
+            return self
+        return Routine.from_actions(sorted(self.to_actions(), key=lambda action: action['time']), self.viewport_coords)
+
+    def encode(self, compress=True):
+        type_table = json.dumps(self.type_names).encode()
+        extras = json.dumps({str(index): extra for index, extra in self.extras.items()}).encode()
+        body = b''.join([
+            _U16.pack(len(type_table)), type_table,
+            self.types.tobytes(),
+            _to_le_bytes(self.times), _to_le_bytes(self.xs), _to_le_bytes(self.ys),
+            _U32.pack(len(extras)), extras,
+        ])
+        flags = FLAG_VIEWPORT_COORDS if self.viewport_coords else 0
+        if compress:
+            body = zlib.compress(body, 6)
+            flags |= FLAG_COMPRESSED
+        return _HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(self), self.coord_scale) + body
+
+    @classmethod
+    def decode(cls, data):
+        if len(data) < _HEADER.size:
+            raise RoutineFormatError("Routine data is truncated")
+        magic, version, flags, count, coord_scale = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise RoutineFormatError("Not an encoded routine")
+        if version != FORMAT_VERSION:
+            raise RoutineFormatError(f"Unsupported routine format version: {version}")
+        body = data[_HEADER.size:]
+        if flags & FLAG_COMPRESSED:
+            body = zlib.decompress(body)
+
+        offset = 0
+        (table_length,) = _U16.unpack_from(body, offset)
+        offset += _U16.size
+        type_names = json.loads(body[offset:offset + table_length])
+        offset += table_length
+        types = array('B', body[offset:offset + count])
+        offset += count
+        times = _array('q', body[offset:offset + 8 * count])
+        offset += 8 * count
+        xs = _array('i', body[offset:offset + 4 * count])
+        offset += 4 * count
+        ys = _array('i', body[offset:offset + 4 * count])
+        offset += 4 * count
+        (extras_length,) = _U32.unpack_from(body, offset)
+        offset += _U32.size
+        extras = {int(index): extra for index, extra in json.loads(body[offset:offset + extras_length]).items()}
+        return cls(types, times, xs, ys, type_names, extras, coord_scale, bool(flags & FLAG_VIEWPORT_COORDS))
+
+    def to_text(self, compress=True):
+        return ROUTINE_PREFIX + base64.b64encode(self.encode(compress)).decode('ascii')
+
+def _with_times(actions):
+    # Old recordings have no 'time' and spell pauses out as {'type': 'wait', 'duration': ...}
+    elapsed = 0.0
+    for action in actions:
+        if action.get('type') == 'wait' and 'time' not in action:
+            elapsed += float(action.get('duration', 0))
+            continue
+        if 'time' in action:
+            elapsed = float(action['time'])
+            yield action
+        else:
+            yield dict(action, time=elapsed)
+
+def encode_routine(actions, compress=True):
+    return load_routine(actions).to_text(compress)
+
+def load_routine(steps):
+    """Accepts a Routine, encoded text or bytes, or any legacy JSON routine shape."""
+    if isinstance(steps, Routine):
+        return steps
+    if isinstance(steps, (bytes, bytearray, memoryview)):
+        return Routine.decode(bytes(steps))
+    if isinstance(steps, str):
+        if steps.startswith(ROUTINE_PREFIX):
+            return Routine.decode(base64.b64decode(steps[len(ROUTINE_PREFIX):]))
+        steps = json.loads(steps)
+    viewport_coords = False
+    if isinstance(steps, dict) and 'actions' in steps:
+        viewport_coords = steps.get('coordinates') == 'viewport'
+        steps = steps['actions']
+    if isinstance(steps, list):
+        return Routine.from_actions(steps, viewport_coords)
+    raise RoutineFormatError(f"Unexpected routine format: {type(steps)}")
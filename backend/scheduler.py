@@ -0,0 +1,341 @@
+"""Timer-driven routine scheduler for the projects and bot_settings tables.
+
+Each enabled project of a user whose bot is active (bot_settings.is_active) is a schedule that
+plays the routine with the project's name every `interval` minutes, falling back to
+bot_settings.run_interval. Daily caps apply per project (projects.max_daily_runs) and per user
+(bot_settings.max_daily_runs).
+
+Schedules live in a min-heap ordered by next run time, so dispatching the next due run and
+rescheduling or cancelling one schedule are all O(log n). Edits reach a running scheduler over
+Redis pub/sub (notify_schedule_changed); a periodic full resync catches anything missed.
+
+Run one scheduler per deployment (extra instances wait on a Redis leader lock):
+
+    python -m backend.scheduler
+"""
+import json
+import heapq
+import random
+import logging
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from redis.exceptions import LockNotOwnedError
+from .celery_worker import celery
+from .config import Config
+from .redis_client import redis_client
+from .repository import schedules
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_UPDATES_CHANNEL = 'scheduler:updates'
+LEADER_LOCK_KEY = 'scheduler:leader'
+
+class Schedule:
+    __slots__ = ('project_id', 'user_id', 'routine_name', 'interval', 'max_daily_runs', 'user_max_daily_runs', 'next_run')
+
+    def __init__(self, project_id, user_id, routine_name, interval, max_daily_runs=None, user_max_daily_runs=None):
+        self.project_id = project_id
+        self.user_id = user_id
+        self.routine_name = routine_name
+        self.interval = interval  # seconds
+        self.max_daily_runs = max_daily_runs
+        self.user_max_daily_runs = user_max_daily_runs
+        self.next_run = None
+
+    @classmethod
+    def from_rows(cls, project, settings):
+        if not project.get('enabled') or not settings or not settings.get('is_active'):
+            return None
+        minutes = project.get('interval') or settings.get('run_interval') or 60
+        return cls(project['id'], project['user_id'], project['name'],
+                   max(minutes * 60, Config.SCHEDULER_MIN_INTERVAL),
+                   project.get('max_daily_runs'), settings.get('max_daily_runs'))
+
+class ScheduleQueue:
+    """Min-heap of schedules by next run time with O(log n) reschedule and lazy removal."""
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, project_id):
+        return project_id in self._entries
+
+    def get(self, project_id):
+        entry = self._entries.get(project_id)
+        return entry[2] if entry else None
+
+    def keys(self):
+        return set(self._entries)
+
+    def push(self, schedule, run_at):
+        # Rescheduling invalidates the old heap entry in place instead of searching for it
+        self.remove(schedule.project_id)
+        schedule.next_run = run_at
+        entry = [run_at, next(self._sequence), schedule]
+        self._entries[schedule.project_id] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+
+    def remove(self, project_id):
+        entry = self._entries.pop(project_id, None)
+        if entry:
+            entry[2] = None
+        return entry is not None
+
+    def next_run(self):
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        due = []
+        while self.next_run() is not None and self._heap[0][0] <= now:
+            _, _, schedule = heapq.heappop(self._heap)
+            del self._entries[schedule.project_id]
+            due.append(schedule)
+        return due
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[2] is not None]
+        heapq.heapify(self._heap)
+
+def utc_day(now):
+    return datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%d')
+
+def next_utc_midnight(now):
+    today = datetime.fromtimestamp(now, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today + timedelta(days=1)).timestamp()
+
+class DailyRunCounter:
+    """Per-project and per-user run counts for the current UTC day, kept in Redis."""
+
+    def _keys(self, schedule, now):
+        day = utc_day(now)
+        return f"scheduled_runs:{schedule.project_id}:{day}", f"scheduled_runs_user:{schedule.user_id}:{day}"
+
+    def try_reserve(self, schedule, now):
+        project_key, user_key = self._keys(schedule, now)
+        pipe = redis_client.pipeline()
+        pipe.incr(project_key)
+        pipe.incr(user_key)
+        pipe.expire(project_key, 2 * 24 * 3600)
+        pipe.expire(user_key, 2 * 24 * 3600)
+        project_runs, user_runs, _, _ = pipe.execute()
+        if ((schedule.max_daily_runs and project_runs > schedule.max_daily_runs) or
+                (schedule.user_max_daily_runs and user_runs > schedule.user_max_daily_runs)):
+            self.release(schedule, now)
+            return False
+        return True
+
+    def release(self, schedule, now):
+        project_key, user_key = self._keys(schedule, now)
+        pipe = redis_client.pipeline()
+        pipe.decr(project_key)
+        pipe.decr(user_key)
+        pipe.execute()
+
+def fetch_active_settings(user_id=None):
+    return {row['user_id']: row for row in schedules.active_settings(user_id)}
+
+def fetch_enabled_projects(user_id=None, project_id=None):
+    return schedules.enabled_projects(user_id, project_id)
+
+def notify_schedule_changed(user_id=None, project_id=None):
+    """Tell a running scheduler to reload one user's or one project's schedules."""
+    try:
+        redis_client.publish(SCHEDULER_UPDATES_CHANNEL, json.dumps({'user_id': user_id, 'project_id': project_id}))
+    except Exception as e:
+        logger.error(f"Failed to notify scheduler: {str(e)}")
+
+def is_playback_running(schedule):
+    return celery.backend.get(f'playback_task:{schedule.user_id}:{schedule.routine_name}') is not None
+
+def dispatch_playback(schedule):
+    # Sent by name like any other client would; the worker that takes it claims a browser slot.
+    # Nobody is at the keyboard to press the start key, so the run starts on its own
+    return celery.send_task('backend.tasks.start_playback_task', args=[schedule.routine_name, str(schedule.user_id), False],
+                            kwargs={'autostart': True})
+
+class RoutineScheduler:
+    def __init__(self, dispatch=dispatch_playback, clock=time.time):
+        self.queue = ScheduleQueue()
+        self.counter = DailyRunCounter()
+        self.dispatch = dispatch
+        self.clock = clock
+        self._user_projects = {}
+        self._lock = threading.RLock()
+        # The Redis leader lock while this instance leads; renewed before every dispatch
+        self._leader_lock = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def jitter(self, interval):
+        # Small random offset so schedules sharing an interval don't hit the slots together
+        return random.uniform(0, min(Config.SCHEDULER_JITTER, interval * 0.1))
+
+    def upsert(self, schedule):
+        now = self.clock()
+        with self._lock:
+            existing = self.queue.get(schedule.project_id)
+            if existing and existing.interval == schedule.interval:
+                run_at = existing.next_run
+            elif existing:
+                run_at = min(existing.next_run, now + schedule.interval + self.jitter(schedule.interval))
+            else:
+                # New schedules start somewhere inside their first interval, not all at once
+                run_at = now + random.uniform(0, schedule.interval)
+            self.queue.push(schedule, run_at)
+            self._user_projects.setdefault(schedule.user_id, set()).add(schedule.project_id)
+        self._wakeup.set()
+
+    def remove(self, project_id, user_id=None):
+        with self._lock:
+            self.queue.remove(project_id)
+            if user_id in self._user_projects:
+                self._user_projects[user_id].discard(project_id)
+
+    def _sync(self, settings, projects, scope):
+        # scope: the project ids this batch of rows is authoritative for
+        seen = set()
+        for project in projects:
+            schedule = Schedule.from_rows(project, settings.get(project['user_id']))
+            if schedule:
+                seen.add(schedule.project_id)
+                self.upsert(schedule)
+        with self._lock:
+            for project_id in scope - seen:
+                schedule = self.queue.get(project_id)
+                self.remove(project_id, schedule.user_id if schedule else None)
+        return len(seen)
+
+    def load_all(self):
+        count = self._sync(fetch_active_settings(), fetch_enabled_projects(), self.queue.keys())
+        logger.info(f"Scheduler loaded {count} schedules")
+
+    def refresh_user(self, user_id):
+        with self._lock:
+            scope = set(self._user_projects.get(user_id, ()))
+        self._sync(fetch_active_settings(user_id), fetch_enabled_projects(user_id=user_id), scope)
+
+    def refresh_project(self, project_id):
+        projects = fetch_enabled_projects(project_id=project_id)
+        settings = fetch_active_settings(projects[0]['user_id']) if projects else {}
+        self._sync(settings, projects, {project_id})
+
+    def handle_update(self, message):
+        update = json.loads(message)
+        if update.get('project_id'):
+            self.refresh_project(update['project_id'])
+        elif update.get('user_id'):
+            self.refresh_user(update['user_id'])
+
+    def run_due(self):
+        now = self.clock()
+        with self._lock:
+            due = self.queue.pop_due(now)
+        for schedule in due:
+            # A long batch must not outlive the lock, or a second scheduler dispatches the same runs
+            self.renew_leadership()
+            self._run(schedule, now)
+        return len(due)
+
+    def renew_leadership(self):
+        # Raises LockNotOwnedError once another instance has taken over
+        if self._leader_lock is not None:
+            self._leader_lock.reacquire()
+
+    def _run(self, schedule, now):
+        if is_playback_running(schedule):
+            run_at = now + Config.SCHEDULER_BUSY_RETRY
+        elif not self.counter.try_reserve(schedule, now):
+            logger.info(f"Daily cap reached for {schedule.routine_name} ({schedule.project_id}), next run tomorrow")
+            run_at = next_utc_midnight(now) + self.jitter(schedule.interval)
+        else:
+            try:
+                self.dispatch(schedule)
+                logger.info(f"Dispatched scheduled playback of {schedule.routine_name} for user {schedule.user_id}")
+            except Exception as e:
+                self.counter.release(schedule, now)
+                logger.error(f"Failed to dispatch {schedule.routine_name}: {str(e)}")
+            run_at = now + schedule.interval + self.jitter(schedule.interval)
+        with self._lock:
+            # An update may have replaced or removed the schedule while it was running
+            still_scheduled = schedule.project_id in self._user_projects.get(schedule.user_id, ())
+            if still_scheduled and schedule.project_id not in self.queue:
+                self.queue.push(schedule, run_at)
+
+    def _listen(self):
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(SCHEDULER_UPDATES_CHANNEL)
+        try:
+            while not self._stopped.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message and message['type'] == 'message':
+                    try:
+                        self.handle_update(message['data'])
+                    except Exception as e:
+                        logger.error(f"Failed to apply schedule update: {str(e)}")
+        finally:
+            pubsub.close()
+
+    def lead(self):
+        self.load_all()
+        next_resync = self.clock() + Config.SCHEDULER_RESYNC_INTERVAL
+        while not self._stopped.is_set():
+            self.renew_leadership()
+            self.run_due()
+            now = self.clock()
+            if now >= next_resync:
+                self.load_all()
+                self.renew_leadership()
+                celery.send_task('backend.celery_worker.cleanup_old_tasks')
+                next_resync = now + Config.SCHEDULER_RESYNC_INTERVAL
+            with self._lock:
+                next_run = self.queue.next_run()
+            # Sleep until the next run, an update, or a lock renewal, whichever comes first
+            wait = min(next_resync, next_run if next_run is not None else next_resync) - self.clock()
+            self._wakeup.wait(max(0.0, min(wait, Config.SCHEDULER_LOCK_TIMEOUT / 3)))
+            self._wakeup.clear()
+
+    def serve_forever(self):
+        listener = None
+        try:
+            while not self._stopped.is_set():
+                lock = redis_client.lock(LEADER_LOCK_KEY, timeout=Config.SCHEDULER_LOCK_TIMEOUT)
+                logger.info("Waiting for scheduler leadership")
+                # Bounded, so stop() is noticed by instances that are not leading
+                if not lock.acquire(blocking=True, blocking_timeout=Config.SCHEDULER_LOCK_TIMEOUT):
+                    continue
+                if listener is None:
+                    listener = threading.Thread(target=self._listen, name='scheduler-updates', daemon=True)
+                    listener.start()
+                self._leader_lock = lock
+                try:
+                    self.lead()
+                except LockNotOwnedError:
+                    # The lock expired during a slow iteration and another instance leads now
+                    logger.warning("Lost scheduler leadership, no longer dispatching")
+                finally:
+                    self._leader_lock = None
+                    try:
+                        lock.release()
+                    except Exception:
+                        pass
+        finally:
+            self._stopped.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    RoutineScheduler().serve_forever()
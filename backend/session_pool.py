@@ -0,0 +1,288 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from .browser import build_chrome_options, launch_browser, TELEGRAM_WEB_URL, DRIVER_ERRORS
+from .config import Config
+from .slots import claim_slot
+from .profiles import provision_profile, sync_back_profile
+from .tracing import StartupTrace
+from .utils import percentile
+
+logger = logging.getLogger(__name__)
+
+# Overlay elements and page flags left behind by Player/Recorder runs
+RESET_PAGE_JS = """
+['playback-status', 'playing-indicator', 'recording-status', 'recording-complete'].forEach(function(id) {
+    var el = document.getElementById(id);
+    if (el) { el.remove(); }
+});
+window.playbackStarted = false;
+window.playbackStopped = false;
+"""
+
+class PoolTimeout(Exception):
+    pass
+
+class BrowserSession:
+    def __init__(self, driver, user_data_dir, index):
+        self.driver = driver
+        self.user_data_dir = user_data_dir
+        self.index = index
+        self.created_at = time.monotonic()
+        self.uses = 0
+
+    @classmethod
+    def launch(cls, user_data_dir, index=0, trace=None):
+        trace = trace or StartupTrace()
+        with trace.span('profile_provision'):
+            provision_profile(user_data_dir)
+        driver = launch_browser(build_chrome_options(user_data_dir), trace)
+        return cls(driver, user_data_dir, index)
+
+    @property
+    def age(self):
+        return time.monotonic() - self.created_at
+
+    def is_healthy(self):
+        try:
+            self.driver.execute_script("return document.readyState;")
+            return True
+        except DRIVER_ERRORS as e:
+            logger.warning(f"Session {self.index} failed health check: {str(e)}")
+            return False
+
+    def reset(self):
+        handles = self.driver.window_handles
+        for handle in handles[1:]:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(handles[0])
+        if not self.driver.current_url.startswith(TELEGRAM_WEB_URL):
+            self.driver.get(TELEGRAM_WEB_URL)
+            self.driver.fullscreen_window()
+        self.driver.execute_script(RESET_PAGE_JS)
+
+    def relaunch(self, trace=None):
+        """Replace the browser with a fresh one on the same profile, e.g. when it has grown too large."""
+        self.close()
+        trace = trace or StartupTrace()
+        with trace.span('profile_provision'):
+            provision_profile(self.user_data_dir)
+        self.driver = launch_browser(build_chrome_options(self.user_data_dir), trace)
+        self.created_at = time.monotonic()
+
+    def close(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.error(f"Failed to quit session {self.index}: {str(e)}")
+        sync_back_profile(self.user_data_dir)
+
+class PoolMetrics:
+    def __init__(self, window=1000):
+        self.lease_waits = deque(maxlen=window)
+        self.leases = 0
+        self.created = 0
+        self.recycled = 0
+        self.health_failures = 0
+
+    def record_wait(self, seconds):
+        self.leases += 1
+        self.lease_waits.append(seconds)
+
+    def snapshot(self):
+        waits = sorted(self.lease_waits)
+        return {
+            'leases': self.leases,
+            'created': self.created,
+            'recycled': self.recycled,
+            'health_failures': self.health_failures,
+            'lease_wait_p50': percentile(waits, 0.5),
+            'lease_wait_p95': percentile(waits, 0.95),
+            'lease_wait_max': waits[-1] if waits else 0.0,
+        }
+
+class SessionPool:
+    def __init__(self, slot, size=None, max_age=None, max_uses=None, lease_timeout=None):
+        self.slot = slot
+        self.size = size or Config.SESSION_POOL_SIZE
+        self.max_age = max_age or Config.SESSION_MAX_AGE
+        self.max_uses = max_uses or Config.SESSION_MAX_USES
+        self.lease_timeout = lease_timeout or Config.SESSION_LEASE_TIMEOUT
+        self.metrics = PoolMetrics()
+        self._idle = deque()
+        self._free_indexes = list(range(self.size))
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def user_data_dir_for(self, index):
+        # Chrome refuses to share a profile directory, so every pooled session gets its own
+        if index == 0:
+            return self.slot.profile_dir
+        return f"{self.slot.profile_dir}-{index}"
+
+    def _create_session(self, index, trace=None):
+        session = BrowserSession.launch(self.user_data_dir_for(index), index, trace)
+        self.metrics.created += 1
+        logger.info(f"Launched pooled browser session {index} in slot {self.slot.index}")
+        return session
+
+    def _needs_recycling(self, session):
+        return session.age > self.max_age or session.uses >= self.max_uses
+
+    def warm(self):
+        while True:
+            with self._cond:
+                if self._closed or not self._free_indexes:
+                    return
+                index = self._free_indexes.pop(0)
+            try:
+                session = self._create_session(index)
+            except Exception as e:
+                logger.error(f"Failed to warm browser session {index}: {str(e)}")
+                with self._cond:
+                    self._free_indexes.append(index)
+                    self._cond.notify()
+                return
+            with self._cond:
+                self._idle.append(session)
+                self._cond.notify()
+
+    def warm_async(self):
+        threading.Thread(target=self.warm, name='session-pool-warmup', daemon=True).start()
+
+    def acquire(self, timeout=None, trace=None):
+        trace = trace or StartupTrace()
+        timeout = self.lease_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            index = None
+            with self._cond:
+                while not self._idle and not self._free_indexes:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No browser session available after {timeout}s")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    session = self._idle.popleft()
+                else:
+                    index = self._free_indexes.pop(0)
+
+            if index is not None:
+                try:
+                    session = self._create_session(index, trace)
+                except Exception:
+                    self._retire_index(index)
+                    raise
+            elif self._needs_recycling(session) or not self._check_health(session, trace):
+                if not self._needs_recycling(session):
+                    self.metrics.health_failures += 1
+                self._discard(session)
+                continue
+
+            self.metrics.record_wait(time.monotonic() - started)
+            return session
+
+    def _check_health(self, session, trace):
+        with trace.span('health_check'):
+            return session.is_healthy()
+
+    def release(self, session, healthy=True):
+        session.uses += 1
+        if healthy and not self._closed and not self._needs_recycling(session):
+            try:
+                session.reset()
+            except DRIVER_ERRORS as e:
+                logger.warning(f"Failed to reset session {session.index}: {str(e)}")
+                healthy = False
+            if healthy:
+                with self._cond:
+                    self._idle.append(session)
+                    self._cond.notify()
+                return
+        self._discard(session)
+
+    def _discard(self, session):
+        self.metrics.recycled += 1
+        logger.info(f"Recycling browser session {session.index} after {session.uses} uses, {session.age:.0f}s")
+        session.close()
+        self._retire_index(session.index)
+
+    def _retire_index(self, index):
+        with self._cond:
+            self._free_indexes.append(index)
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self, timeout=None, trace=None):
+        trace = trace or StartupTrace()
+        with trace.span('session_lease'):
+            session = self.acquire(timeout, trace)
+        healthy = True
+        try:
+            yield session
+        except DRIVER_ERRORS:
+            healthy = False
+            raise
+        finally:
+            self.release(session, healthy=healthy)
+            logger.info(f"Session pool metrics: {self.metrics.snapshot()}")
+
+    def evict(self, user_data_dir):
+        """Close the idle session running on this profile, e.g. so another browser can use it."""
+        with self._cond:
+            sessions = [session for session in self._idle if session.user_data_dir == user_data_dir]
+            for session in sessions:
+                self._idle.remove(session)
+        for session in sessions:
+            self._discard(session)
+        return len(sessions)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            sessions = list(self._idle)
+            self._idle.clear()
+        for session in sessions:
+            session.close()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_session_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool(claim_slot())
+        return _pool
+
+def evict_pooled_profile(user_data_dir):
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.evict(user_data_dir)
+
+def close_session_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+@contextmanager
+def lease_session(trace=None):
+    """A ready browser session for one run; with a trace, the lease and any launch are recorded in it."""
+    if not Config.SESSION_POOL_ENABLED:
+        trace = trace or StartupTrace()
+        with trace.span('session_lease'):
+            session = BrowserSession.launch(claim_slot().profile_dir, trace=trace)
+        try:
+            yield session
+        finally:
+            session.close()
+        return
+    with get_session_pool().lease(trace=trace) as session:
+        yield session
@@ -0,0 +1,119 @@
+import os
+import time
+import logging
+import threading
+from .config import Config
+from .profiles import profile_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+class NoFreeSlot(Exception):
+    pass
+
+class Slot:
+    """One browser execution slot: its own profile directory, display and host-wide lock."""
+
+    def __init__(self, index, lock_file):
+        self.index = index
+        self._lock_file = lock_file
+
+    @property
+    def profile_dir(self):
+        if Config.PROFILE_CLONING:
+            # A working copy of the template, provisioned when a browser launches on it
+            return profile_path(f"slot{self.index}")
+        # Slot 0 keeps the original profile so single-slot hosts behave as before
+        if self.index == 0:
+            return Config.CHROME_USER_DATA_DIR
+        return f"{Config.CHROME_USER_DATA_DIR}-slot{self.index}"
+
+    @property
+    def headless_profile_dir(self):
+        # Headless runs get their own working copy, so the slot's warm headed sessions keep theirs
+        return profile_path(f"slot{self.index}-headless") if Config.PROFILE_CLONING else None
+
+    @property
+    def display(self):
+        if Config.SLOT_DISPLAY_BASE is None:
+            return os.environ.get('DISPLAY')
+        return f":{Config.SLOT_DISPLAY_BASE + self.index}"
+
+    def apply_environment(self):
+        # Chrome and the pynput listeners both pick the X display up from the process environment
+        if self.display:
+            os.environ['DISPLAY'] = self.display
+
+    def release(self):
+        if self._lock_file is None:
+            return
+        try:
+            _unlock(self._lock_file)
+        finally:
+            self._lock_file.close()
+            self._lock_file = None
+        logger.info(f"Released browser slot {self.index}")
+
+def _lock(lock_file):
+    if fcntl:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+
+def _unlock(lock_file):
+    if fcntl:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+class SlotManager:
+    def __init__(self, count=None, lock_dir=None):
+        self.count = count or Config.BROWSER_SLOTS
+        self.lock_dir = lock_dir or Config.SLOT_LOCK_DIR
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def try_acquire(self, index):
+        lock_file = open(os.path.join(self.lock_dir, f"slot-{index}.lock"), 'a+')
+        try:
+            _lock(lock_file)
+        except OSError:
+            lock_file.close()
+            return None
+        logger.info(f"Acquired browser slot {index} (pid {os.getpid()})")
+        return Slot(index, lock_file)
+
+    def acquire(self, timeout=0, poll_interval=0.5):
+        deadline = time.monotonic() + timeout
+        while True:
+            for index in range(self.count):
+                slot = self.try_acquire(index)
+                if slot:
+                    return slot
+            if time.monotonic() >= deadline:
+                raise NoFreeSlot(f"All {self.count} browser slots on this host are busy")
+            time.sleep(poll_interval)
+
+_slot = None
+_slot_lock = threading.Lock()
+
+def claim_slot(timeout=0):
+    """Claim a slot for this worker process; it is held until the process exits."""
+    global _slot
+    with _slot_lock:
+        if _slot is None:
+            _slot = SlotManager().acquire(timeout)
+            _slot.apply_environment()
+        return _slot
+
+def release_slot():
+    global _slot
+    with _slot_lock:
+        if _slot is not None:
+            _slot.release()
+            _slot = None
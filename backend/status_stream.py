@@ -0,0 +1,140 @@
+"""Live recording/playback status pushed over Redis pub/sub and served as server-sent events.
+
+Every run publishes to its user's channel, so one SSE connection follows all of a user's routines.
+The latest event of each run is also kept in a hash so a client that connects mid-run starts
+from the current state instead of waiting for the next update.
+"""
+import json
+import time
+import logging
+import threading
+from .config import Config
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATES = ('completed', 'stopped', 'failed')
+
+def status_channel(user_id):
+    return f"status:{user_id}"
+
+def latest_status_key(user_id):
+    return f"status_latest:{user_id}"
+
+def publish_status(user_id, event):
+    payload = json.dumps(event, default=str)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(latest_status_key(user_id), f"{event['kind']}:{event['routine_name']}", payload)
+        pipe.expire(latest_status_key(user_id), Config.STATUS_SNAPSHOT_TTL)
+        pipe.publish(status_channel(user_id), payload)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to publish status for {event.get('routine_name')}: {str(e)}")
+
+class StatusReporter:
+    """Publishes the state of one recording or playback run.
+
+    Progress is sampled from the watched player by a background thread, so the click loop only
+    updates two integers and never waits on Redis.
+    """
+
+    def __init__(self, user_id, routine_name, kind='playback', task_id=None, interval=None):
+        self.user_id = str(user_id)
+        self.routine_name = routine_name
+        self.kind = kind
+        self.task_id = task_id
+        self.interval = interval or Config.STATUS_PROGRESS_INTERVAL
+        self._player = None
+        # Fields sent with every event of the run, e.g. its timing after compression
+        self.context = {}
+        self._last_progress = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def event(self, state, **fields):
+        event = {
+            'kind': self.kind,
+            'routine_name': self.routine_name,
+            'task_id': self.task_id,
+            'state': state,
+            'timestamp': time.time(),
+        }
+        event.update(self.context)
+        event.update(fields)
+        return event
+
+    def publish(self, state, **fields):
+        publish_status(self.user_id, self.event(state, **fields))
+
+    def watch(self, player):
+        self._player = player
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=f'status-{self.routine_name}', daemon=True)
+        self._thread.start()
+
+    def progress(self):
+        player = self._player
+        return {
+            'action_index': player.action_index,
+            'action_count': len(player.routine),
+            'loop': player.loop,
+            'playing': player.is_playing,
+            'paused': player.paused,
+            'drift': player.scheduler.stats(),
+        }
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            progress = self.progress()
+            # Nothing moved (e.g. waiting for the start key): skip the publish
+            if progress == self._last_progress:
+                continue
+            self._last_progress = progress
+            if progress['paused']:
+                state = 'paused'
+            else:
+                state = 'playing' if progress['playing'] else 'waiting'
+            self.publish(state, **progress)
+
+    def unwatch(self):
+        # Stops sampling without publishing, e.g. before a restarted run watches its new player
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def finish(self, state, **fields):
+        self.unwatch()
+        if self._player:
+            fields = dict(self.progress(), **fields)
+        self.publish(state, **fields)
+
+def format_sse(payload, event=None):
+    if isinstance(payload, bytes):
+        payload = payload.decode()
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in payload.splitlines())
+    return '\n'.join(lines) + '\n\n'
+
+def stream_status(user_id, keepalive=None):
+    """Yields SSE frames for every run of a user until the client disconnects."""
+    keepalive = keepalive or Config.STATUS_KEEPALIVE
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the snapshots so nothing published in between is missed
+    pubsub.subscribe(status_channel(user_id))
+    try:
+        for payload in redis_client.hvals(latest_status_key(user_id)):
+            yield format_sse(payload)
+        last_sent = time.monotonic()
+        while True:
+            message = pubsub.get_message(timeout=keepalive)
+            if message and message['type'] == 'message':
+                yield format_sse(message['data'])
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= keepalive:
+                # Comment frame; keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+    finally:
+        pubsub.close()
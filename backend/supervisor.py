@@ -0,0 +1,168 @@
+"""Supervised playback: a watchdog for the browser and restarts that resume from a checkpoint.
+
+A Watchdog thread runs next to every supervised player. The player marks when each click's
+WebDriver command was sent (Player.busy_since); a command in flight for longer than
+WATCHDOG_TIMEOUT, or chromedriver or Chrome exiting, counts as a crash. The watchdog then kills
+the browser so a blocked command fails, and posts a 'crashed' signal so a player sleeping through
+a long gap wakes up and raises BrowserCrashed.
+
+PlaybackSupervisor catches any driver failure, hands the broken session back to the pool (which
+discards it), waits with exponential backoff and starts a new player on a fresh session. That
+player resumes at the loop and action that were in flight (PLAYBACK_RESUME_FROM=loop restarts
+the loop instead). Restarts are bounded by PLAYBACK_MAX_RESTARTS. The count resets once a
+resumed run completes a loop, so a repeat run survives one crash a day for as long as it runs.
+"""
+import time
+import logging
+import threading
+from .browser import DRIVER_ERRORS
+from .config import Config
+from .memory import browser_processes, psutil
+from .player import Player
+from .session_pool import lease_session
+
+logger = logging.getLogger(__name__)
+
+def kill_browser(driver):
+    # Chrome first, then chromedriver, so a command blocked on the driver fails instead of hanging
+    for process in browser_processes(driver) or []:
+        try:
+            process.kill()
+        except psutil.Error:
+            pass
+    service = getattr(driver, 'service', None)
+    process = getattr(service, 'process', None)
+    if process is not None:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+class Watchdog:
+    def __init__(self, player, timeout=None, interval=None):
+        self.player = player
+        self.timeout = Config.WATCHDOG_TIMEOUT if timeout is None else timeout
+        self.interval = Config.WATCHDOG_INTERVAL if interval is None else interval
+        self.reason = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=f'watchdog-{self.player.routine_name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def check(self):
+        """Why the browser looks dead, or None."""
+        player = self.player
+        if player.recycling:
+            # The old browser exits on purpose while the new one starts
+            return None
+        busy_since = player.busy_since
+        if busy_since is not None and time.monotonic() - busy_since > self.timeout:
+            return f"WebDriver command hung for more than {self.timeout}s"
+        driver = player.driver
+        if driver is None:
+            return None
+        process = getattr(getattr(driver, 'service', None), 'process', None)
+        if process is not None and process.poll() is not None:
+            return "chromedriver exited"
+        # An empty list means chromedriver is alive but its Chrome is gone; None means unknown
+        if browser_processes(driver) == []:
+            return "Chrome exited"
+        return None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            reason = self.check()
+            # Checked again in case a relaunch began while the old processes were being looked at
+            if reason and not self.player.recycling:
+                self.reason = reason
+                logger.error(f"Watchdog: {reason} in routine {self.player.routine_name}, killing the browser")
+                kill_browser(self.player.driver)
+                self.player.signals.post('crashed')
+                return
+
+class PlaybackSupervisor:
+    def __init__(self, routine_name, actions, repeat=False, reporter=None, run_id=None, trace=None,
+                 max_restarts=None, backoff=None, max_backoff=None, autostart=False):
+        self.routine_name = routine_name
+        self.actions = actions
+        self.repeat = repeat
+        self.autostart = autostart
+        self.reporter = reporter
+        self.run_id = run_id
+        self.trace = trace
+        self.max_restarts = Config.PLAYBACK_MAX_RESTARTS if max_restarts is None else max_restarts
+        self.backoff = Config.PLAYBACK_RESTART_BACKOFF if backoff is None else backoff
+        self.max_backoff = Config.PLAYBACK_RESTART_BACKOFF_MAX if max_backoff is None else max_backoff
+        self.restarts = []
+
+    def make_player(self, session, previous=None):
+        player = Player(self.routine_name, self.actions, self.repeat, session=session, reporter=self.reporter,
+                        run_id=self.run_id, trace=self.trace if previous is None else None, autostart=self.autostart)
+        if previous is not None:
+            # One run as far as drift and memory history are concerned
+            player.scheduler = previous.scheduler
+            if previous.governor and player.governor:
+                player.governor = previous.governor
+        return player
+
+    def run(self):
+        """Play until the run ends normally; returns the last player. Raises once restarts run out."""
+        previous = None
+        checkpoint = None
+        attempts = 0
+        while True:
+            player = None
+            watchdog = None
+            try:
+                with lease_session(self.trace if previous is None else None) as session:
+                    player = self.make_player(session, previous)
+                    if Config.WATCHDOG_ENABLED:
+                        watchdog = Watchdog(player)
+                        watchdog.start()
+                    if checkpoint is None:
+                        player.start()
+                    else:
+                        player.resume(checkpoint)
+                    player.play()
+                    if watchdog:
+                        watchdog.stop()
+                return player
+            except DRIVER_ERRORS as e:
+                if watchdog:
+                    watchdog.stop()
+                if player is None or player.stop_requested:
+                    raise
+                player.signals.detach()
+                if self.reporter:
+                    self.reporter.unwatch()
+                if checkpoint is not None and player.loop > checkpoint['loop']:
+                    # The resumed run got through a whole loop, so this is a new failure, not the same one again
+                    attempts = 0
+                attempts += 1
+                checkpoint = player.checkpoint()
+                error = (watchdog.reason if watchdog and watchdog.reason else None) or str(e)
+                if attempts > self.max_restarts:
+                    logger.error(f"Giving up on routine {self.routine_name} after {attempts - 1} restarts: {error}")
+                    raise
+                delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+                self.restarts.append({'at': time.time(), 'error': error, 'checkpoint': checkpoint, 'delay_s': delay})
+                logger.warning(f"Browser failed in routine {self.routine_name} ({error}), restarting in {delay}s "
+                               f"from loop {checkpoint['loop']}, action {checkpoint['action_index']}")
+                if self.reporter:
+                    self.reporter.publish('recovering', attempt=attempts, delay_s=delay, error=error, **checkpoint)
+                time.sleep(delay)
+                previous = player
+
+def supervise_playback(routine_name, actions, repeat=False, reporter=None, run_id=None, trace=None, autostart=False):
+    supervisor = PlaybackSupervisor(routine_name, actions, repeat, reporter=reporter, run_id=run_id, trace=trace,
+                                    autostart=autostart)
+    return supervisor.run(), supervisor.restarts
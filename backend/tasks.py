@@ -1,18 +1,78 @@
 from .celery_worker import celery
 from .recorder import start_recording
-from .player import start_playback
-from .supabase_client import supabase
+from .supervisor import supervise_playback
+from .playlist import start_playlist, parse_playlist
+from .headless import HeadlessPlayer, compile_headless_events
+from .repository import routines, calibrations
+from .session_pool import get_session_pool, close_session_pool, evict_pooled_profile, lease_session
+from .slots import claim_slot, release_slot, NoFreeSlot
+from .profiles import collect_garbage_async
+from .config import Config
 import json
 import logging
 from celery.exceptions import SoftTimeLimitExceeded
 from .utils import sanitize_data
-from celery.result import AsyncResult
-from celery.app.control import Inspect, Control
+from .routine_format import encode_routine, load_routine
+from .playback_plan import compile_plan, store_plan, get_cached_plan, invalidate_plan, invalidate_routine_plans
+from .pacing import Pacing, pace_plan, record_pacing_success, record_pacing_failure
+from .dashboard import invalidate_dashboard
+from .status_stream import StatusReporter
+from .control import send_control
+from .write_behind import record_activity, record_stats, utcnow, start_flusher, stop_flusher
+from celery.signals import worker_process_init, worker_ready, worker_shutdown, before_task_publish
+from .tracing import StartupTrace
 from uuid import UUID
+import time
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+def prepare_worker_slot():
+    start_flusher()
+    if Config.PROFILE_CLONING:
+        collect_garbage_async()
+    try:
+        claim_slot()
+    except NoFreeSlot as e:
+        logger.warning(f"Worker process started without a browser slot: {str(e)}")
+        return
+    if Config.SESSION_POOL_ENABLED:
+        get_session_pool().warm_async()
+
+@worker_process_init.connect
+def prepare_slot_in_child(**kwargs):
+    prepare_worker_slot()
+
+@worker_ready.connect
+def prepare_slot_in_solo_worker(**kwargs):
+    # Solo workers run tasks in the main process, so worker_process_init never fires
+    if celery.conf.worker_pool == 'solo':
+        prepare_worker_slot()
+
+@worker_shutdown.connect
+def release_worker_slot(**kwargs):
+    close_session_pool()
+    release_slot()
+    stop_flusher()
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    # Lets the worker's startup trace include the time the task sat in the queue
+    if headers is not None:
+        headers.setdefault('enqueued_at', time.time())
+
+def startup_trace(task, user_id, kind, routine_name):
+    return StartupTrace(user_id, kind, routine_name, run_id=task.request.id,
+                        enqueued_at=getattr(task.request, 'enqueued_at', None))
+
+def require_slot(task):
+    # Hand the task back to the queue until another process frees a slot
+    try:
+        return claim_slot()
+    except NoFreeSlot as e:
+        # An explicit limit: max_retries=None would mean the task's own limit, not unlimited
+        raise task.retry(exc=e, countdown=Config.SLOT_RETRY_DELAY, max_retries=Config.SLOT_MAX_RETRIES)
+
 def update_recording_status(user_id, routine_name, status):
     key = f"recording_status:{user_id}:{routine_name}"
     celery.backend.set(key, status)
@@ -21,190 +81,337 @@ def get_recording_status(user_id, routine_name):
     key = f"recording_status:{user_id}:{routine_name}"
     return celery.backend.get(key)
 
-@celery.task(bind=True, name='backend.tasks.start_recording_task', max_retries=0, soft_time_limit=600, time_limit=610)
-def start_recording_task(self, routine_name, tokens_per_run, user_id):
+@celery.task(bind=True, name='backend.tasks.start_recording_task', soft_time_limit=600, time_limit=610)
+def start_recording_task(self, routine_name, tokens_per_run, user_id, mode=None):
+    require_slot(self)
+    reporter = StatusReporter(user_id, routine_name, kind='recording', task_id=self.request.id)
+    trace = startup_trace(self, user_id, 'recording', routine_name)
     try:
         logger.info(f"Starting recording task for routine: {routine_name}")
-        result = start_recording(routine_name)
+        reporter.publish('started')
+        with lease_session(trace) as session:
+            result = start_recording(routine_name, session=session, mode=mode, trace=trace)
+        trace.save()
         logger.info(f"Recording result: {result}")
         if result and result.get('actions'):
             sanitized_result = sanitize_data(result)
             try:
-                # Check if the routine already exists
-                existing_routine = supabase.table('routines').select('*').eq('name', routine_name).eq('user_id', user_id).execute()
-                
-                if existing_routine.data:
-                    # Update existing routine
-                    update_result = supabase.table('routines').update({
-                        'steps': json.dumps(sanitized_result),
-                        'tokens_per_run': tokens_per_run,
-                        'updated_at': 'now()'
-                    }).eq('name', routine_name).eq('user_id', user_id).execute()
-                    logger.info(f"Routine updated in database: {update_result}")
-                else:
-                    # Insert new routine
-                    insert_result = supabase.table('routines').insert({
-                        'name': routine_name,
-                        'user_id': user_id,
-                        'steps': json.dumps(sanitized_result),
-                        'tokens_per_run': tokens_per_run
-                    }).execute()
-                    logger.info(f"New routine saved to database: {insert_result}")
+                # Updates the existing routine of this name, or creates it
+                saved_row = routines.save_steps(user_id, routine_name, encode_routine(sanitized_result), tokens_per_run)
+                logger.info(f"Routine saved to database: {routine_name}")
                 
+                if saved_row:
+                    try:
+                        refresh_playback_plan(saved_row, user_id)
+                    except Exception as e:
+                        logger.error(f"Failed to compile playback plan for routine {routine_name}: {str(e)}")
+                invalidate_dashboard(user_id)
+                reporter.publish('completed', action_count=len(result['actions']), capture=result.get('capture'))
                 return f"Recording completed for routine: {routine_name}"
             except Exception as e:
                 logger.error(f"Failed to save routine: {str(e)}")
                 raise
         else:
             logger.warning(f"No actions recorded for routine: {routine_name}")
+            reporter.publish('completed', action_count=0)
             return f"No actions recorded for routine: {routine_name}"
     except SoftTimeLimitExceeded:
         logger.error(f"Recording task timed out for routine: {routine_name}")
+        reporter.publish('failed', error='timed out')
         return f"Recording task timed out for routine: {routine_name}"
     except Exception as e:
         logger.error(f"Error during recording: {str(e)}")
+        trace.save()
+        reporter.publish('failed', error=str(e))
         raise
 
-def delete_routine(routine_name):
+def delete_routine(routine_name, user_id=None):
     try:
-        supabase.table('routines').delete().eq('name', routine_name).execute()
+        routines.delete_by_name(routine_name, user_id)
+        if user_id is not None:
+            invalidate_plan(user_id, routine_name)
+        else:
+            invalidate_routine_plans(routine_name)
         logging.info(f"Deleted routine: {routine_name}")
     except Exception as e:
         logging.error(f"Failed to delete routine: {str(e)}")
 
 @celery.task(bind=True)
 def run_routine(self, routine_id, user_id):
-    routine = supabase.table('routines').select('*').eq('id', routine_id).single().execute()
-    if not routine.data:
+    routine = routines.get(routine_id)
+    if not routine:
         return "Routine not found"
     
-    steps = json.loads(routine.data['steps'])
+    steps = load_routine(routine['steps'])
     # Implement the logic to run the routine steps
     # ...
 
     # Update user stats
-    supabase.table('user_stats').upsert({
-        'user_id': user_id,
-        'total_routine_runs': supabase.raw('total_routine_runs + 1')
-    }).execute()
+    record_stats(user_id, increments={'total_routine_runs': 1}, values={'last_run_date': utcnow()})
+
+    return f"Routine {routine['name']} completed"
 
-    return f"Routine {routine.data['name']} completed"
+def load_routine_row(routine_name, user_id):
+    return routines.latest_by_name(user_id, routine_name)
 
-@celery.task(bind=True, name='backend.tasks.start_playback_task', max_retries=0, soft_time_limit=None, time_limit=None)
-def start_playback_task(self, routine_name, user_id, repeat_indefinitely=False):
+def refresh_playback_plan(routine_row, user_id):
+    # Compiles the plan once at save time so playback starts from a single cache hit
+    try:
+        plan = compile_plan(routine_row, get_user_calibration_data(user_id))
+    except Exception:
+        # Never leave the plan of the previous version cached; the next playback compiles again
+        try:
+            invalidate_plan(user_id, routine_row.get('name'))
+        except Exception as e:
+            logger.error(f"Failed to drop cached playback plan for routine {routine_row.get('name')}: {str(e)}")
+        raise
+    try:
+        store_plan(plan, user_id)
+    except Exception as e:
+        logger.error(f"Failed to cache playback plan for routine {routine_row.get('name')}: {str(e)}")
+        try:
+            invalidate_plan(user_id, routine_row.get('name'))
+        except Exception:
+            pass
+    return plan
+
+def get_playback_plan(routine_name, user_id):
+    plan = get_cached_plan(user_id, routine_name)
+    if plan:
+        return plan
+    logger.info(f"No cached playback plan for routine: {routine_name}, compiling")
+    routine_row = load_routine_row(routine_name, user_id)
+    if not routine_row:
+        return None
+    return refresh_playback_plan(routine_row, user_id)
+
+@celery.task(bind=True, name='backend.tasks.start_playback_task', soft_time_limit=None, time_limit=None)
+def start_playback_task(self, routine_name, user_id, repeat_indefinitely=False, pacing=None, autostart=False):
     logging.info(f"Starting playback for routine: {routine_name}")
+    require_slot(self)
+    reporter = StatusReporter(user_id, routine_name, kind='playback', task_id=self.request.id)
+    trace = startup_trace(self, user_id, 'playback', routine_name)
+    # Set once playback runs with learned pacing, so a failure from then on backs the gaps off
+    learning_plan = None
     try:
-        # Convert user_id to UUID
+        # Validate user_id before anything is queued under it
         user_uuid = UUID(user_id)
+        reporter.publish('started', repeat=repeat_indefinitely)
         
         # Log the start of playback
-        try:
-            supabase.table('activities').insert({
-                'user_id': user_uuid,
-                'action_type': 'playback_start',
-                'details': json.dumps({'routine_name': routine_name, 'repeat_indefinitely': repeat_indefinitely})
-            }).execute()
-        except Exception as e:
-            logging.error(f"Failed to log playback start: {str(e)}")
+        record_activity(user_uuid, 'playback_start', {'routine_name': routine_name, 'repeat_indefinitely': repeat_indefinitely})
         
-        routines = supabase.table('routines').select('*').eq('name', routine_name).eq('user_id', user_id).execute()
-        logging.info(f"Retrieved routines: {routines.data}")
-        
-        if not routines.data:
+        with trace.span('load_plan'):
+            plan = get_playback_plan(routine_name, user_id)
+        if plan is None:
+            reporter.publish('failed', error='routine not found')
             return f"Routine not found: {routine_name}"
+        pacing = Pacing.from_options(pacing)
+        with trace.span('pace_plan'):
+            actions, timing = pace_plan(plan, pacing)
+        reporter.context['timing'] = timing
         
-        if len(routines.data) > 1:
-            logging.warning(f"Multiple routines found with name '{routine_name}'. Using the most recent one.")
-            routine = max(routines.data, key=lambda x: x['created_at'])
-        else:
-            routine = routines.data[0]
-        
-        recorded_data = routine['steps']
-        logging.info(f"Recorded data: {recorded_data}")
-        
-        if isinstance(recorded_data, str):
-            recorded_data = json.loads(recorded_data)
-        
-        if isinstance(recorded_data, list):
-            actions = recorded_data
-        elif isinstance(recorded_data, dict) and 'actions' in recorded_data:
-            actions = recorded_data['actions']
-        else:
-            raise ValueError(f"Unexpected recorded_data format: {type(recorded_data)}")
-        
-        logging.info(f"Loaded {len(actions)} actions for playback")
+        logging.info(f"Loaded {len(actions)} actions for playback, duration {timing['before']['duration_s']}s -> {timing['after']['duration_s']}s ({pacing.to_dict()})")
         
         if not actions:
             logging.warning("No actions to play")
+            reporter.publish('completed', action_count=0)
             return "No actions to play"
         
-        player = start_playback(routine_name, {'actions': actions}, repeat_indefinitely)
-        
-        # Store task ID in a way that can be accessed for cleanup
+        # Stored before the player starts, so a stop can reach it while it waits for the start key
         celery.backend.set(f'playback_task:{user_id}:{routine_name}', self.request.id)
         
-        player.play()
+        if pacing.learn:
+            learning_plan = plan
+        # Restarts the browser and resumes from the last checkpoint if it crashes or hangs
+        player, restarts = supervise_playback(routine_name, actions, repeat_indefinitely, reporter=reporter, run_id=self.request.id,
+                                              trace=trace, autostart=autostart)
         
         # Clean up task ID after completion
         celery.backend.delete(f'playback_task:{user_id}:{routine_name}')
+        trace.save()
         
         # Log the completion of playback
-        try:
-            supabase.table('activities').insert({
-                'user_id': user_uuid,
-                'action_type': 'playback_complete',
-                'details': json.dumps({'routine_name': routine_name})
-            }).execute()
-        except Exception as e:
-            logging.error(f"Failed to log playback completion: {str(e)}")
+        record_activity(user_uuid, 'playback_complete', {
+            'routine_name': routine_name,
+            'drift': player.scheduler.stats(),
+            'timing': timing,
+            'memory': player.governor.summary() if player.governor else None,
+            'restarts': restarts,
+        })
+        if learning_plan is not None:
+            if restarts or player.scheduler.skipped:
+                record_pacing_failure(plan)
+            elif player.loop > 0:
+                # At least one full pass went through with these gaps, without a crash or a dropped action
+                record_pacing_success(plan, actions)
+        record_stats(user_uuid, increments={'total_routine_runs': 1}, values={'last_run_date': utcnow()})
+        reporter.finish('stopped' if player.stop_requested else 'completed')
         
         logging.info(f"Playback completed for routine: {routine_name}")
         return f"Playback completed for routine: {routine_name}"
     except Exception as e:
         # Clean up task ID in case of error
         celery.backend.delete(f'playback_task:{user_id}:{routine_name}')
+        trace.save()
+        if learning_plan is not None:
+            record_pacing_failure(learning_plan)
         # Log the error
-        try:
-            supabase.table('activities').insert({
-                'user_id': user_uuid,
-                'action_type': 'playback_error',
-                'details': json.dumps({'routine_name': routine_name, 'error': str(e)})
-            }).execute()
-        except Exception as log_error:
-            logging.error(f"Failed to log playback error: {str(log_error)}")
+        record_activity(user_id, 'playback_error', {'routine_name': routine_name, 'error': str(e)})
+        reporter.finish('failed', error=str(e))
         logging.error(f"Error during playback: {str(e)}")
         raise
 
-@celery.task(name='backend.tasks.stop_playback_task')
-def stop_playback_task(task_id):
+@celery.task(bind=True, name='backend.tasks.start_playlist_task', soft_time_limit=None, time_limit=None)
+def start_playlist_task(self, playlist_name, user_id, items, pacing=None):
+    logging.info(f"Starting playlist: {playlist_name}")
+    require_slot(self)
+    reporter = StatusReporter(user_id, playlist_name, kind='playlist', task_id=self.request.id)
+    trace = startup_trace(self, user_id, 'playlist', playlist_name)
     try:
-        task = AsyncResult(task_id)
-        if task.state == 'PLAYING':
-            player = task.info.get('player')
-            if player:
-                player.stop()
-                return "Playback stopped successfully"
-        return "No active playback found to stop"
+        user_uuid = UUID(user_id)
+        items = parse_playlist(items)
+        reporter.publish('started', items=[item.to_dict() for item in items])
+        record_activity(user_uuid, 'playlist_start', {'playlist_name': playlist_name, 'items': [item.to_dict() for item in items]})
+
+        # Every routine is loaded before the browser is touched, so a missing one fails fast
+        pacing = Pacing.from_options(pacing)
+        plans = {}
+        with trace.span('load_plan'):
+            for item in items:
+                if item.name not in plans:
+                    plan = get_playback_plan(item.name, user_id)
+                    if plan is None:
+                        reporter.publish('failed', error=f'routine not found: {item.name}')
+                        return f"Routine not found: {item.name}"
+                    plans[item.name] = (plan,) + pace_plan(plan, pacing)
+                item.routine = plans[item.name][1]
+
+        # Same marker as a single routine, so /stop_playback, /pause_playback and /resume_playback work by playlist name
+        celery.backend.set(f'playback_task:{user_id}:{playlist_name}', self.request.id)
+
+        with lease_session(trace) as session:
+            player = start_playlist(playlist_name, items, session=session, reporter=reporter, run_id=self.request.id, trace=trace)
+            player.play()
+
+        celery.backend.delete(f'playback_task:{user_id}:{playlist_name}')
+        trace.save()
+
+        results = player.results
+        record_activity(user_uuid, 'playlist_complete', {'playlist_name': playlist_name, 'items': results})
+        if pacing.learn:
+            failed = {result['routine_name'] for result in results
+                      if result['status'] == 'failed' or result.get('drift', {}).get('skipped')}
+            for name in failed:
+                record_pacing_failure(plans[name][0])
+            for name in {result['routine_name'] for result in results if result['status'] == 'completed'} - failed:
+                plan, actions, _ = plans[name]
+                record_pacing_success(plan, actions)
+        passes = sum(result['passes'] for result in results)
+        if passes:
+            record_stats(user_uuid, increments={'total_routine_runs': passes}, values={'last_run_date': utcnow()})
+        reporter.finish('stopped' if player.stop_requested else 'completed', summary=player.summary())
+
+        logging.info(f"Playlist completed: {playlist_name}")
+        return f"Playlist completed: {playlist_name}"
+    except Exception as e:
+        celery.backend.delete(f'playback_task:{user_id}:{playlist_name}')
+        trace.save()
+        record_activity(user_id, 'playlist_error', {'playlist_name': playlist_name, 'error': str(e)})
+        reporter.finish('failed', error=str(e))
+        logging.error(f"Error during playlist: {str(e)}")
+        raise
+
+def report_pacing_failure(routine_name, user_id):
+    # A run that finished but did not do its job, as judged by the user
+    plan = get_playback_plan(routine_name, user_id)
+    if plan is None:
+        return False
+    record_pacing_failure(plan)
+    return True
+
+def preview_pacing(routine_name, user_id, pacing):
+    plan = get_playback_plan(routine_name, user_id)
+    if plan is None:
+        return None
+    return pace_plan(plan, pacing)[1]
+
+def translate_to_headless(routine_name, user_id):
+    plan = get_playback_plan(routine_name, user_id)
+    if plan is None:
+        return None
+    return compile_headless_events(plan.routine)
+
+@celery.task(bind=True, name='backend.tasks.start_headless_playback_task', soft_time_limit=None, time_limit=None)
+def start_headless_playback_task(self, routine_name, user_id, repeat_indefinitely=False, events=None):
+    logging.info(f"Starting headless playback for routine: {routine_name}")
+    slot = require_slot(self)
+    # Shows up in the routine list like any playback; the context marks it as headless
+    reporter = StatusReporter(user_id, routine_name, kind='playback', task_id=self.request.id)
+    reporter.context['headless'] = True
+    try:
+        user_uuid = UUID(user_id)
+        reporter.publish('started', repeat=repeat_indefinitely)
+        record_activity(user_uuid, 'playback_start', {'routine_name': routine_name, 'repeat_indefinitely': repeat_indefinitely, 'headless': True})
+        
+        if events is None:
+            # /translate_headless passes the events it compiled; other callers get them compiled here
+            events = translate_to_headless(routine_name, user_id)
+        if events is None:
+            reporter.publish('failed', error='routine not found')
+            return f"Routine not found: {routine_name}"
+        if not events:
+            reporter.publish('completed', action_count=0)
+            return "No actions to play"
+        
+        profile_dir = slot.headless_profile_dir
+        if profile_dir is None:
+            # Without cloning it shares the slot profile, and Chrome refuses to open a profile twice
+            profile_dir = slot.profile_dir
+            evict_pooled_profile(profile_dir)
+        player = HeadlessPlayer(routine_name, events, profile_dir, repeat=repeat_indefinitely, run_id=self.request.id, reporter=reporter)
+        celery.backend.set(f'playback_task:{user_id}:{routine_name}', self.request.id)
+        player.start()
+        player.play()
+        celery.backend.delete(f'playback_task:{user_id}:{routine_name}')
+        
+        record_activity(user_uuid, 'playback_complete', {
+            'routine_name': routine_name,
+            'headless': True,
+            'drift': player.scheduler.stats(),
+        })
+        record_stats(user_uuid, increments={'total_routine_runs': 1}, values={'last_run_date': utcnow()})
+        reporter.finish('stopped' if player.stop_requested else 'completed')
+        logging.info(f"Headless playback completed for routine: {routine_name}")
+        return f"Headless playback completed for routine: {routine_name}"
     except Exception as e:
-        logging.error(f"Error stopping playback: {str(e)}")
-        return f"Error stopping playback: {str(e)}"
+        celery.backend.delete(f'playback_task:{user_id}:{routine_name}')
+        record_activity(user_id, 'playback_error', {'routine_name': routine_name, 'error': str(e), 'headless': True})
+        reporter.finish('failed', error=str(e))
+        logging.error(f"Error during headless playback: {str(e)}")
+        raise
+
+def control_playback(user_id, routine_name, signal):
+    """Send stop/pause/resume to a routine's running playback, wherever it runs.
 
-def revoke_task(task_id):
-    control = Control(celery)
-    control.revoke(task_id, terminate=True)
+    The player acts on it before its next action; on stop it ends the run and hands its browser
+    session back itself, so no task ever needs to be revoked.
+    """
+    task_id = celery.backend.get(f'playback_task:{user_id}:{routine_name}')
+    if not task_id:
+        return False
+    send_control(task_id.decode() if isinstance(task_id, bytes) else task_id, signal)
+    return True
 
 @celery.task(name='backend.tasks.cleanup_playback_task')
 def cleanup_playback_task(user_id, routine_name):
-    task_id = celery.backend.get(f'playback_task:{user_id}:{routine_name}')
-    if task_id:
-        revoke_task(task_id)
+    if control_playback(user_id, routine_name, 'stop'):
         celery.backend.delete(f'playback_task:{user_id}:{routine_name}')
 
 def get_user_calibration_data(user_id):
     try:
-        calibration = supabase.table('user_calibrations').select('*').eq('user_id', user_id).order('updated_at', desc=True).limit(1).execute()
-        if calibration.data:
-            calibration_data = calibration.data[0]
+        calibration_data = calibrations.latest(user_id)
+        if calibration_data:
             return {
                 'browser': json.loads(calibration_data.get('browser_calibration') or '[]'),
                 'recorder': json.loads(calibration_data.get('recorder_calibration') or '[]'),
@@ -217,31 +424,3 @@ def get_user_calibration_data(user_id):
     except Exception as e:
         logger.error(f"Error retrieving calibration data: {str(e)}")
         return None
-
-def get_dashboard_data(user_id):
-    try:
-        # Fetch user stats
-        user_stats = supabase.table('user_stats').select('*').eq('user_id', user_id).single().execute()
-        
-        # Fetch routines
-        routines = supabase.table('routines').select('*').eq('user_id', user_id).execute()
-        
-        # Fetch recent activities
-        activities = supabase.table('activities').select('*').eq('user_id', user_id).order('created_at', desc=True).limit(10).execute()
-        
-        # Calculate total earnings and tokens generated
-        total_earnings = user_stats.data.get('total_earnings', 0) if user_stats.data else 0
-        total_tokens_generated = user_stats.data.get('total_tokens_generated', 0) if user_stats.data else 0
-        
-        return {
-            'totalEarnings': total_earnings,
-            'totalTokensGenerated': total_tokens_generated,
-            'totalRoutineRuns': user_stats.data.get('total_routine_runs', 0) if user_stats.data else 0,
-            'lastRunDate': user_stats.data.get('last_run_date') if user_stats.data else None,
-            'routines': routines.data,
-            'activities': activities.data if activities else [],
-            'earningsHistory': []  # You might want to implement this if needed
-        }
-    except Exception as e:
-        logging.error(f"Error fetching dashboard data: {str(e)}")
-        raise
\ No newline at end of file
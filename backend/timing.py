@@ -0,0 +1,86 @@
+import time
+import logging
+from collections import deque
+from .config import Config
+from .utils import percentile
+
+logger = logging.getLogger(__name__)
+
+# What to do with an action whose scheduled time has already passed:
+#   catch_up - fire it immediately and keep the recorded timeline (drift never accumulates)
+#   skip     - drop it if it is later than max_lateness, fire it otherwise
+#   shift    - fire it immediately and push the rest of the timeline back by the lateness
+SCHEDULE_POLICIES = ('catch_up', 'skip', 'shift')
+
+class ActionScheduler:
+    def __init__(self, policy=None, max_lateness=None, spin_threshold=None, clock=time.perf_counter, window=None):
+        self.policy = policy or Config.PLAYER_SCHEDULE_POLICY
+        if self.policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"Schedule policy must be one of {SCHEDULE_POLICIES}")
+        self.max_lateness = Config.PLAYER_MAX_LATENESS if max_lateness is None else max_lateness
+        self.spin_threshold = Config.PLAYER_SPIN_THRESHOLD if spin_threshold is None else spin_threshold
+        self.clock = clock
+        self.origin = None
+        self.paused_at = None
+        self.lateness = deque(maxlen=Config.PLAYER_LATENESS_WINDOW if window is None else window)
+        # Totals over the whole run; the percentiles only see the window
+        self.actions = 0
+        self.worst = 0.0
+        self.skipped = 0
+
+    def start(self, offset=0.0):
+        # Anchors action time `offset` to now; statistics keep accumulating across repeat iterations
+        self.origin = self.clock() - offset
+        self.paused_at = None
+
+    def elapsed(self):
+        return self.clock() - self.origin
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = self.clock()
+
+    def resume(self):
+        if self.paused_at is not None:
+            self.origin += self.clock() - self.paused_at
+            self.paused_at = None
+
+    def wait_until(self, action_time, interrupt=None):
+        """Block until action_time (seconds from start); returns False if the action should be skipped.
+
+        If the interrupt event is set during the coarse sleep, returns None straight away so the
+        caller can handle it and wait again.
+        """
+        target = self.origin + action_time
+        remaining = target - self.clock()
+        # Coarse sleep first, then spin through the last stretch the OS scheduler can't hit reliably
+        if remaining > self.spin_threshold:
+            if interrupt is None:
+                time.sleep(remaining - self.spin_threshold)
+            elif interrupt.wait(remaining - self.spin_threshold):
+                return None
+        while self.clock() < target:
+            pass
+
+        lateness = self.clock() - target
+        if self.policy == 'skip' and lateness > self.max_lateness:
+            self.skipped += 1
+            logger.debug(f"Skipping action at {action_time:.3f}s, {lateness * 1000:.1f}ms late")
+            return False
+        if self.policy == 'shift' and lateness > self.max_lateness:
+            self.origin += lateness
+        self.lateness.append(lateness)
+        self.actions += 1
+        self.worst = max(self.worst, lateness)
+        return True
+
+    def stats(self):
+        lateness = sorted(self.lateness)
+        return {
+            'policy': self.policy,
+            'actions': self.actions,
+            'skipped': self.skipped,
+            'lateness_p50_ms': round(percentile(lateness, 0.5) * 1000, 3),
+            'lateness_p99_ms': round(percentile(lateness, 0.99) * 1000, 3),
+            'lateness_max_ms': round(self.worst * 1000, 3),
+        }
@@ -0,0 +1,157 @@
+"""Startup-phase tracing: where the time before a run's first action goes.
+
+Every recording, playback and playlist run carries a StartupTrace. Tasks, the session pool,
+launch_browser, Player.start and Recorder.start wrap each phase in a span (Celery task pickup,
+session lease, Chrome launch, navigation, fullscreen, overlay injection, signal setup, ...), and
+the player marks its first action. Traces are kept in Redis per run and in a capped list per user;
+/api/startup_traces returns them with per-phase percentiles, grouped by the warm-start options in
+effect, so the effect of an option can be read off directly.
+
+    ready_ms                 trace start until the run waits for its start signal or input
+    time_to_first_action_ms  trace start until the first click, minus the wait for the start signal
+
+The trace starts when the task was enqueued if the message carried a timestamp, so task pickup is
+part of both numbers.
+"""
+import json
+import time
+import logging
+from contextlib import contextmanager
+from .config import Config
+from .redis_client import redis_client
+from .utils import percentile
+
+logger = logging.getLogger(__name__)
+
+def trace_key(run_id):
+    return f"startup_trace:{run_id}"
+
+def user_traces_key(user_id):
+    return f"startup_traces:{user_id}"
+
+def warm_start_options():
+    return {
+        'session_pool': Config.SESSION_POOL_ENABLED,
+        'preload_page': Config.BROWSER_PRELOAD_PAGE,
+        'disk_cache': bool(Config.CHROME_DISK_CACHE_DIR),
+    }
+
+class StartupTrace:
+    def __init__(self, user_id=None, kind='playback', routine_name=None, run_id=None, enqueued_at=None):
+        self.user_id = str(user_id) if user_id else None
+        self.kind = kind
+        self.routine_name = routine_name
+        self.run_id = run_id
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+        self.marks = {}
+        self.options = warm_start_options()
+        if enqueued_at:
+            # Wall clocks of the producer and this worker; a negative gap means skew, not pickup
+            pickup = max(self.started_at - float(enqueued_at), 0.0)
+            self._origin -= pickup
+            self.spans.append({'name': 'task_pickup', 'start_ms': 0.0, 'duration_ms': round(pickup * 1000, 3)})
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self._origin) * 1000, 3)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.spans.append({
+                'name': name,
+                'start_ms': round((start - self._origin) * 1000, 3),
+                'duration_ms': round((end - start) * 1000, 3),
+            })
+
+    def mark(self, name):
+        # First occurrence wins, so marking inside a loop is harmless
+        if name not in self.marks:
+            self.marks[name] = self.elapsed_ms()
+
+    def phase_ms(self, name):
+        return sum(span['duration_ms'] for span in self.spans if span['name'] == name)
+
+    def to_dict(self):
+        first_action = self.marks.get('first_action')
+        return {
+            'run_id': self.run_id,
+            'user_id': self.user_id,
+            'kind': self.kind,
+            'routine_name': self.routine_name,
+            'started_at': self.started_at,
+            'options': self.options,
+            'spans': self.spans,
+            'marks': self.marks,
+            'ready_ms': self.marks.get('ready'),
+            'time_to_first_action_ms': round(first_action - self.phase_ms('wait_for_start'), 3) if first_action is not None else None,
+        }
+
+    def save(self):
+        """Store the trace for this run and append it to the user's history; never raises."""
+        if not self.run_id or not self.user_id:
+            return
+        payload = json.dumps(self.to_dict())
+        try:
+            pipe = redis_client.pipeline()
+            pipe.set(trace_key(self.run_id), payload, ex=Config.STARTUP_TRACE_TTL)
+            pipe.lpush(user_traces_key(self.user_id), payload)
+            pipe.ltrim(user_traces_key(self.user_id), 0, Config.STARTUP_TRACE_HISTORY - 1)
+            pipe.expire(user_traces_key(self.user_id), Config.STARTUP_TRACE_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to store startup trace for run {self.run_id}: {str(e)}")
+        logger.info(f"Startup trace for {self.kind} {self.routine_name}: ready {self.marks.get('ready')}ms, "
+                    f"phases {[(span['name'], span['duration_ms']) for span in self.spans]}")
+
+def load_trace(run_id):
+    data = redis_client.get(trace_key(run_id))
+    return json.loads(data) if data else None
+
+def recent_traces(user_id, kind=None, routine_name=None, limit=50):
+    traces = [json.loads(data) for data in redis_client.lrange(user_traces_key(user_id), 0, Config.STARTUP_TRACE_HISTORY - 1)]
+    if kind:
+        traces = [trace for trace in traces if trace['kind'] == kind]
+    if routine_name:
+        traces = [trace for trace in traces if trace['routine_name'] == routine_name]
+    return traces[:limit]
+
+def _distribution(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.5),
+        'p95_ms': percentile(values, 0.95),
+        'max_ms': values[-1] if values else 0.0,
+    }
+
+def summarize(traces):
+    """Per-phase percentiles, one group per combination of warm-start options."""
+    groups = {}
+    for trace in traces:
+        key = json.dumps(trace.get('options', {}), sort_keys=True)
+        groups.setdefault(key, []).append(trace)
+
+    summary = []
+    for key, group in groups.items():
+        phases = {}
+        for trace in group:
+            totals = {}
+            for span in trace['spans']:
+                totals[span['name']] = totals.get(span['name'], 0.0) + span['duration_ms']
+            for name, duration in totals.items():
+                phases.setdefault(name, []).append(duration)
+        summary.append({
+            'options': json.loads(key),
+            'runs': len(group),
+            'phases': {name: _distribution(durations) for name, durations in phases.items()},
+            'ready_ms': _distribution([trace['ready_ms'] for trace in group if trace.get('ready_ms') is not None]),
+            'time_to_first_action_ms': _distribution([trace['time_to_first_action_ms'] for trace in group
+                                                      if trace.get('time_to_first_action_ms') is not None]),
+        })
+    return summary
@@ -1,7 +1,18 @@
+from datetime import datetime, timezone
+
 def sanitize_data(data):
     if isinstance(data, dict):
         return {k: sanitize_data(v) for k, v in data.items() if k not in ['text']}
     elif isinstance(data, list):
         return [sanitize_data(item) for item in data]
     else:
-        return data
\ No newline at end of file
+        return data
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted sequence
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+def utcnow():
+    return datetime.now(timezone.utc).isoformat()
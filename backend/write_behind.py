@@ -0,0 +1,272 @@
+"""Write-behind pipeline for activity rows and user_stats counters.
+
+Tasks enqueue events in Redis (one RPUSH / HINCRBYFLOAT each) and return immediately; a flusher
+thread in the worker bulk-inserts activities and applies aggregated stats on an interval.
+
+Delivery is at-least-once: queued activities are only trimmed after the insert succeeds, and a
+stats snapshot is only deleted after it has been applied, so a crash mid-flush can repeat a
+write but never drop one.
+"""
+import json
+import logging
+import threading
+from collections import deque
+from redis.exceptions import LockNotOwnedError
+from .config import Config
+from .redis_client import redis_client
+from .repository import activities, user_stats
+from .dashboard import invalidate_dashboard
+from .utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_QUEUE_KEY = 'writebehind:activities'
+ACTIVITY_DEAD_LETTER_KEY = 'writebehind:activities:dead'
+FLUSH_LOCK_KEY = 'writebehind:flush_lock'
+_STATS_PREFIX = 'writebehind:stats:'
+_STATS_FLUSHING_PREFIX = 'writebehind:stats_flushing:'
+
+# Hash fields: 'incr:<column>' accumulates increments, 'set:<column>' keeps the latest value
+_INCREMENT = 'incr:'
+_ASSIGN = 'set:'
+
+# Trims the flushed batch off the queue and dead-letters its rejected rows, but only while the
+# flush lock still carries our token: a flusher whose lock expired mid-batch leaves the queue alone
+_TRIM_IF_OWNER = redis_client.register_script("""
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+for i = 3, #ARGV do
+    redis.call('rpush', KEYS[3], ARGV[i])
+end
+redis.call('ltrim', KEYS[2], tonumber(ARGV[2]), -1)
+return 1
+""")
+
+# Events Redis refused (e.g. while it restarts); pushed again on the next flush
+_unsent = deque()
+_unsent_lock = threading.Lock()
+
+def stats_key(user_id):
+    return f"{_STATS_PREFIX}{user_id}"
+
+def stats_flushing_key(user_id):
+    return f"{_STATS_FLUSHING_PREFIX}{user_id}"
+
+def _remember_unsent(operation):
+    with _unsent_lock:
+        _unsent.append(operation)
+
+def record_activity(user_id, action_type, details=None):
+    """Queue an activities row; the timestamp is taken now, not when the row is flushed."""
+    row = {
+        'user_id': str(user_id),
+        'action_type': action_type,
+        'details': json.dumps(details or {}),
+        'created_at': utcnow(),
+    }
+    try:
+        redis_client.rpush(ACTIVITY_QUEUE_KEY, json.dumps(row))
+    except Exception as e:
+        logger.warning(f"Could not queue activity {action_type}, keeping it in memory: {str(e)}")
+        _remember_unsent(('activity', row))
+
+def record_stats(user_id, increments=None, values=None):
+    """Queue user_stats changes: numeric increments add up until flushed, values overwrite."""
+    fields = {}
+    for column, amount in (increments or {}).items():
+        fields[_INCREMENT + column] = amount
+    for column, value in (values or {}).items():
+        fields[_ASSIGN + column] = json.dumps(value)
+    try:
+        _push_stats(str(user_id), fields)
+    except Exception as e:
+        logger.warning(f"Could not queue stats for user {user_id}, keeping them in memory: {str(e)}")
+        _remember_unsent(('stats', (str(user_id), fields)))
+
+def _push_stats(user_id, fields):
+    key = stats_key(user_id)
+    pipe = redis_client.pipeline()
+    for field, value in fields.items():
+        if field.startswith(_INCREMENT):
+            pipe.hincrbyfloat(key, field, value)
+        else:
+            pipe.hset(key, field, value)
+    pipe.execute()
+
+def _push_unsent():
+    while True:
+        with _unsent_lock:
+            if not _unsent:
+                return
+            kind, payload = _unsent[0]
+        if kind == 'activity':
+            redis_client.rpush(ACTIVITY_QUEUE_KEY, json.dumps(payload))
+        else:
+            _push_stats(*payload)
+        with _unsent_lock:
+            _unsent.popleft()
+
+def _insert_activities(rows):
+    """Bulk insert; on failure retry row by row so one bad row can't wedge the queue."""
+    try:
+        activities.insert_many(rows)
+        return rows, []
+    except Exception as e:
+        if len(rows) == 1:
+            raise
+        logger.warning(f"Bulk activity insert failed, retrying row by row: {str(e)}")
+    inserted, rejected = [], []
+    for row in rows:
+        try:
+            activities.insert_many([row])
+            inserted.append(row)
+        except Exception as e:
+            logger.error(f"Activity insert failed: {str(e)}")
+            rejected.append(row)
+    if not inserted:
+        # Nothing got through: the database is unreachable rather than the rows being bad
+        raise RuntimeError("Activity inserts failed for the whole batch")
+    return inserted, rejected
+
+def flush_activities(lock, batch_size=None):
+    batch_size = batch_size or Config.WRITE_BEHIND_BATCH_SIZE
+    flushed = 0
+    users = set()
+    while True:
+        # A long backlog must not outlive the lock; raises LockNotOwnedError once it has
+        lock.reacquire()
+        raw_rows = redis_client.lrange(ACTIVITY_QUEUE_KEY, 0, batch_size - 1)
+        if not raw_rows:
+            break
+        rows = [json.loads(raw) for raw in raw_rows]
+        inserted, rejected = _insert_activities(rows)
+        # Only the flush lock holder pops from the head, so the first len(raw_rows) are ours as long
+        # as we still hold it; if not, the rows stay queued and are inserted again by the new holder
+        owned = _TRIM_IF_OWNER(keys=[FLUSH_LOCK_KEY, ACTIVITY_QUEUE_KEY, ACTIVITY_DEAD_LETTER_KEY],
+                               args=[lock.local.token, len(raw_rows)] + [json.dumps(row) for row in rejected])
+        if not owned:
+            raise LockNotOwnedError("Write-behind flush lock expired during a batch")
+        flushed += len(inserted)
+        users.update(row['user_id'] for row in inserted)
+        if len(raw_rows) < batch_size:
+            break
+    return flushed, users
+
+def _decode_fields(fields):
+    return {(field.decode() if isinstance(field, bytes) else field): value for field, value in fields.items()}
+
+def _apply_stats(user_id, fields, row):
+    changes = {}
+    for field, value in fields.items():
+        if field.startswith(_INCREMENT):
+            column = field[len(_INCREMENT):]
+            amount = float(value)
+            if amount.is_integer():
+                amount = int(amount)
+            changes[column] = ((row or {}).get(column) or 0) + amount
+        elif field.startswith(_ASSIGN):
+            changes[field[len(_ASSIGN):]] = json.loads(value)
+    if not changes:
+        return
+    if row:
+        user_stats.update(row['id'], changes)
+    else:
+        user_stats.create(user_id, changes)
+
+def flush_stats():
+    # Snapshots left behind by an interrupted flush go first; a user with one waits for the
+    # next flush before their live counters are snapshotted again
+    snapshots = {}
+    for key in list(redis_client.scan_iter(match=f"{_STATS_FLUSHING_PREFIX}*")):
+        snapshots[key.decode()[len(_STATS_FLUSHING_PREFIX):]] = key
+    for key in list(redis_client.scan_iter(match=f"{_STATS_PREFIX}*")):
+        user_id = key.decode()[len(_STATS_PREFIX):]
+        flushing_key = stats_flushing_key(user_id)
+        # RENAME is atomic: increments arriving from now on start a new live hash
+        if user_id in snapshots or not redis_client.renamenx(key, flushing_key):
+            continue
+        snapshots[user_id] = flushing_key
+    if not snapshots:
+        return set()
+
+    fields = {user_id: _decode_fields(redis_client.hgetall(key)) for user_id, key in snapshots.items()}
+    # One read for every user's current row, limited to the counters being incremented
+    columns = {field[len(_INCREMENT):] for user_fields in fields.values() for field in user_fields if field.startswith(_INCREMENT)}
+    rows = user_stats.get_many(list(snapshots), columns=','.join(['id', 'user_id'] + sorted(columns)))
+    for user_id, key in snapshots.items():
+        _apply_stats(user_id, fields[user_id], rows.get(user_id))
+        redis_client.delete(key)
+    return set(snapshots)
+
+def flush():
+    """Drain everything queued so far. Safe to call from any process; one flush runs at a time."""
+    lock = redis_client.lock(FLUSH_LOCK_KEY, timeout=max(60, Config.WRITE_BEHIND_INTERVAL * 10))
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        _push_unsent()
+        flushed, users = flush_activities(lock)
+        lock.reacquire()
+        users |= flush_stats()
+        for user_id in users:
+            invalidate_dashboard(user_id)
+        if flushed:
+            logger.debug(f"Flushed {flushed} activities for {len(users)} users")
+        return flushed
+    except LockNotOwnedError as e:
+        # Another flusher holds the lock now and carries on from where the queue stands
+        logger.warning(f"Stopped flushing: {str(e)}")
+        return 0
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+class WriteBehindFlusher:
+    def __init__(self, interval=None):
+        self.interval = interval or Config.WRITE_BEHIND_INTERVAL
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='write-behind-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                flush()
+            except Exception as e:
+                # Everything stays queued; the next interval retries
+                logger.error(f"Write-behind flush failed: {str(e)}")
+
+    def stop(self, final_flush=True):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+        if final_flush:
+            try:
+                flush()
+            except Exception as e:
+                logger.error(f"Final write-behind flush failed: {str(e)}")
+
+_flusher = None
+
+def start_flusher():
+    global _flusher
+    if _flusher is None:
+        _flusher = WriteBehindFlusher()
+    _flusher.start()
+    return _flusher
+
+def stop_flusher():
+    global _flusher
+    if _flusher is not None:
+        _flusher.stop()
+        _flusher = None
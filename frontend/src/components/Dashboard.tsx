@@ -14,6 +14,7 @@ import { useToast } from "@/hooks/use-toast"
 import { RefreshCw } from "lucide-react"
 import { Calibration } from '@/components/Calibration'
 import { useRecordingStatus } from '@/hooks/useRecordingStatus'
+import { useStatusStream } from '@/hooks/useStatusStream'
 import {
   Dialog,
   DialogContent,
@@ -30,7 +31,8 @@ export function Dashboard() {
   const [currentRecordingTask, setCurrentRecordingTask] = useState<{ id: string, name: string } | null>(null)
   const [isRecording, setIsRecording] = useState(false);
   const [showCalibration, setShowCalibration] = useState(false);
-  const { status: recordingStatus, error: recordingError } = useRecordingStatus(currentRecordingTask?.id || null);
+  const { statuses } = useStatusStream();
+  const { status: recordingStatus, error: recordingError } = useRecordingStatus(statuses, currentRecordingTask);
 
   const fetchDashboardData = useCallback(async () => {
     if (!session || !session.access_token) {
@@ -100,22 +102,6 @@ export function Dashboard() {
         description: "A new window will open. Press 7 to start recording, 8 to stop.",
       })
 
-      // Poll for recording completion
-      const pollInterval = setInterval(async () => {
-        const statusResponse = await fetch(`${API_BASE_URL}/api/recording-status/${data.task_id}`, {
-          headers: {
-            'Authorization': `Bearer ${session.access_token}`,
-          },
-        });
-        const statusData = await statusResponse.json();
-        if (statusData.status === 'completed') {
-          clearInterval(pollInterval);
-          setIsRecording(false);
-          setCurrentRecordingTask(null);
-          refreshDashboardData();  // Refresh dashboard data after recording is completed
-        }
-      }, 5000);  // Poll every 5 seconds
-
     } catch (error) {
       console.error('Error starting recording:', error);
       toast({
@@ -124,7 +110,16 @@ export function Dashboard() {
         variant: "destructive",
       })
     }
-  }, [session, toast, refreshDashboardData]);
+  }, [session, toast]);
+
+  // Completion arrives over the status stream instead of a polling loop
+  useEffect(() => {
+    if (currentRecordingTask && recordingStatus === 'completed') {
+      setIsRecording(false);
+      setCurrentRecordingTask(null);
+      refreshDashboardData();  // Refresh dashboard data after recording is completed
+    }
+  }, [currentRecordingTask, recordingStatus, refreshDashboardData]);
 
   const handleBotToggle = useCallback(async (status: boolean) => {
     try {
@@ -375,6 +370,7 @@ export function Dashboard() {
           onPlaybackRoutine={handlePlaybackRoutine}
           onTranslateToHeadless={handleTranslateToHeadless}
           onDeleteRoutine={handleDeleteRoutine}
+          statuses={statuses}
         />
       </div>
       <div className="flex gap-4">
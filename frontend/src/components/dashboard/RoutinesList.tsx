@@ -1,8 +1,9 @@
-import React, { useState } from 'react'
+import React, { useState, useEffect } from 'react'
 import { Button } from '@/components/ui/button'
 import { useToast } from "@/hooks/use-toast"
 import { API_BASE_URL } from '@/config'
 import { useAuth } from '@/contexts/AuthContext'
+import { RunStatus, FINAL_STATES, statusKey } from '@/hooks/useStatusStream'
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card"
 import { ScrollArea } from "@/components/ui/scroll-area"
 import { Input } from "@/components/ui/input"
@@ -30,6 +31,23 @@ type RoutinesListProps = {
   onPlaybackRoutine: (name: string, repeatIndefinitely: boolean) => void
   onTranslateToHeadless: (name: string) => void
   onDeleteRoutine: (id: string) => void
+  statuses?: Record<string, RunStatus>
+}
+
+type PlaybackState = { isPlaying: boolean, isIndefinite: boolean, taskId?: string }
+
+function describeProgress(status: RunStatus) {
+  if (status.state === 'failed') {
+    return `Failed: ${status.error ?? 'unknown error'}`
+  }
+  if (status.action_index === undefined) {
+    return status.state
+  }
+  const drift = status.drift ? ` · drift p99 ${status.drift.lateness_p99_ms}ms` : ''
+  const timing = status.timing && status.timing.saved_s > 0
+    ? ` · ${status.timing.before.duration_s}s → ${status.timing.after.duration_s}s`
+    : ''
+  return `Action ${status.action_index + 1}/${status.action_count} · loop ${(status.loop ?? 0) + 1}${drift}${timing}`
 }
 
 export function RoutinesList({ 
@@ -39,14 +57,29 @@ export function RoutinesList({
   onRecordRoutine, 
   onPlaybackRoutine, 
   onTranslateToHeadless,
-  onDeleteRoutine
+  onDeleteRoutine,
+  statuses = {}
 }: RoutinesListProps) {
   const [newRoutineName, setNewRoutineName] = useState('')
   const [newTokensPerRun, setNewTokensPerRun] = useState(0)
-  const [playbackStates, setPlaybackStates] = useState<Record<string, { isPlaying: boolean, isIndefinite: boolean }>>({})
+  const [playbackStates, setPlaybackStates] = useState<Record<string, PlaybackState>>({})
   const { toast } = useToast()
   const { session } = useAuth()
 
+  // Playback end is pushed over the status stream instead of polled per routine
+  useEffect(() => {
+    setPlaybackStates(prev => {
+      const finished = Object.keys(prev).filter(name => {
+        const status = statuses[statusKey('playback', name)]
+        return !!status && prev[name].isPlaying && status.task_id === prev[name].taskId && FINAL_STATES.includes(status.state)
+      })
+      if (!finished.length) return prev
+      const next = { ...prev }
+      finished.forEach(name => { next[name] = { isPlaying: false, isIndefinite: false } })
+      return next
+    })
+  }, [statuses])
+
   const handleAddRoutine = () => {
     if (newRoutineName && newTokensPerRun > 0) {
       onAddRoutine({ name: newRoutineName, steps: [], tokens_per_run: newTokensPerRun })
@@ -76,12 +109,9 @@ export function RoutinesList({
       const data = await response.json()
       setPlaybackStates(prev => ({
         ...prev,
-        [name]: { isPlaying: true, isIndefinite: repeatIndefinitely }
+        [name]: { isPlaying: true, isIndefinite: repeatIndefinitely, taskId: data.task_id }
       }))
       onPlaybackRoutine(name, repeatIndefinitely)
-
-      // Start polling for playback status
-      pollPlaybackStatus(name)
     } catch (error) {
       toast({
         title: "Error",
@@ -91,34 +121,6 @@ export function RoutinesList({
     }
   }
 
-  const pollPlaybackStatus = async (name: string) => {
-    const checkStatus = async () => {
-      try {
-        const response = await fetch(`${API_BASE_URL}/playback_status/${name}`, {
-          headers: {
-            'Authorization': `Bearer ${session?.access_token}`,
-          },
-        })
-        if (!response.ok) {
-          throw new Error('Failed to fetch playback status')
-        }
-        const data = await response.json()
-        if (data.status === 'completed' || data.status === 'stopped') {
-          setPlaybackStates(prev => ({
-            ...prev,
-            [name]: { isPlaying: false, isIndefinite: false }
-          }))
-          clearInterval(intervalId)
-        }
-      } catch (error) {
-        console.error('Error checking playback status:', error)
-        clearInterval(intervalId)
-      }
-    }
-
-    const intervalId = setInterval(checkStatus, 5000) // Check every 5 seconds
-  }
-
   const handleStopPlayback = async (name: string) => {
     try {
       const response = await fetch(`${API_BASE_URL}/stop_playback`, {
@@ -194,6 +196,9 @@ export function RoutinesList({
                   <span className="font-semibold">{routine.name}</span>
                   <span className="text-sm text-gray-500">{routine.tokens_per_run} tokens per run</span>
                 </div>
+                {playbackStates[routine.name]?.isPlaying && statuses[statusKey('playback', routine.name)]?.task_id === playbackStates[routine.name]?.taskId && (
+                  <p className="text-sm text-gray-500 mb-2">{describeProgress(statuses[statusKey('playback', routine.name)])}</p>
+                )}
                 <div className="flex flex-wrap gap-2">
                   <Button size="sm" onClick={() => onRecordRoutine(routine.name, routine.tokens_per_run)}>Record</Button>
                   <Button 
@@ -1,43 +1,17 @@
-import { useState, useEffect } from 'react';
-import { useAuth } from '@/contexts/AuthContext';
-import { API_BASE_URL } from '@/config';
+import { RunStatus, statusKey } from '@/hooks/useStatusStream';
 
-export function useRecordingStatus(taskId: string | null) {
-  const [status, setStatus] = useState<string>('in_progress');
-  const [error, setError] = useState<string | null>(null);
-  const { session } = useAuth();
+// Maps the streamed recording state onto the in_progress/completed/failed values the dashboard shows
+export function useRecordingStatus(statuses: Record<string, RunStatus>, task: { id: string, name: string } | null) {
+  const streamed = task ? statuses[statusKey('recording', task.name)] : undefined;
+  // Ignore the snapshot left by an earlier recording of the same routine
+  const current = streamed?.task_id === task?.id ? streamed : undefined;
 
-  useEffect(() => {
-    if (!taskId) return;
+  let status = 'in_progress';
+  if (current?.state === 'completed' || current?.state === 'stopped') {
+    status = 'completed';
+  } else if (current?.state === 'failed') {
+    status = 'failed';
+  }
 
-    const checkStatus = async () => {
-      try {
-        const response = await fetch(`${API_BASE_URL}/api/recording-status/${taskId}`, {
-          headers: {
-            'Authorization': `Bearer ${session?.access_token}`,
-          },
-        });
-        if (!response.ok) {
-          throw new Error('Failed to fetch recording status');
-        }
-        const data = await response.json();
-        setStatus(data.status);
-        setError(null);
-
-        if (data.status !== 'in_progress') {
-          clearInterval(intervalId);
-        }
-      } catch (error) {
-        console.error('Error checking recording status:', error);
-        setError(error instanceof Error ? error.message : 'An error occurred');
-        clearInterval(intervalId);
-      }
-    };
-
-    const intervalId = setInterval(checkStatus, 5000); // Check every 5 seconds
-
-    return () => clearInterval(intervalId);
-  }, [taskId, session]);
-
-  return { status, error };
+  return { status, error: current?.error ?? null };
 }
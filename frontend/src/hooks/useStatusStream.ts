@@ -0,0 +1,84 @@
+import { useState, useEffect } from 'react';
+import { useAuth } from '@/contexts/AuthContext';
+import { API_BASE_URL } from '@/config';
+
+export type RunState = 'started' | 'waiting' | 'playing' | 'paused' | 'recovering' | 'item_finished' | 'completed' | 'stopped' | 'failed';
+
+export type RunStatus = {
+  kind: 'recording' | 'playback' | 'playlist'
+  routine_name: string
+  task_id: string | null
+  state: RunState
+  timestamp: number
+  action_index?: number
+  action_count?: number
+  loop?: number
+  drift?: {
+    lateness_p50_ms: number
+    lateness_p99_ms: number
+    lateness_max_ms: number
+    skipped: number
+  }
+  // Routine duration as recorded and after idle-gap compression
+  timing?: {
+    before: { duration_s: number }
+    after: { duration_s: number }
+    saved_s: number
+    speedup: number | null
+  }
+  // Repeat runs: the latest browser memory sample
+  memory?: {
+    loop: number
+    recycles: number
+    total_rss_mb?: number
+    js_heap_used_mb?: number
+    dom_nodes?: number
+  }
+  // Supervised playback: the browser crashed and restarts after delay_s
+  attempt?: number
+  delay_s?: number
+  // Playlists: the item playing now and the results of the items played so far
+  item?: { index: number; routine_name: string; repeat: number }
+  items?: PlaylistItemResult[]
+  error?: string
+}
+
+export type PlaylistItemResult = {
+  index: number
+  routine_name: string
+  repeat: number
+  passes: number
+  status: 'completed' | 'stopped' | 'failed' | 'skipped'
+  duration_s: number
+  error?: string
+}
+
+export const FINAL_STATES: RunState[] = ['completed', 'stopped', 'failed'];
+
+export const statusKey = (kind: RunStatus['kind'], routineName: string) => `${kind}:${routineName}`;
+
+// One server-sent event stream per user; replaces polling the per-routine status endpoints
+export function useStatusStream() {
+  const [statuses, setStatuses] = useState<Record<string, RunStatus>>({});
+  const [connected, setConnected] = useState(false);
+  const { session } = useAuth();
+
+  useEffect(() => {
+    if (!session?.access_token) return;
+
+    // EventSource cannot send an Authorization header, so the token goes in the query string
+    const source = new EventSource(
+      `${API_BASE_URL}/status/stream?access_token=${encodeURIComponent(session.access_token)}`
+    );
+    source.onopen = () => setConnected(true);
+    source.onerror = () => setConnected(false);  // EventSource reconnects on its own
+    source.onmessage = (event) => {
+      const status: RunStatus = JSON.parse(event.data);
+      setStatuses(prev => ({ ...prev, [statusKey(status.kind, status.routine_name)]: status }));
+    };
+
+    return () => source.close();
+  }, [session?.access_token]);
+
+  return { statuses, connected };
+}